@@ -399,13 +399,6 @@ def saveFile():
     for i in delete_list:
         saved_connections.__delitem__(i)
     
-    try:
-        file = open(file_path, 'w')
-    except:
-        print('unable to write file %s' % file_path, file=sys.stderr)
-        app.quit()
-        return
-        
     xml = QDomDocument()
     p = xml.createElement('RAY-JACKPATCH')
     
@@ -417,8 +410,10 @@ def saveFile():
         
     xml.appendChild(p)
     
-    file.write(xml.toString())
-    file.close()
+    if not ray.writeFileAtomically(file_path, xml.toString(), backup=True):
+        print('unable to write file %s' % file_path, file=sys.stderr)
+        app.quit()
+        return
     
     NSMServer.saveReply()
     
@@ -387,22 +387,13 @@ class Proxy(QObject):
 
         parent_pid = self.process.pid()
 
-        # check in pids if one comes from this ray-proxy
+        # check in pids if one comes from this ray-proxy,
+        # /proc is read once for all pids
         for pid in pids:
             if pid < parent_pid:
                 continue
 
-            ppid = pid
-
-            while ppid != parent_pid and ppid > 1:
-                try:
-                    ppid = int(subprocess.check_output(
-                        ['ps', '-o', 'ppid=', '-p', str(ppid)]))
-                except BaseException:
-                    self.checkWindowEnded()
-                    return
-
-            if ppid == parent_pid:
+            if ray.ProcessTree.findAncestor(pid, (parent_pid,)):
                 # a window appears with a pid child of this ray-proxy,
                 # replyOpen
                 QTimer.singleShot(200, self.checkWindowEnded)
@@ -503,11 +503,7 @@ class BookMarker:
         return xml
     
     def writeXmlFile(self, xml):
-        try:
-            file = open(self.bookmarks_memory, 'w')
-            file.write(xml.toString())
-        except:
-            return
+        ray.writeFileAtomically(self.bookmarks_memory, xml.toString())
     
     def getPickersForXml(self):
         string = ":"
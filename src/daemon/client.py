@@ -1,7 +1,9 @@
 import os
 import shlex
 import shutil
+import signal
 import subprocess
+import time
 
 from liblo import Address
 from PyQt5.QtCore import (QCoreApplication, QProcess,
@@ -11,6 +13,11 @@ from PyQt5.QtXml import QDomDocument
 import ray
 from server_sender import ServerSender
 from daemon_tools  import TemplateRoots, Terminal, RS
+from copy_engine   import isUnfinishedCopy, CopyPriority
+from client_timeouts import ClientTimeouts
+from executable_index import ExecutableIndex
+from client_log    import ClientLog, logFilePath
+from scheduling_policy import SchedulingPolicy
 
 NSM_API_VERSION_MAJOR = 1
 NSM_API_VERSION_MINOR = 0
@@ -30,6 +37,7 @@ class Client(ServerSender):
     #can be directly changed by OSC thread
     gui_visible      = True
     progress         = 0
+    dirty            = -1 #unknown until client sends is_dirty or is_clean
     
     #have to be modified by main thread for security
     addr             = None
@@ -61,9 +69,20 @@ class Client(ServerSender):
     net_daemon_url       = ''
     net_duplicate_state  = -1
     
+    launch_group     = ''
+    launch_priority  = 0
+    
     last_save_time = 0.00
     last_dirty = 0.00
     
+    #times of last launch and last open or save command,
+    #to learn clients latencies
+    launch_time  = 0.00
+    command_time = 0.00
+    
+    #process is leader of its own process group (pgid is pid)
+    process_group = False
+    
     def __init__(self, parent_session):
         ServerSender.__init__(self)
         self.session = parent_session
@@ -81,6 +100,12 @@ class Client(ServerSender):
         self.process.readyReadStandardOutput.connect(self.standardOutput)
         self.process.setProcessEnvironment(process_env)
         
+        #last output lines of client, fetched with /ray/client/get_log
+        self.log = ClientLog()
+        
+        #cpu affinity, nice, io class and cgroup applied at launch
+        self.scheduling = SchedulingPolicy()
+        
         #if client is'n't stopped 2secs after stop, 
         #another stop becames a kill!
         self.stopped_since_long = False
@@ -129,6 +154,14 @@ class Client(ServerSender):
         
         self.net_session_template = ctx.attribute('net_session_template')
         
+        self.launch_group = ctx.attribute('launch_group')
+        
+        launch_priority = ctx.attribute('launch_priority')
+        if launch_priority.lstrip('-').isdigit():
+            self.launch_priority = int(launch_priority)
+        
+        self.scheduling.readXml(ctx)
+        
         if basename(self.executable_path) == 'ray-network':
             if self.arguments:
                 eat_url  = False
@@ -188,6 +221,14 @@ class Client(ServerSender):
             ctx.setAttribute('net_session_template',
                              self.net_session_template)
             
+        if self.launch_group:
+            ctx.setAttribute('launch_group', self.launch_group)
+            
+        if self.launch_priority:
+            ctx.setAttribute('launch_priority', self.launch_priority)
+        
+        self.scheduling.writeXml(ctx)
+            
         
     def setReply(self, errcode, message):
         self._reply_message = message
@@ -257,7 +298,7 @@ class Client(ServerSender):
             self.sendStatusToGui()
         
         if (status == ray.ClientStatus.COPY
-            or self.session.file_copier.isActive(self.client_id)):
+            or self.session.copy_scheduler.isActive(self.client_id)):
                 self.sendGui("/ray/client/status", self.client_id, 
                              ray.ClientStatus.COPY)
     
@@ -296,6 +337,7 @@ class Client(ServerSender):
         self.session.setRenameable(False)
         
         self.last_dirty = 0.00
+        self.dirty      = -1
         
         if self.is_dummy:
             return
@@ -320,34 +362,81 @@ class Client(ServerSender):
         self.running_executable = self.executable_path
         self.running_arguments  = self.arguments
         
-        self.process.start(self.executable_path, arguments)
+        program = self.executable_path
+        self.process_group = False
+        
+        #wrappers are only used if executable exists, else QProcess
+        #would not report the failed start.
+        if ExecutableIndex.instance().which(self.executable_path):
+            wrapper = self.scheduling.wrapperArguments()
+            
+            #with setsid, client and its helper processes are in their own
+            #process group, signals are sent to the whole group.
+            if RS.settings.value('daemon/client_process_groups',
+                                 True, type=bool):
+                setsid = ExecutableIndex.instance().which('setsid')
+                if setsid:
+                    wrapper.insert(0, setsid)
+                    self.process_group = True
+            
+            if wrapper:
+                arguments = wrapper[1:] + [self.executable_path] + arguments
+                program = wrapper[0]
+        
+        self.log.openFile(self.getLogFilePath())
+        
+        self.launch_time = time.time()
+        self.process.start(program, arguments)
         #self.process.start(
             #'konsole', 
             #['--hide-tabbar', '--hide-menubar', '-e', self.executable_path]
                 #+ arguments)
      
+    def signalProcessGroup(self, sig):
+        #returns True if signal has been sent to the process group
+        if not (self.process_group and self.pid):
+            return False
+        
+        try:
+            os.killpg(self.pid, sig)
+        except OSError:
+            return False
+        
+        return True
+    
     def terminate(self):
         if self.isRunning():
-            self.process.terminate()
+            if not self.signalProcessGroup(signal.SIGTERM):
+                self.process.terminate()
         
     def kill(self):
         if self.isRunning():
-            self.process.kill()
+            if not self.signalProcessGroup(signal.SIGKILL):
+                self.process.kill()
             
     def isRunning(self):
         return bool(self.process.state() == 2)
     
+    def getLogFilePath(self):
+        if not self.session.path:
+            return ''
+        
+        return logFilePath(self.session.path, self.client_id)
+    
     def standardError(self):
         standard_error = self.process.readAllStandardError().data()
+        self.log.write(standard_error)
         Terminal.clientMessage(standard_error, self.name, self.client_id)
         
     def standardOutput(self):
         standard_output = self.process.readAllStandardOutput().data()
+        self.log.write(standard_output)
         Terminal.clientMessage(standard_output, self.name, self.client_id)
     
     def processStarted(self):
         self.stopped_since_long = False
         self.pid    = self.process.pid()
+        self.session.clients.reindex(self)
         self.setStatus(ray.ClientStatus.LAUNCH)
         
         #Terminal.message("Process has pid: %i" % self.pid)
@@ -360,10 +449,18 @@ class Client(ServerSender):
     def processFinished(self, exit_code, exit_status):
         self.stopped_timer.stop()
         
+        #last output of client is not lost
+        self.standardError()
+        self.standardOutput()
+        self.log.closeFile()
+        
         if self.pending_command in (ray.Command.KILL, ray.Command.QUIT):
             self.sendGuiMessage(_translate('GUIMSG', 
                                            "%s terminated as planned")
                                     % self.guiMsgStyle())
+            
+            #helper processes left by client
+            self.signalProcessGroup(signal.SIGTERM)
         else:
             self.sendGuiMessage(_translate('GUIMSG',
                                            "%s died unexpectedly.")
@@ -382,6 +479,8 @@ class Client(ServerSender):
         self.active          = False
         self.pid             = 0
         self.addr            = None
+        self.launch_time     = 0.00
+        self.session.clients.reindex(self)
         
         self.session.setRenameable(True)
         
@@ -391,6 +490,7 @@ class Client(ServerSender):
                                 % self.guiMsgStyle())
             self.active     = False
             self.pid        = 0
+            self.session.clients.reindex(self)
             self.setStatus(ray.ClientStatus.STOPPED)
             self.pending_command = ray.Command.NONE
             
@@ -416,14 +516,27 @@ class Client(ServerSender):
                              % self.name)
             self.sendToSelfAddress("/nsm/client/session_is_loaded")
     
-    def save(self):
+    def isClean(self):
+        #client supports :dirty: and told us it has nothing to save
+        return bool(self.active
+                    and self.isCapableOf(':dirty:')
+                    and self.dirty == 0)
+    
+    def save(self, dirty_only=False):
         if self.isRunning():
             if self.active:
-                Terminal.message("Telling %s to save" % self.name)
-                self.sendToSelfAddress("/nsm/client/save")
-                
-                self.pending_command = ray.Command.SAVE
-                self.setStatus(ray.ClientStatus.SAVE)
+                if dirty_only and self.isClean():
+                    Terminal.message("%s is clean, not saved" % self.name)
+                    self.sendGuiMessage(
+                        _translate('GUIMSG', "%s clean, save skipped")
+                        % self.guiMsgStyle())
+                else:
+                    Terminal.message("Telling %s to save" % self.name)
+                    self.sendToSelfAddress("/nsm/client/save")
+                    
+                    self.pending_command = ray.Command.SAVE
+                    self.command_time    = time.time()
+                    self.setStatus(ray.ClientStatus.SAVE)
             
             elif self.isDumbClient():
                 self.setStatus(ray.ClientStatus.NOOP)
@@ -441,7 +554,7 @@ class Client(ServerSender):
             if not self.stopped_timer.isActive():
                 self.stopped_timer.start()
                 
-            self.process.terminate()
+            self.terminate()
     
     def quit(self):
         Terminal.message("Commanding %s to quit" % self.name)
@@ -456,15 +569,22 @@ class Client(ServerSender):
     def switch(self, new_client):
         old_client_id     = self.client_id
         self.client_id    = new_client.client_id
+        self.session.clients.reindex(self)
         self.name         = new_client.name
         self.prefix_mode  = new_client.prefix_mode
         self.project_path = new_client.project_path
         self.label        = new_client.label
         self.icon         = new_client.icon
+        self.launch_group    = new_client.launch_group
+        self.launch_priority = new_client.launch_priority
+        self.scheduling.copy(new_client.scheduling)
         
         jack_client_name    = self.getJackClientName()
         client_project_path = self.getProjectPath()
         
+        #log goes now to the file of the new session
+        self.log.openFile(self.getLogFilePath())
+        
         Terminal.message("Commanding %s to switch \"%s\""
                          % (self.name, client_project_path))
         
@@ -472,6 +592,10 @@ class Client(ServerSender):
                                self.session.name, jack_client_name)
         
         self.pending_command = ray.Command.OPEN
+        self.command_time    = time.time()
+        #dirty state was for the previous project,
+        #client tells its new state once switched
+        self.dirty = -1
         self.setStatus(ray.ClientStatus.SWITCH)
             
         self.sendGui("/ray/client/switch", old_client_id, self.client_id)
@@ -494,8 +618,18 @@ class Client(ServerSender):
                         self.capabilities,
                         int(self.check_last_save))
         
+        if not removed:
+            self.sendGui('/ray/client/scheduling', self.client_id,
+                         *self.scheduling.oscArgs())
+        
         self.sent_to_gui = True
     
+    def updateScheduling(self, args):
+        #applied at next launch
+        self.scheduling.update(*args)
+        self.sendGui('/ray/client/scheduling', self.client_id,
+                     *self.scheduling.oscArgs())
+    
     def updateClientProperties(self, client_data):
         self.client_id       = client_data.client_id
         self.executable_path = client_data.executable_path
@@ -506,6 +640,7 @@ class Client(ServerSender):
         self.icon            = client_data.icon
         self.capabilities    = client_data.capabilities
         self.check_last_save = client_data.check_last_save
+        self.session.clients.reindex(self)
         
         self.sendGuiClientProperties()
     
@@ -574,13 +709,15 @@ class Client(ServerSender):
                                       template_name)
             
             if os.path.exists(template_dir):
-                if os.access(template_dir, os.W_OK):
-                    shutil.rmtree(template_dir)
-                else:
+                if not os.access(template_dir, os.W_OK):
                     #TODO send error
                     return
                 
-            os.makedirs(template_dir)
+                #resume template copy if it has been aborted
+                if not isUnfinishedCopy(template_dir):
+                    shutil.rmtree(template_dir)
+                
+            os.makedirs(template_dir, exist_ok=True)
             
             if self.net_daemon_url:
                 self.net_session_template = template_name
@@ -590,11 +727,15 @@ class Client(ServerSender):
             
             if client_files:
                 self.setStatus(ray.ClientStatus.COPY)
-                fc = self.session.file_copier
-                fc.startClientCopy(self.client_id, client_files, template_dir,
-                                   self.saveAsTemplate_step1,
-                                   self.saveAsTemplateAborted,
-                                   [template_name])
+                #template copy is a background task, it must not slow down
+                #other copies and audio disk access.
+                scheduler = self.session.copy_scheduler
+                scheduler.startClientCopy(self.client_id, client_files,
+                                          template_dir,
+                                          self.saveAsTemplate_step1,
+                                          self.saveAsTemplateAborted,
+                                          [template_name],
+                                          priority=CopyPriority.LOW)
             else:
                 self.saveAsTemplate_step1(template_name)
 
@@ -622,13 +763,10 @@ class Client(ServerSender):
         
         #create client_templates.xml if not exists
         if not os.path.isfile(xml_file):
-            file = open(xml_file, 'w')
-            
             xml = QDomDocument()
             rct = xml.createElement('RAY-CLIENT-TEMPLATES')
             xml.appendChild(rct)
-            file.write(xml.toString())
-            file.close()
+            ray.writeFileAtomically(xml_file, xml.toString())
             del xml
             
         file = open(xml_file, 'r')
@@ -665,9 +803,7 @@ class Client(ServerSender):
             
         content.appendChild(rct)
         
-        file = open(xml_file, 'w')
-        file.write(xml.toString())
-        file.close()
+        ray.writeFileAtomically(xml_file, xml.toString(), backup=True)
     
     def saveAsTemplateAborted(self, template_name):
         self.setStatus(self.status)
@@ -869,10 +1005,17 @@ class Client(ServerSender):
         
         self.capabilities = capabilities
         self.addr         = src_addr
+        self.session.clients.reindex(self)
         self.name         = client_name
         self.active       = True
         self.did_announce = True
         
+        if self.launch_time:
+            ClientTimeouts.instance().record(
+                self.executable_path, 'announce',
+                time.time() - self.launch_time)
+            self.launch_time = 0.00
+        
         if self.executable_path in RS.non_active_clients:
             RS.non_active_clients.remove(self.executable_path)
         
@@ -896,6 +1039,7 @@ class Client(ServerSender):
                   self.session.name, jack_client_name)
         
         self.pending_command = ray.Command.OPEN
+        self.command_time    = time.time()
         
         if self.isCapableOf(":optional-gui:"):
             self.sendGui("/ray/client/has_optional_gui", self.client_id)
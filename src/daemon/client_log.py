@@ -0,0 +1,161 @@
+import os
+import threading
+from collections import deque
+
+from daemon_tools import RS
+from copy_engine import LOGS_DIR
+
+DEFAULT_LINES = 1000
+
+#in kB
+DEFAULT_FILE_SIZE = 1024
+DEFAULT_FILE_COUNT = 3
+
+#longer lines are cut in the ring buffer, not in the log file
+MAX_LINE_LENGTH = 4096
+
+def logFilePath(session_path, client_id):
+    return "%s/%s/%s.log" % (session_path, LOGS_DIR, client_id)
+
+class ClientLog(object):
+    #keeps the last output lines (stdout and stderr) of a client
+    #in a bounded ring buffer, and optionally writes them to a log file
+    #rotated by size. Written by main thread, read by OSC thread.
+
+    #settings are read once, clients output can be written very often
+    _max_lines = None
+    _files_enabled = False
+    _max_file_size = 0
+    _file_count = 1
+
+    @classmethod
+    def readSettings(cls):
+        if cls._max_lines is not None:
+            return
+
+        cls._max_lines = max(1, RS.settings.value('daemon/client_log_lines',
+                                                  DEFAULT_LINES, type=int))
+        cls._files_enabled = RS.settings.value('daemon/client_log_files',
+                                               False, type=bool)
+        cls._max_file_size = RS.settings.value('daemon/client_log_file_size',
+                                               DEFAULT_FILE_SIZE,
+                                               type=int) * 1024
+        cls._file_count = max(1, RS.settings.value(
+            'daemon/client_log_file_count', DEFAULT_FILE_COUNT, type=int))
+
+    def __init__(self):
+        self.readSettings()
+        self._lines = deque(maxlen=self._max_lines)
+        self._partial = b''
+
+        #count of complete lines written since client creation,
+        #number of the last line in the ring buffer
+        self._seq = 0
+
+        self._lock = threading.Lock()
+
+        self._file = None
+        self._file_path = ''
+        self._file_size = 0
+
+    def openFile(self, file_path):
+        self.closeFile()
+
+        if not (file_path and self._files_enabled):
+            return
+
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            self._file = open(file_path, 'ab')
+            self._file_size = self._file.tell()
+        except OSError:
+            self._file = None
+            return
+
+        self._file_path = file_path
+
+    def closeFile(self):
+        if self._file is None:
+            return
+
+        try:
+            self._file.close()
+        except OSError:
+            pass
+
+        self._file = None
+        self._file_path = ''
+
+    def _rotate(self):
+        file_path = self._file_path
+        count = self._file_count
+        self.closeFile()
+
+        #client.log.2 -> client.log.3 ... client.log -> client.log.1
+        try:
+            for i in range(count - 1, 0, -1):
+                old_path = "%s.%i" % (file_path, i)
+                if os.path.exists(old_path):
+                    os.replace(old_path, "%s.%i" % (file_path, i + 1))
+            os.replace(file_path, file_path + '.1')
+        except OSError:
+            pass
+
+        self.openFile(file_path)
+
+    def _writeFile(self, byte_string):
+        try:
+            self._file.write(byte_string)
+            self._file.flush()
+        except OSError:
+            self.closeFile()
+            return
+
+        self._file_size += len(byte_string)
+
+        max_size = self._max_file_size
+        if max_size > 0 and self._file_size >= max_size:
+            self._rotate()
+
+    def write(self, byte_string):
+        if not byte_string:
+            return
+
+        if self._file is not None:
+            self._writeFile(byte_string)
+
+        lines = (self._partial + byte_string).split(b'\n')
+
+        with self._lock:
+            self._partial = lines.pop(-1)[:MAX_LINE_LENGTH]
+
+            for line in lines:
+                self._lines.append(line[:MAX_LINE_LENGTH])
+                self._seq += 1
+
+    def lines(self, count=0):
+        #returns last count lines (all if 0) and number of last line.
+        #Not finished line is added at end.
+        with self._lock:
+            lines = list(self._lines)
+            if self._partial:
+                lines.append(self._partial)
+            seq = self._seq
+
+        if count > 0:
+            lines = lines[-count:]
+
+        return ([l.decode(errors='replace') for l in lines], seq)
+
+    def linesSince(self, since_seq):
+        #returns complete lines written after line number since_seq,
+        #and number of last line, to be used for the next call.
+        with self._lock:
+            count = min(self._seq - since_seq, len(self._lines))
+            if count > 0:
+                lines = list(self._lines)[-count:]
+            else:
+                lines = []
+            seq = self._seq
+
+        return ([l.decode(errors='replace') for l in lines], seq)
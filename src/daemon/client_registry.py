@@ -0,0 +1,141 @@
+class ClientList(list):
+    #clients of a session, in session order, with indexes by client_id,
+    #OSC url and pid. Indexes follow list changes, a client calls
+    #reindex() when its client_id, address or pid changes.
+    #When clients share a key (a stale client with the id of a new one),
+    #the first one in list order owns it, as a linear search would find.
+    #Lookups can be done from OSC thread.
+    def __init__(self, clients=()):
+        list.__init__(self)
+        self._by_id  = {}
+        self._by_url = {}
+        self._by_pid = {}
+
+        #keys under which each client is indexed, by id(client)
+        self._keys = {}
+
+        self.extend(clients)
+
+    @staticmethod
+    def _clientKeys(client):
+        url = client.addr.url if client.addr else ''
+        return (client.client_id, url, client.pid)
+
+    def _indexes(self):
+        return (self._by_id, self._by_url, self._by_pid)
+
+    def _listPosition(self, client):
+        for i, other in enumerate(self):
+            if other is client:
+                return i
+        return len(self)
+
+    def _index(self, client):
+        keys = self._clientKeys(client)
+        self._keys[id(client)] = keys
+
+        for i, key in enumerate(keys):
+            if not key:
+                continue
+
+            index = self._indexes()[i]
+            owner = index.get(key)
+
+            if (owner is None
+                    or not id(owner) in self._keys
+                    or (owner is not client
+                        and self._listPosition(client)
+                                < self._listPosition(owner))):
+                index[key] = client
+
+    def _unindex(self, client):
+        keys = self._keys.pop(id(client), None)
+        if keys is None:
+            return
+
+        for i, key in enumerate(keys):
+            if not key:
+                continue
+
+            index = self._indexes()[i]
+
+            #key may be owned by another client
+            if index.get(key) is not client:
+                continue
+
+            del index[key]
+
+            #key goes to the next client having it
+            for other in self:
+                other_keys = self._keys.get(id(other))
+                if other_keys is not None and other_keys[i] == key:
+                    index[key] = other
+                    break
+
+    def _reindexAll(self):
+        self._by_id.clear()
+        self._by_url.clear()
+        self._by_pid.clear()
+        self._keys.clear()
+
+        for client in self:
+            self._index(client)
+
+    def reindex(self, client):
+        if not id(client) in self._keys:
+            #client is not in session (loading, trashed...)
+            return
+
+        self._unindex(client)
+        self._index(client)
+
+    def byId(self, client_id):
+        return self._by_id.get(client_id)
+
+    def byUrl(self, url):
+        return self._by_url.get(url)
+
+    def byPid(self, pid):
+        if not pid:
+            return None
+        return self._by_pid.get(pid)
+
+    def append(self, client):
+        list.append(self, client)
+        self._index(client)
+
+    def insert(self, i, client):
+        list.insert(self, i, client)
+        self._index(client)
+
+    def extend(self, clients):
+        for client in clients:
+            self.append(client)
+
+    def __iadd__(self, clients):
+        self.extend(clients)
+        return self
+
+    def remove(self, client):
+        list.remove(self, client)
+        self._unindex(client)
+
+    def pop(self, i=-1):
+        client = list.pop(self, i)
+        self._unindex(client)
+        return client
+
+    def clear(self):
+        list.clear(self)
+        self._reindexAll()
+
+    def __delitem__(self, i):
+        list.__delitem__(self, i)
+        self._reindexAll()
+
+    def __setitem__(self, i, value):
+        list.__setitem__(self, i, value)
+        self._reindexAll()
+
+    def __contains__(self, client):
+        return id(client) in self._keys
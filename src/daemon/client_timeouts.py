@@ -0,0 +1,158 @@
+import os
+import threading
+
+from daemon_tools import CommandLineArgs, getAppConfigPath
+
+KINDS = ('announce', 'open', 'save')
+
+#samples kept per executable and kind
+MAX_SAMPLES = 20
+
+#below this count of samples, default timeout is used
+MIN_SAMPLES = 3
+
+PERCENTILE = 0.95
+MARGIN_FACTOR = 1.5
+MARGIN_MS = 1000
+MIN_TIMEOUT_MS = 1000
+
+#learned timeout can't be more than default timeout multiplied by this
+MAX_DEFAULT_FACTOR = 6
+
+instance = None
+
+class ClientTimeouts(object):
+    #announce, open and save latencies of clients, per executable.
+    #Timeouts of the session state machine are extended from them,
+    #so that a slow client doesn't get wrongly marked as non active.
+    #Latencies are persisted in config dir.
+    def __init__(self):
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._modified = False
+
+        global instance
+        instance = self
+
+    @staticmethod
+    def instance():
+        global instance
+
+        if not instance:
+            instance = ClientTimeouts()
+        return instance
+
+    def filePath(self):
+        if CommandLineArgs.config_dir:
+            app_config_path = CommandLineArgs.config_dir
+        else:
+            app_config_path = getAppConfigPath()
+
+        return "%s/client_timeouts" % app_config_path
+
+    def _load(self):
+        #each line is "kind ms,ms,ms executable"
+        self._loaded = True
+
+        try:
+            file = open(self.filePath(), 'r')
+            contents = file.read()
+            file.close()
+        except:
+            return
+
+        for line in contents.split('\n'):
+            elements = line.split(' ', 2)
+            if len(elements) != 3 or not elements[0] in KINDS:
+                continue
+
+            kind, samples_line, executable = elements
+            samples = [int(s) for s in samples_line.split(',') if s.isdigit()]
+            if samples:
+                self._samples[(executable, kind)] = samples[-MAX_SAMPLES:]
+
+    def save(self):
+        with self._lock:
+            if not self._modified:
+                return
+
+            contents = ''
+            for key in sorted(self._samples):
+                executable, kind = key
+                contents += "%s %s %s\n" % (
+                    kind, ','.join([str(s) for s in self._samples[key]]),
+                    executable)
+
+            self._modified = False
+
+        file_path = self.filePath()
+        tmp_path = "%s.tmp" % file_path
+
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            file = open(tmp_path, 'w')
+            file.write(contents)
+            file.close()
+            os.replace(tmp_path, file_path)
+        except:
+            return
+
+    def record(self, executable, kind, latency):
+        #latency is in seconds
+        if not executable or latency < 0:
+            return
+
+        with self._lock:
+            if not self._loaded:
+                self._load()
+
+            samples = self._samples.get((executable, kind))
+            if samples is None:
+                samples = []
+                self._samples[(executable, kind)] = samples
+
+            samples.append(int(latency * 1000))
+            if len(samples) > MAX_SAMPLES:
+                samples.pop(0)
+
+            self._modified = True
+
+    def learnedTimeout(self, executable, kind):
+        #returns learned timeout in ms, 0 if not enough samples
+        with self._lock:
+            if not self._loaded:
+                self._load()
+
+            samples = self._samples.get((executable, kind))
+            if not samples or len(samples) < MIN_SAMPLES:
+                return 0
+
+            samples = sorted(samples)
+
+        index = min(len(samples) - 1, int(len(samples) * PERCENTILE))
+        return max(MIN_TIMEOUT_MS,
+                   int(samples[index] * MARGIN_FACTOR) + MARGIN_MS)
+
+    def timeout(self, executables, kind, default):
+        #timeout in ms to wait for all executables.
+        #default is used for any executable without enough samples.
+        timeout = 0
+
+        for executable in executables:
+            learned = self.learnedTimeout(executable, kind)
+            if not learned:
+                continue
+
+            timeout = max(timeout, min(learned, default * MAX_DEFAULT_FACTOR))
+
+        #learned latencies only extend default timeout. A shorter one
+        #would save nothing, waiting ends once all clients replied.
+        return max(timeout, default)
+
+    def executables(self):
+        with self._lock:
+            if not self._loaded:
+                self._load()
+
+            return sorted(set([key[0] for key in self._samples]))
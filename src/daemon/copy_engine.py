@@ -0,0 +1,623 @@
+import errno
+import fcntl
+import os
+import shutil
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+#smaller chunks when bandwidth is limited, for a smoother disk usage
+LIMITED_CHUNK_SIZE = 1024 * 1024
+
+#ioctl request to share data extents between two files (reflink),
+#supported by btrfs, XFS, bcachefs, OCFS2...
+FICLONE = 0x40049409
+
+#file listing files already copied in a destination folder.
+#It is removed when copy succeeds, so a folder containing it
+#is an unfinished copy that can be resumed.
+MANIFEST_NAME = '.ray-copy-manifest'
+
+#file listing checksums of files copied in verify mode.
+#It is next to raysession.xml for session copies.
+CHECKSUMS_NAME = '.ray-checksums'
+
+#snapshots store of a session, never copied with the session
+SNAPSHOTS_DIR = '.ray-snapshots'
+
+#clients log files of a session, never copied with the session
+LOGS_DIR = '.ray-logs'
+
+#errors meaning kernel side copy is not possible between these two files,
+#in this case we fall back to the next copy method.
+_FALLBACK_ERRNOS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                    errno.EOPNOTSUPP, errno.EBADF, errno.ETXTBSY)
+
+def _lowerThreadPriority():
+    #copy must not disturb audio clients.
+    #On Linux, nice value is a per thread attribute,
+    #so this doesn't affect daemon main thread.
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, 15)
+    except:
+        pass
+
+def isUnfinishedCopy(dir_path):
+    return os.path.isfile("%s/%s" % (dir_path, MANIFEST_NAME))
+
+def readChecksums(dir_path):
+    #returns a dict {relative_path: (size, mtime_ns, crc)}
+    #each line is "crc size mtime_ns relative_path"
+    checksums = {}
+
+    try:
+        checksums_file = open("%s/%s" % (dir_path, CHECKSUMS_NAME), 'r')
+    except OSError:
+        return checksums
+
+    with checksums_file:
+        for line in checksums_file.read().split('\n'):
+            elements = line.split(' ', 3)
+            if len(elements) != 4:
+                continue
+
+            try:
+                checksums[elements[3]] = (int(elements[1]),
+                                          int(elements[2]),
+                                          int(elements[0], 16))
+            except ValueError:
+                continue
+
+    return checksums
+
+def writeChecksums(dir_path, checksums):
+    checksums_path = "%s/%s" % (dir_path, CHECKSUMS_NAME)
+    tmp_path = "%s.tmp" % checksums_path
+
+    with open(tmp_path, 'w') as checksums_file:
+        for rel_path in sorted(checksums):
+            size, mtime_ns, crc = checksums[rel_path]
+            checksums_file.write("%08x %i %i %s\n"
+                                 % (crc, size, mtime_ns, rel_path))
+
+    os.replace(tmp_path, checksums_path)
+
+def _removePaths(paths):
+    for path in paths:
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            elif os.path.lexists(path):
+                os.remove(path)
+        except OSError:
+            continue
+
+def removeInBackground(paths):
+    thread = threading.Thread(target=_removePaths, args=(list(paths),),
+                              daemon=True)
+    thread.start()
+
+def cloneData(orig_fd, dest_fd):
+    #shares data of orig_fd with dest_fd (reflink),
+    #returns False if filesystem refuses it.
+    try:
+        fcntl.ioctl(dest_fd, FICLONE, orig_fd)
+    except OSError:
+        return False
+
+    return True
+
+class CopyPriority:
+    LOW    = 1
+    NORMAL = 2
+    HIGH   = 4
+
+class CopyAborted(Exception):
+    pass
+
+class BandwidthLimiter(object):
+    #shares a global bytes per second budget between running copy jobs.
+    #Each job gets a part of the budget proportional to its priority.
+    #rate 0 means no limit.
+    def __init__(self, rate=0):
+        self.rate  = max(0, rate)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def setRate(self, rate):
+        with self._lock:
+            self.rate = max(0, rate)
+
+    def isLimited(self):
+        return bool(self.rate)
+
+    def register(self, job, priority):
+        with self._lock:
+            #[priority, allowance, last update time]
+            self._jobs[job] = [max(1, priority), 0.0, time.monotonic()]
+
+    def unregister(self, job):
+        with self._lock:
+            self._jobs.pop(job, None)
+
+    def consume(self, job, size):
+        #called after size bytes have been copied by job,
+        #blocks while job has exceeded its part of the budget.
+        while True:
+            with self._lock:
+                if not self.rate or not job in self._jobs:
+                    return
+
+                total_priority = sum([state[0]
+                                      for state in self._jobs.values()])
+                state = self._jobs[job]
+                job_rate = self.rate * state[0] / total_priority
+
+                now = time.monotonic()
+                #allowance can't exceed one second of copy
+                state[1] = min(job_rate,
+                               state[1] + (now - state[2]) * job_rate)
+                state[2] = now
+
+                #allowance can go negative, next copy will wait
+                if state[1] >= 0:
+                    state[1] -= size
+                    return
+
+                wait_time = min(0.1, - state[1] / job_rate)
+
+            if job.isAborted():
+                return
+
+            time.sleep(wait_time)
+
+class CopyJob(object):
+    def __init__(self, copy_pairs, max_workers=4, clone=False,
+                 manifest_dir='', limiter=None, priority=1, checksum_dir=''):
+        #copy_pairs is a list of (orig_path, dest_path) tuples,
+        #orig_path (file or folder) is copied as dest_path as 'cp -R' does.
+        #with clone, files are reflinked when the filesystem allows it.
+        #with manifest_dir, copied files are listed in a manifest there,
+        #and files listed by a previous aborted copy are not copied again.
+        #with limiter, copy speed follows the limiter budget for priority.
+        #with checksum_dir, copy is verified: data is hashed while it is
+        #copied and checksums are written in this folder.
+        self.copy_pairs   = copy_pairs
+        self.max_workers  = max(1, max_workers)
+        self.clone        = clone
+        self.manifest_dir = manifest_dir
+        self.limiter      = limiter
+        self.priority     = priority
+        self.checksum_dir = checksum_dir
+        self.errors       = []
+
+        #files whose copied data doesn't match size or stored checksum
+        self.mismatches = []
+
+        #number of regular files cloned or really copied
+        self.cloned_count = 0
+        self.copied_count = 0
+
+        #total_size is known once source trees have been walked,
+        #copied_size is increased by workers while data is copied.
+        self.total_size  = 0
+        self.copied_size = 0
+
+        self._abort_event   = threading.Event()
+        self._lock          = threading.Lock()
+        self._finished      = False
+        self._walked_size   = 0
+        self._manifest      = {}
+        self._manifest_file = None
+        self._src_checksums  = {}
+        self._dest_checksums = {}
+        self._thread        = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def abort(self):
+        self._abort_event.set()
+
+    def isAborted(self):
+        return self._abort_event.is_set()
+
+    def isFinished(self):
+        return self._finished
+
+    def _addError(self, path, error):
+        with self._lock:
+            self.errors.append("%s: %s" % (path, str(error)))
+
+    def _addCopiedSize(self, size):
+        with self._lock:
+            self.copied_size += size
+
+    def _countFile(self, cloned):
+        with self._lock:
+            if cloned:
+                self.cloned_count += 1
+            else:
+                self.copied_count += 1
+
+    def _manifestPath(self):
+        return "%s/%s" % (self.manifest_dir, MANIFEST_NAME)
+
+    def _openManifest(self):
+        manifest_path = self._manifestPath()
+
+        #each line is "size mtime_ns relative_path" of a finished file
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, 'r') as manifest_file:
+                for line in manifest_file.read().split('\n'):
+                    elements = line.split(' ', 2)
+                    if (len(elements) == 3
+                            and elements[0].isdigit()
+                            and elements[1].isdigit()):
+                        self._manifest[elements[2]] = (int(elements[0]),
+                                                       int(elements[1]))
+
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        self._manifest_file = open(manifest_path, 'a')
+
+    def _closeManifest(self):
+        if self._manifest_file is None:
+            return
+
+        self._manifest_file.close()
+        self._manifest_file = None
+
+        if not (self.isAborted() or self.errors):
+            try:
+                os.remove(self._manifestPath())
+            except OSError:
+                pass
+
+    def _isAlreadyCopied(self, dest_path, size, mtime_ns):
+        if not self._manifest:
+            return False
+
+        rel_path = os.path.relpath(dest_path, self.manifest_dir)
+        if self._manifest.get(rel_path) != (size, mtime_ns):
+            return False
+
+        try:
+            return bool(os.lstat(dest_path).st_size == size)
+        except OSError:
+            return False
+
+    def _recordCopied(self, dest_path, size, mtime_ns, crc=None):
+        if self.checksum_dir and crc is not None:
+            with self._lock:
+                self._dest_checksums[
+                    os.path.relpath(dest_path, self.checksum_dir)] = (
+                        size, mtime_ns, crc)
+
+        if self._manifest_file is None:
+            return
+
+        rel_path = os.path.relpath(dest_path, self.manifest_dir)
+
+        with self._lock:
+            self._manifest_file.write("%i %i %s\n" % (size, mtime_ns, rel_path))
+            self._manifest_file.flush()
+
+    def _loadChecksums(self):
+        #stored checksums of the sources, keyed by path relative to
+        #checksum_dir, same keys as in the destination checksums file.
+        for orig_path, dest_path in self.copy_pairs:
+            if os.path.normpath(dest_path) == os.path.normpath(
+                    self.checksum_dir):
+                src_dir = orig_path
+            else:
+                src_dir = os.path.dirname(orig_path)
+
+            self._src_checksums.update(readChecksums(src_dir))
+
+        self._dest_checksums = readChecksums(self.checksum_dir)
+
+    def _storedChecksum(self, dest_path, size, mtime_ns):
+        src_sum = self._src_checksums.get(
+            os.path.relpath(dest_path, self.checksum_dir))
+
+        if src_sum is None or src_sum[:2] != (size, mtime_ns):
+            return None
+
+        return src_sum[2]
+
+    def _isUnchanged(self, dest_path, size, mtime_ns):
+        #True if destination file has been verified with the same data
+        #as the source file by a previous copy.
+        rel_path = os.path.relpath(dest_path, self.checksum_dir)
+        src_sum = self._src_checksums.get(rel_path)
+
+        if (src_sum is None or src_sum[:2] != (size, mtime_ns)
+                or self._dest_checksums.get(rel_path) != src_sum):
+            return False
+
+        try:
+            dest_stat = os.lstat(dest_path)
+        except OSError:
+            return False
+
+        return bool(dest_stat.st_size == size
+                    and dest_stat.st_mtime_ns == mtime_ns)
+
+    def _checkCopied(self, orig_path, dest_path, size, mtime_ns, copied, crc):
+        if copied != size:
+            with self._lock:
+                self.mismatches.append(
+                    "%s: %i bytes copied, %i expected"
+                    % (dest_path, copied, size))
+            return False
+
+        if crc is None:
+            return True
+
+        #source file has the same stats than when its checksum was stored
+        #but data is different.
+        stored_crc = self._storedChecksum(dest_path, size, mtime_ns)
+
+        if stored_crc is not None and stored_crc != crc:
+            with self._lock:
+                self.mismatches.append(
+                    "%s: checksum %08x doesn't match stored checksum %08x"
+                    % (orig_path, crc, stored_crc))
+            return False
+
+        return True
+
+    def _run(self):
+        folders = []
+        files = []
+
+        if self.limiter:
+            self.limiter.register(self, self.priority)
+
+        try:
+            if self.manifest_dir:
+                self._openManifest()
+
+            if self.checksum_dir:
+                self._loadChecksums()
+
+            for orig_path, dest_path in self.copy_pairs:
+                if self.isAborted():
+                    break
+
+                self._walk(orig_path, dest_path, folders, files)
+
+            self.total_size = self._walked_size
+
+            with ThreadPoolExecutor(max_workers=self.max_workers,
+                                    initializer=_lowerThreadPriority) \
+                    as executor:
+                for file_args in files:
+                    if self.isAborted():
+                        break
+
+                    executor.submit(self._copyEntry, *file_args)
+
+            #folders mtimes are changed while their contents are copied,
+            #so their stats are copied at end, deepest first.
+            if not self.isAborted():
+                for orig_dir, dest_dir in reversed(folders):
+                    try:
+                        shutil.copystat(orig_dir, dest_dir)
+                    except OSError as e:
+                        self._addError(dest_dir, e)
+        except BaseException as e:
+            self._addError('', e)
+
+        try:
+            self._closeManifest()
+        except OSError as e:
+            self._addError(self._manifestPath(), e)
+
+        if self.checksum_dir:
+            try:
+                writeChecksums(self.checksum_dir, self._dest_checksums)
+            except OSError as e:
+                self._addError(self.checksum_dir, e)
+
+        if self.limiter:
+            self.limiter.unregister(self)
+
+        self._finished = True
+
+    def _addFile(self, orig_path, dest_path, orig_stat, files):
+        size = orig_stat.st_size
+        self._walked_size += size
+
+        if (self._isAlreadyCopied(dest_path, size, orig_stat.st_mtime_ns)
+                or (self.checksum_dir
+                    and self._isUnchanged(dest_path, size,
+                                          orig_stat.st_mtime_ns))):
+            self._addCopiedSize(size)
+            return
+
+        files.append((orig_path, dest_path, size, orig_stat.st_mtime_ns))
+
+    def _walk(self, orig_path, dest_path, folders, files):
+        #single scandir walk, used to size the copy and to create folders.
+        if not os.path.isdir(orig_path) or os.path.islink(orig_path):
+            try:
+                self._addFile(orig_path, dest_path,
+                              os.lstat(orig_path), files)
+            except OSError as e:
+                self._addError(orig_path, e)
+            return
+
+        to_scan = [(orig_path, dest_path)]
+
+        while to_scan:
+            if self.isAborted():
+                return
+
+            orig_dir, dest_dir = to_scan.pop()
+
+            try:
+                os.makedirs(dest_dir, exist_ok=True)
+                entries = list(os.scandir(orig_dir))
+            except OSError as e:
+                self._addError(orig_dir, e)
+                continue
+
+            folders.append((orig_dir, dest_dir))
+
+            for entry in entries:
+                #daemon files are only at root of the copied folder,
+                #client files may have the same names deeper.
+                if (orig_dir == orig_path
+                        and entry.name in (MANIFEST_NAME, CHECKSUMS_NAME,
+                                           SNAPSHOTS_DIR, LOGS_DIR)):
+                    continue
+
+                dest_entry = "%s/%s" % (dest_dir, entry.name)
+
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        to_scan.append((entry.path, dest_entry))
+                        continue
+
+                    self._addFile(entry.path, dest_entry,
+                                  entry.stat(follow_symlinks=False), files)
+                except OSError as e:
+                    self._addError(entry.path, e)
+
+    def _copyEntry(self, orig_path, dest_path, size, mtime_ns):
+        if self.isAborted():
+            return
+
+        try:
+            if os.path.islink(orig_path):
+                if os.path.lexists(dest_path):
+                    os.remove(dest_path)
+                os.symlink(os.readlink(orig_path), dest_path)
+                shutil.copystat(orig_path, dest_path, follow_symlinks=False)
+                self._addCopiedSize(size)
+                crc = None
+            else:
+                copied, crc = self._copyFile(orig_path, dest_path)
+                shutil.copystat(orig_path, dest_path)
+
+                if self.checksum_dir:
+                    orig_stat = os.stat(orig_path)
+
+                    if (orig_stat.st_size != size
+                            or orig_stat.st_mtime_ns != mtime_ns):
+                        #source has been written while copied (a live file),
+                        #copy is what has been read, not a corruption.
+                        #Its checksum is not stored, data read may be
+                        #older than the last source write.
+                        size = copied
+                        mtime_ns = orig_stat.st_mtime_ns
+                        crc = None
+
+                    if not self._checkCopied(orig_path, dest_path,
+                                             size, mtime_ns, copied, crc):
+                        #mismatch is already reported
+                        raise CopyAborted
+
+                    if crc is None:
+                        #file has been cloned, data has not been read
+                        crc = self._storedChecksum(dest_path, size, mtime_ns)
+        except (CopyAborted, OSError) as e:
+            #never keep a partial or corrupted file
+            try:
+                os.remove(dest_path)
+            except OSError:
+                pass
+
+            if not isinstance(e, CopyAborted):
+                self._addError(orig_path, e)
+            return
+
+        self._recordCopied(dest_path, size, mtime_ns, crc)
+
+    def _copyFile(self, orig_path, dest_path):
+        #returns copied size and data checksum,
+        #checksum is None if data has not been read.
+        with open(orig_path, 'rb') as orig_file:
+            orig_stat = os.fstat(orig_file.fileno())
+
+            with open(dest_path, 'wb') as dest_file:
+                os.fchmod(dest_file.fileno(), orig_stat.st_mode & 0o7777)
+
+                if (self.clone
+                        and self._cloneData(orig_file.fileno(),
+                                            dest_file.fileno())):
+                    self._addCopiedSize(orig_stat.st_size)
+                    self._countFile(True)
+                    return orig_stat.st_size, None
+
+                copied, crc = self._copyData(orig_file.fileno(),
+                                             dest_file.fileno())
+                self._countFile(False)
+                return copied, crc
+
+    def _cloneData(self, orig_fd, dest_fd):
+        #returns False if filesystem refuses the reflink,
+        #file will then be normally copied.
+        return cloneData(orig_fd, dest_fd)
+
+    def _copyData(self, orig_fd, dest_fd):
+        #in verify mode, data must pass through the daemon to be hashed
+        verify = bool(self.checksum_dir)
+        crc = 0
+
+        methods = []
+        if hasattr(os, 'copy_file_range') and not verify:
+            methods.append('copy_file_range')
+        if hasattr(os, 'sendfile') and not verify:
+            methods.append('sendfile')
+        methods.append('read_write')
+
+        chunk_size = CHUNK_SIZE
+        if self.limiter and self.limiter.isLimited():
+            chunk_size = LIMITED_CHUNK_SIZE
+
+        method_index = 0
+        offset = 0
+
+        while True:
+            if self.isAborted():
+                raise CopyAborted
+
+            method = methods[method_index]
+
+            try:
+                if method == 'copy_file_range':
+                    copied = os.copy_file_range(orig_fd, dest_fd, chunk_size)
+                elif method == 'sendfile':
+                    copied = os.sendfile(dest_fd, orig_fd, offset, chunk_size)
+                else:
+                    os.lseek(orig_fd, offset, os.SEEK_SET)
+                    data = memoryview(os.read(orig_fd, chunk_size))
+                    copied = len(data)
+                    if verify:
+                        crc = zlib.crc32(data, crc)
+                    while data:
+                        data = data[os.write(dest_fd, data):]
+            except OSError as e:
+                #kernel side copy is refused for these files,
+                #try the next method if nothing has been copied yet.
+                if (offset == 0 and e.errno in _FALLBACK_ERRNOS
+                        and method_index + 1 < len(methods)):
+                    method_index += 1
+                    continue
+                raise
+
+            if not copied:
+                break
+
+            offset += copied
+            self._addCopiedSize(copied)
+
+            if self.limiter:
+                self.limiter.consume(self, copied)
+
+        return offset, (crc if verify else None)
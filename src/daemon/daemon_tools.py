@@ -1,6 +1,7 @@
 import argparse
 import os
 import sys
+import time
 from PyQt5.QtCore import QCoreApplication, QStandardPaths, QSettings
 
 import ray
@@ -68,6 +69,14 @@ class TemplateRoots:
 class Terminal:
     _last_client_name = ''
     
+    #clients output relayed to daemon stderr is limited to
+    #'daemon/client_output_rate' kB/s, last output lines of each client
+    #can still be read with /ray/client/get_log.
+    _output_rate = None
+    _output_budget = 0.0
+    _output_time = 0.0
+    _output_dropped = 0
+    
     @classmethod
     def message(cls, string):
         if cls._last_client_name and cls._last_client_name != 'daemon':
@@ -78,11 +87,49 @@ class Terminal:
         
         cls._last_client_name = 'daemon'
 
+    @classmethod
+    def outputRate(cls):
+        if cls._output_rate is None:
+            cls._output_rate = max(
+                0, RS.settings.value('daemon/client_output_rate', 64,
+                                     type=int)) * 1024
+        return cls._output_rate
+    
+    @classmethod
+    def _outputAllowed(cls, size):
+        rate = cls.outputRate()
+        if not rate:
+            return True
+        
+        #budget refills at rate, up to one second of output.
+        #A big chunk is shown if budget remains, then budget is in debt.
+        now = time.monotonic()
+        cls._output_budget = min(
+            rate, cls._output_budget + (now - cls._output_time) * rate)
+        cls._output_time = now
+        
+        if cls._output_budget <= 0:
+            cls._output_dropped += size
+            return False
+        
+        cls._output_budget -= size
+        
+        if cls._output_dropped:
+            sys.stderr.write(
+                '\n[\033[90mray-daemon\033[0m]%i bytes of clients output '
+                'not shown, use /ray/client/get_log to read it\n'
+                    % cls._output_dropped)
+            cls._output_dropped = 0
+            cls._last_client_name = 'daemon'
+        
+        return True
+    
     @classmethod
     def clientMessage(cls, byte_string, client_name, client_id):
         client_str = "%s.%s" % (client_name, client_id)
         
-        if not CommandLineArgs.debug_only:
+        if (not CommandLineArgs.debug_only
+                and cls._outputAllowed(len(byte_string))):
             if cls._last_client_name != client_str:
                 sys.stderr.write('\n[\033[90m%s-%s\033[0m]\n'
                                     % (client_name, client_id))
@@ -4,6 +4,8 @@ import os
 import subprocess
 import sys
 
+import ray
+
 class WindowProperties(object):
     id      = ""
     desktop = 0
@@ -45,17 +47,7 @@ class DesktopsMemory(object):
             self.non_daemon_pids.append(pid)
             return False
         
-        ppid = pid
-        
-        while ppid > daemon_pid and ppid > 1:
-            try:
-                ppid = int(subprocess.check_output(['ps', '-o', 'ppid=',
-                                                    '-p', str(ppid)]))
-            except:
-                self.non_daemon_pids.append(pid)
-                return False
-            
-        if ppid == daemon_pid:
+        if ray.ProcessTree.isDescendantOf(pid, daemon_pid):
             self.daemon_pids.append(pid)
             return True
         
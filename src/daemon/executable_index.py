@@ -0,0 +1,108 @@
+import os
+import threading
+
+instance = None
+
+class ExecutableIndex(object):
+    #executables found in $PATH, kept in memory.
+    #A PATH directory is listed again only when its mtime changed,
+    #so checking index validity costs one stat per PATH directory.
+    def __init__(self):
+        self._dirs = {}
+        self._lock = threading.Lock()
+
+        global instance
+        instance = self
+
+    @staticmethod
+    def instance():
+        global instance
+
+        if not instance:
+            instance = ExecutableIndex()
+        return instance
+
+    def _pathDirs(self):
+        path_dirs = []
+
+        for path_dir in os.getenv('PATH', '').split(':'):
+            if path_dir and not path_dir in path_dirs:
+                path_dirs.append(path_dir)
+
+        return path_dirs
+
+    def _scanDir(self, path_dir):
+        #returns executables of path_dir as a list and as a set,
+        #path_dir is listed again only if it changed.
+        try:
+            mtime_ns = os.stat(path_dir).st_mtime_ns
+        except OSError:
+            self._dirs.pop(path_dir, None)
+            return [], set()
+
+        cached = self._dirs.get(path_dir)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1], cached[2]
+
+        executables = []
+
+        try:
+            with os.scandir(path_dir) as entries:
+                for entry in entries:
+                    try:
+                        if (entry.is_file()
+                                and os.access(entry.path, os.X_OK)):
+                            executables.append(entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            executables = []
+
+        executables_set = set(executables)
+        self._dirs[path_dir] = (mtime_ns, executables, executables_set)
+        return executables, executables_set
+
+    def pathState(self):
+        #returns a key which changes when an executable may have been
+        #added or removed in $PATH, to invalidate results based on it.
+        path_state = []
+
+        for path_dir in self._pathDirs():
+            try:
+                path_state.append((path_dir, os.stat(path_dir).st_mtime_ns))
+            except OSError:
+                path_state.append((path_dir, 0))
+
+        return tuple(path_state)
+
+    def executables(self):
+        #all executables names, without duplicates, in $PATH order
+        exec_list = []
+        exec_set = set()
+
+        with self._lock:
+            for path_dir in self._pathDirs():
+                for exe in self._scanDir(path_dir)[0]:
+                    if not exe in exec_set:
+                        exec_set.add(exe)
+                        exec_list.append(exe)
+
+        return exec_list
+
+    def which(self, executable):
+        #same as shutil.which, served from the index
+        if not executable:
+            return None
+
+        if '/' in executable:
+            if (os.path.isfile(executable)
+                    and os.access(executable, os.X_OK)):
+                return executable
+            return None
+
+        with self._lock:
+            for path_dir in self._pathDirs():
+                if executable in self._scanDir(path_dir)[1]:
+                    return "%s/%s" % (path_dir, executable)
+
+        return None
@@ -1,77 +1,94 @@
 import os
-import subprocess
-from PyQt5.QtCore import QProcess, QTimer
+from PyQt5.QtCore import QTimer
 from osc_server_thread import OscServerThread
 from server_sender import ServerSender
+from copy_engine import (CopyJob, CopyPriority, BandwidthLimiter,
+                         removeInBackground)
+from daemon_tools import RS, Terminal
 import ray
 
+#operations refused while a client copy runs, they copy, move or restore
+#session folder (so copied client folders), or leave the session
+#the copied client belongs to.
+CLIENT_COPY_CONFLICTS = ('/ray/server/new_session',
+                         '/ray/server/new_from_template',
+                         '/ray/server/open_session',
+                         '/ray/session/take_snapshot',
+                         '/ray/session/restore_snapshot',
+                         '/ray/session/save_as_template',
+                         '/ray/session/close',
+                         '/ray/session/duplicate',
+                         '/ray/session/rename',
+                         '/ray/session/add_client_template')
+
 class CopyFile(object):
     slots = ['orig_path',
              'dest_path',
-             'state',
-             'size']
+             'state']
 
 class FileCopier(ServerSender):
-    def __init__(self, session):
+    def __init__(self, scheduler, client_id=''):
         ServerSender.__init__(self)
-        self.session        = session
-        self.client_id      = ''
+        self.scheduler      = scheduler
+        self.session        = scheduler.session
+        self.client_id      = client_id
+        self.priority       = CopyPriority.NORMAL
         self.next_function  = None
         self.abort_function = None
         self.next_args      = []
         self.copy_files     = []
         self.copy_size      = 0
+        self.last_sent_size = 0
+        self.dest_dir       = ''
+        self.resumable      = True
         self.aborted        = False
+        self.discard        = False
         self.is_active      = False
         
-        self.process = QProcess()
-        self.process.finished.connect(self.processFinished)
-        if ray.QT_VERSION >= (5, 6):
-            self.process.errorOccurred.connect(self.errorOccurred)
+        self.copy_job = None
         
         self.timer = QTimer()
         self.timer.setInterval(250)
         self.timer.setSingleShot(True)
         self.timer.timeout.connect(self.checkProgressSize)
         
-    def informCopytoGui(self, copy_state):
-        server = OscServerThread.getInstance()
-        if not server:
-            return
+    def message(self, string):
+        if self.client_id:
+            Terminal.message("%s: %s" % (self.client_id, string))
+        else:
+            Terminal.message(string)
         
-        server.informCopytoGui(copy_state)
+        self.sendGuiMessage(string)
     
-    def getFileSize(self, filepath):
-        if not os.path.exists(filepath):
-            return 0
-        
-        try:
-            du_full = subprocess.check_output(
-                ['nice', '-n', '15', 'du', '-sb', filepath]).decode()
-        except:
-            du_full = ""
-            
-        if not du_full:
-            return 0
-        
-        du_str = du_full.split('\t')[0]
-        if not du_str.isdigit():
-            return 0
+    def reportMismatches(self, mismatches):
+        for mismatch in mismatches:
+            Terminal.warning("copy verify failed: %s" % mismatch)
         
-        return int(du_str)
+        error_message = "%i copied files are corrupted or incomplete:\n%s" \
+                            % (len(mismatches), '\n'.join(mismatches))
         
+        if self.client_id:
+            self.sendGui('/error', ray.Err.COPY_CORRUPTED, error_message)
+        else:
+            self.session.oscReply('/error', self.session.osc_path,
+                                  ray.Err.COPY_CORRUPTED, error_message)
+            self.sendGuiMessage(error_message)
+    
     def checkProgressSize(self):
-        current_size = 0
         self.timer.stop()
         
-        for copy_file in self.copy_files:
-            if copy_file.state == 2:
-                current_size += copy_file.size
-            elif copy_file.state == 1:
-                current_size += self.getFileSize(copy_file.dest_path)
-                break
+        if self.copy_job.isFinished():
+            self.copyFinished()
+            return
+        
+        #sizes are counted by the copy job itself,
+        #total size is known once source trees have been walked.
+        current_size = self.copy_job.copied_size
+        self.copy_size = self.copy_job.total_size
 
-        if current_size and self.copy_size:
+        if (current_size and self.copy_size
+                and current_size != self.last_sent_size):
+            self.last_sent_size = current_size
             progress = float(current_size/self.copy_size)
             
             if self.client_id:
@@ -83,71 +100,93 @@ class FileCopier(ServerSender):
         
         self.timer.start()
     
-    def processFinished(self, exit_code, exit_status):
+    def copyFinished(self):
         self.timer.stop()
         
+        for error in self.copy_job.errors:
+            Terminal.warning("copy error: %s" % error)
+        
+        if self.copy_job.clone:
+            self.message("%i files cloned, %i files copied"
+                         % (self.copy_job.cloned_count,
+                            self.copy_job.copied_count))
+        
+        if self.copy_job.mismatches:
+            self.reportMismatches(self.copy_job.mismatches)
+            
+            #a copy that doesn't verify can't be used,
+            #operation is aborted and created files are removed
+            self.aborted = True
+            self.discard = True
+        
+        self.copy_job = None
+        
         for copy_file in self.copy_files:
             if copy_file.state == 1:
                 copy_file.state = 2
-                break
         
         if self.aborted:
-            ##remove all created files
-            for copy_file in self.copy_files:
-                if copy_file.state > 0:
-                    file_to_remove = copy_file.dest_path
-                    
-                    if os.path.exists(file_to_remove):
-                        try:
-                            subprocess.run(['rm', '-R', file_to_remove]) 
-                        except:
-                            pass
+            if self.resumable and not self.discard:
+                #finished files are kept and listed in copy manifest,
+                #copy job already removed partial files.
+                self.message("Copy aborted, it can be resumed later")
+            else:
+                ##remove all created files
+                removeInBackground(
+                    [copy_file.dest_path for copy_file in self.copy_files
+                     if copy_file.state > 0])
                         
             self.is_active = False
-            self.informCopytoGui(False)
+            self.scheduler.informCopytoGui()
             self.abort_function(*self.next_args)
             return
         
-        #run next_function if copy is terminated
-        for copy_file in self.copy_files:
-            if copy_file.state != 2:
-                break
-        else:
-            self.is_active = False
-            self.informCopytoGui(False)
-            
-            if self.next_function:
-                self.next_function(*self.next_args)
-                
-            return
-        
-        self.nextProcess()
+        self.is_active = False
+        self.scheduler.informCopytoGui()
         
-    def errorOccurred(self):
-        #todo make something else
-        self.processFinished(0, 0)
+        if self.next_function:
+            self.next_function(*self.next_args)
         
-    def nextProcess(self):
+    def startCopyJob(self):
         self.is_active = True
         
+        copy_pairs = []
+        
         for copy_file in self.copy_files:
-            if copy_file.state == 0:
-                copy_file.state = 1
-                self.process.start('nice' , 
-                                   ['-n', '+15', 'cp', '-R', 
-                                    copy_file.orig_path, copy_file.dest_path])
-                break
-            
+            copy_file.state = 1
+            copy_pairs.append((copy_file.orig_path, copy_file.dest_path))
+        
+        server = self.getServer()
+        clone = bool(server and server.option_clone_copy)
+        
+        manifest_dir = self.dest_dir if self.resumable else ''
+        checksum_dir = ''
+        if server and server.option_verify_copy:
+            checksum_dir = self.dest_dir
+        
+        self.copy_job = CopyJob(
+            copy_pairs,
+            RS.settings.value('daemon/copy_workers', 4, type=int),
+            clone, manifest_dir, self.scheduler.limiter, self.priority,
+            checksum_dir)
+        self.copy_job.start()
+        
         self.timer.start()
     
     def start(self, src_list, dest_dir, next_function,
-              abort_function, next_args=[]):
+              abort_function, next_args=[], copy_into=True, resumable=True,
+              priority=CopyPriority.NORMAL):
+        self.priority       = priority
         self.abort_function = abort_function
         self.next_function  = next_function
         self.next_args      = next_args
+        self.dest_dir       = dest_dir
+        self.resumable      = resumable
         
         self.aborted = False
+        self.discard = False
         self.copy_size = 0
+        self.last_sent_size = 0
         self.copy_files.clear()
         
         dest_path_exists = bool(os.path.exists(dest_dir))
@@ -161,11 +200,10 @@ class FileCopier(ServerSender):
             copy_file = CopyFile()
             copy_file.state     = 0
             copy_file.orig_path = orig_path
-            copy_file.size      = self.getFileSize(orig_path)
-            
-            self.copy_size+=copy_file.size
             
-            if dest_path_exists:
+            if not copy_into:
+                copy_file.dest_path = dest_dir
+            elif dest_path_exists:
                 copy_file.dest_path = "%s/%s" % (dest_dir,
                                                  os.path.basename(orig_path))
             else:
@@ -176,36 +214,146 @@ class FileCopier(ServerSender):
         
         
         if self.copy_files:
-            self.informCopytoGui(True)
-            self.nextProcess()
+            self.startCopyJob()
+            self.scheduler.informCopytoGui()
         else:
             self.next_function(*self.next_args)
         
+    def abort(self, abort_function=None, next_args=[], discard=False):
+        #with discard, all copied files are removed,
+        #else finished files are kept to resume the copy later.
+        if abort_function:
+            self.abort_function = abort_function
+            self.next_args = next_args
+        
+        #copy job may be finished and not checked yet,
+        #it is considered as aborted anyway.
+        if self.is_active:
+            self.aborted = True
+            self.discard = discard
+            self.copy_job.abort()
+            
+    def isActive(self):
+        return self.is_active
+
+class CopyScheduler(ServerSender):
+    #runs copy jobs at the same time, one per client and one for session.
+    #All jobs share the bandwidth budget of the limiter.
+    def __init__(self, session):
+        ServerSender.__init__(self)
+        self.session = session
+        self.copiers = {}
+        
+        self.limiter = BandwidthLimiter(
+            RS.settings.value('daemon/copy_bandwidth', 0, type=int) * 1024)
+        
+        self.abort_function = None
+        self.abort_args     = []
+        self.aborting       = []
+        
+        self.last_copying_state = False
+    
+    def getCopier(self, client_id=''):
+        #client_id is empty for the session copier
+        if not client_id in self.copiers:
+            self.copiers[client_id] = FileCopier(self, client_id)
+        
+        return self.copiers[client_id]
+    
+    def activeCopiers(self, client_id=None):
+        return [copier for copier in self.copiers.values()
+                if copier.isActive()
+                   and (client_id is None or copier.client_id == client_id)]
+    
+    def setBandwidth(self, kbytes_per_second):
+        #0 means no limit
+        self.limiter.setRate(kbytes_per_second * 1024)
+    
+    def informCopytoGui(self):
+        copying = self.isActive()
+        if copying == self.last_copying_state:
+            return
+        
+        self.last_copying_state = copying
+        
+        server = OscServerThread.getInstance()
+        if not server:
+            return
+        
+        server.informCopytoGui(copying)
+    
     def startClientCopy(self, client_id, src_list, dest_dir, next_function,
-                        abort_function, next_args=[]):
-        self.client_id = client_id
-        self.start(src_list, dest_dir, next_function,
-                   abort_function, next_args)
+                        abort_function, next_args=[], resumable=True,
+                        priority=CopyPriority.NORMAL):
+        copier = self.getCopier(client_id)
+        if copier.isActive():
+            #should not happen, callers check it before
+            abort_function(*next_args)
+            return
+        
+        copier.start(src_list, dest_dir, next_function,
+                     abort_function, next_args, resumable=resumable,
+                     priority=priority)
         
     def startSessionCopy(self, src_dir, dest_dir, next_function,
-                         abort_function, next_args=[]):
-        self.client_id = ''
-        self.start([src_dir], dest_dir, next_function,
-                   abort_function, next_args)
+                         abort_function, next_args=[],
+                         priority=CopyPriority.HIGH):
+        copier = self.getCopier()
+        if copier.isActive():
+            abort_function(*next_args)
+            return
+        
+        copier.start([src_dir], dest_dir, next_function,
+                     abort_function, next_args, copy_into=False,
+                     priority=priority)
+    
+    def copierAborted(self, copier):
+        if copier in self.aborting:
+            self.aborting.remove(copier)
+        
+        if self.aborting or not self.abort_function:
+            return
+        
+        abort_function = self.abort_function
+        self.abort_function = None
+        abort_function(*self.abort_args)
+    
+    def abort(self, abort_function=None, next_args=[], client_id=None,
+              discard=False):
+        #abort all copies, or only the client_id one if given.
+        #with abort_function, it is called once when all aborted copies
+        #are finished, instead of the abort functions of the copies.
+        copiers = self.activeCopiers(client_id)
         
-    def abort(self, abort_function=None, next_args=[]):
         if abort_function:
             self.abort_function = abort_function
-            self.next_args = next_args
-        
-        self.timer.stop()
-        if self.process.state() == QProcess.Running:
-            self.aborted = True
-            self.process.terminate()
+            self.abort_args     = next_args
+            self.aborting       = copiers[:]
             
-    def isActive(self, client_id=''):
-        if client_id and client_id != self.client_id:
+            if not copiers:
+                self.copierAborted(None)
+                return
+            
+            for copier in copiers:
+                copier.abort(self.copierAborted, [copier], discard)
+            return
+        
+        for copier in copiers:
+            copier.abort(discard=discard)
+    
+    def isActive(self, client_id=None):
+        #with client_id, only checks copy of this client,
+        #empty client_id is for session copy.
+        return bool(self.activeCopiers(client_id))
+    
+    def conflictsWith(self, osc_path):
+        #session copy prevents any session operation,
+        #client copies only prevent operations working on session folder.
+        if self.isActive(''):
+            return True
+        
+        if not self.isActive():
             return False
         
-        return self.is_active
+        return bool(osc_path in CLIENT_COPY_CONFLICTS)
  
@@ -0,0 +1,55 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, pyqtSignal
+
+import ray
+
+instance = None
+
+class FileWriter(QObject):
+    #writes files atomically in a worker thread, so main thread
+    #(and OSC handling) doesn't wait for a slow disk or NFS session root.
+    #Contents have to be serialized in main thread before.
+    #Only one worker, so writes are done in the order they were asked.
+    written = pyqtSignal(int, bool)
+
+    def __init__(self):
+        QObject.__init__(self)
+        self._callbacks = {}
+        self._last_job = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        self.written.connect(self.writeFinished)
+
+        global instance
+        instance = self
+
+    @staticmethod
+    def instance():
+        global instance
+
+        if not instance:
+            instance = FileWriter()
+        return instance
+
+    def _write(self, job, file_path, contents, backup):
+        success = ray.writeFileAtomically(file_path, contents, backup)
+        self.written.emit(job, success)
+
+    def write(self, file_path, contents, callback=None, args=[],
+              backup=False):
+        #calls callback(success, *args) in main thread once file is written
+        with self._lock:
+            self._last_job += 1
+            job = self._last_job
+
+        if callback is not None:
+            self._callbacks[job] = (callback, args)
+
+        self._executor.submit(self._write, job, file_path, contents, backup)
+
+    def writeFinished(self, job, success):
+        if job in self._callbacks:
+            callback, args = self._callbacks.pop(job)
+            callback(success, *args)
@@ -0,0 +1,363 @@
+import os
+import struct
+import time
+from PyQt5.QtCore import QTimer
+
+from daemon_tools import RS
+from executable_index import ExecutableIndex
+
+#a client is considered as launched after this delay,
+#even if it didn't bind any port (wrapper scripts...)
+LAUNCH_TIMEOUT = 1.0
+
+#old staggering delay, for clients which won't bind any OSC port
+#(known non active clients, binaries not linked to liblo)
+DUMB_LAUNCH_TIMEOUT = 0.1
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+DT_NEEDED = 1
+DT_STRTAB = 5
+
+#{binary_path: (mtime_ns, links_liblo)}
+_liblo_cache = {}
+
+CHECK_INTERVAL = 20
+
+DEFAULT_CONCURRENCY = 4
+
+def _udpInodes():
+    #returns inodes of all bound UDP sockets of the system
+    inodes = set()
+
+    for proc_file in ('/proc/net/udp', '/proc/net/udp6'):
+        try:
+            file = open(proc_file, 'r')
+            lines = file.read().split('\n')[1:]
+            file.close()
+        except:
+            continue
+
+        for line in lines:
+            elements = line.split()
+            if len(elements) >= 10:
+                inodes.add(elements[9])
+
+    return inodes
+
+def hasBoundUdpPort(pid, udp_inodes=None):
+    #True if process pid owns at least one bound UDP socket.
+    #liblo binds its port before client sends its announce.
+    #udp_inodes can be given to read /proc/net/udp once for many pids.
+    if not pid:
+        return False
+
+    socket_inodes = set()
+    fd_dir = "/proc/%i/fd" % pid
+
+    try:
+        fds = os.listdir(fd_dir)
+    except OSError:
+        return False
+
+    for fd in fds:
+        try:
+            link = os.readlink("%s/%s" % (fd_dir, fd))
+        except OSError:
+            continue
+
+        if link.startswith('socket:['):
+            socket_inodes.add(link[8:-1])
+
+    if not socket_inodes:
+        return False
+
+    if udp_inodes is None:
+        udp_inodes = _udpInodes()
+
+    return bool(socket_inodes & udp_inodes)
+
+def _elfNeededLibs(file):
+    #returns names of libraries an ELF binary is linked to,
+    #None if file is not an ELF binary (scripts...)
+    ident = file.read(16)
+    if len(ident) < 16 or ident[:4] != b'\x7fELF':
+        return None
+
+    is_64 = bool(ident[4] == 2)
+    endian = '<' if ident[5] == 1 else '>'
+
+    if is_64:
+        file.seek(0x20)
+        phoff, = struct.unpack(endian + 'Q', file.read(8))
+        file.seek(0x36)
+        phentsize, phnum = struct.unpack(endian + 'HH', file.read(4))
+    else:
+        file.seek(0x1C)
+        phoff, = struct.unpack(endian + 'I', file.read(4))
+        file.seek(0x2A)
+        phentsize, phnum = struct.unpack(endian + 'HH', file.read(4))
+
+    loads = []
+    dynamic = None
+
+    for i in range(phnum):
+        file.seek(phoff + i * phentsize)
+        if is_64:
+            p_type, p_flags, p_offset, p_vaddr, p_paddr, p_filesz = \
+                struct.unpack(endian + 'IIQQQQ', file.read(40))
+        else:
+            p_type, p_offset, p_vaddr, p_paddr, p_filesz = \
+                struct.unpack(endian + 'IIIII', file.read(20))
+
+        if p_type == PT_LOAD:
+            loads.append((p_vaddr, p_offset, p_filesz))
+        elif p_type == PT_DYNAMIC:
+            dynamic = (p_offset, p_filesz)
+
+    if dynamic is None:
+        #static binary
+        return []
+
+    entry_format = endian + ('qQ' if is_64 else 'iI')
+    entry_size = struct.calcsize(entry_format)
+
+    file.seek(dynamic[0])
+    data = file.read(dynamic[1])
+
+    needed_offsets = []
+    strtab = None
+
+    for i in range(0, len(data) - entry_size + 1, entry_size):
+        tag, value = struct.unpack_from(entry_format, data, i)
+        if tag == 0:
+            break
+        if tag == DT_NEEDED:
+            needed_offsets.append(value)
+        elif tag == DT_STRTAB:
+            strtab = value
+
+    if strtab is None:
+        return []
+
+    #string table address is a virtual address
+    strtab_offset = None
+    for p_vaddr, p_offset, p_filesz in loads:
+        if p_vaddr <= strtab < p_vaddr + p_filesz:
+            strtab_offset = strtab - p_vaddr + p_offset
+            break
+
+    if strtab_offset is None:
+        return []
+
+    libs = []
+    for needed_offset in needed_offsets:
+        file.seek(strtab_offset + needed_offset)
+        libs.append(file.read(256).split(b'\0', 1)[0].decode(
+            errors='replace'))
+
+    return libs
+
+def linksLiblo(executable):
+    #False if executable is a binary not linked to liblo, so it won't
+    #bind any port. Scripts may use liblo, True is returned for them.
+    path = ExecutableIndex.instance().which(executable)
+    if not path:
+        return False
+
+    try:
+        binary_path = os.path.realpath(path)
+        mtime_ns = os.stat(binary_path).st_mtime_ns
+    except OSError:
+        return False
+
+    cached = _liblo_cache.get(binary_path)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+
+    try:
+        with open(binary_path, 'rb') as file:
+            libs = _elfNeededLibs(file)
+    except (OSError, struct.error):
+        libs = None
+
+    if libs is None:
+        links_liblo = True
+    else:
+        links_liblo = bool([l for l in libs if l.startswith('liblo.so')])
+
+    _liblo_cache[binary_path] = (mtime_ns, links_liblo)
+    return links_liblo
+
+def closeWaves(clients):
+    #returns lists of clients to quit one after the other.
+    #Clients of a launch group are quit in reverse launch order,
+    #groups in parallel. Clients without group are in the first wave.
+    waves = [[]]
+    groups = {}
+
+    for client in clients:
+        if client.launch_group:
+            if not client.launch_group in groups:
+                groups[client.launch_group] = []
+            groups[client.launch_group].append(client)
+        else:
+            waves[0].append(client)
+
+    for group_clients in groups.values():
+        group_clients.sort(key=lambda c: - c.launch_priority)
+        group_clients.reverse()
+
+        for i in range(len(group_clients)):
+            if i >= len(waves):
+                waves.append([])
+            waves[i].append(group_clients[i])
+
+    return waves
+
+class LaunchQueue(object):
+    #clients of one launch group, launched one after the other.
+    #Clients without launch group share the default queue.
+    __slots__ = ['clients',
+                 'current',
+                 'launch_time',
+                 'launch_timeout']
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.current = None
+        self.launch_time = 0.0
+        self.launch_timeout = LAUNCH_TIMEOUT
+
+class LaunchScheduler(object):
+    #replaces the old 100ms staggering of clients launch.
+    #liblo derives its port numbers from the system time, so clients of
+    #a same queue are launched only once previous one bound its port
+    #(or announced, or died, or its launch timeout is reached).
+    #Clients without launch group are all in the default queue,
+    #only explicit launch groups are launched in parallel,
+    #up to 'daemon/launch_concurrency' clients launching at once.
+    def __init__(self, session):
+        self.session = session
+        self.queues = []
+        self.groups = {}
+        self.default_queue = None
+
+        self.timer = QTimer()
+        self.timer.setInterval(CHECK_INTERVAL)
+        self.timer.timeout.connect(self.check)
+
+    def concurrency(self):
+        return max(1, RS.settings.value('daemon/launch_concurrency',
+                                        DEFAULT_CONCURRENCY, type=int))
+
+    def _queueFor(self, client):
+        if not client.launch_group:
+            if self.default_queue is None:
+                self.default_queue = LaunchQueue([])
+                self.queues.append(self.default_queue)
+            return self.default_queue
+
+        if not client.launch_group in self.groups:
+            queue = LaunchQueue([])
+            self.groups[client.launch_group] = queue
+            self.queues.append(queue)
+        return self.groups[client.launch_group]
+
+    def launch(self, clients):
+        for client in clients:
+            self._queueFor(client).clients.append(client)
+
+        #in a group, higher priority first, then session order
+        for queue in self.queues:
+            queue.clients.sort(key=lambda c: - c.launch_priority)
+
+        #groups whose first client has higher priority get slots first
+        self.queues.sort(key=lambda q: - q.clients[0].launch_priority
+                                       if q.clients else 0)
+
+        self.check()
+
+    def clear(self):
+        self.queues.clear()
+        self.groups.clear()
+        self.default_queue = None
+        self.timer.stop()
+
+    def isLaunching(self):
+        return bool(self.queues)
+
+    def launchTimeout(self, client):
+        if (client.executable_path in RS.non_active_clients
+                or not linksLiblo(client.executable_path)):
+            return DUMB_LAUNCH_TIMEOUT
+        return LAUNCH_TIMEOUT
+
+    def isLaunched(self, client, launch_time, launch_timeout, udp_inodes):
+        if client.active:
+            return True
+
+        if client.process.state() == 0:
+            #process failed to start or already finished
+            return True
+
+        if time.time() - launch_time >= launch_timeout:
+            return True
+
+        return hasBoundUdpPort(client.pid, udp_inodes)
+
+    def check(self):
+        launching = 0
+
+        #/proc/net/udp is read once per check for all launching clients
+        udp_inodes = None
+        for queue in self.queues:
+            if queue.current is not None:
+                udp_inodes = _udpInodes()
+                break
+
+        for queue in self.queues:
+            if queue.current is not None:
+                if self.isLaunched(queue.current, queue.launch_time,
+                                   queue.launch_timeout, udp_inodes):
+                    queue.current = None
+                else:
+                    launching += 1
+
+        max_launching = self.concurrency()
+
+        for queue in self.queues:
+            if launching >= max_launching:
+                break
+
+            if queue.current is not None:
+                continue
+
+            while queue.clients:
+                client = queue.clients.pop(0)
+
+                #client may have been removed since
+                if client in self.session.clients and not client.isRunning():
+                    client.start()
+                    queue.current = client
+                    queue.launch_time = time.time()
+                    queue.launch_timeout = self.launchTimeout(client)
+                    launching += 1
+                    self.session.clientLaunched(client)
+                    break
+
+        self.queues = [q for q in self.queues
+                       if q.clients or q.current is not None]
+
+        if not self.default_queue in self.queues:
+            self.default_queue = None
+
+        for group, queue in list(self.groups.items()):
+            if not queue in self.queues:
+                del self.groups[group]
+
+        if self.queues:
+            if not self.timer.isActive():
+                self.timer.start()
+        else:
+            self.timer.stop()
@@ -5,12 +5,17 @@ import shutil
 import subprocess
 import time
 from liblo import ServerThread, Address, make_method, Message
-from PyQt5.QtXml import QDomDocument
 
 #from shared import *
 import ray
 from signaler import Signaler
 from multi_daemon_file import MultiDaemonFile
+from executable_index import ExecutableIndex
+from template_catalog import ClientTemplateCatalog
+from version_prober import VersionProber, versionIsEnough
+from client_timeouts import ClientTimeouts
+from prefetcher import SessionPrefetcher
+from copy_engine import isUnfinishedCopy
 from daemon_tools import TemplateRoots, CommandLineArgs, Terminal, RS
 
 instance = None
@@ -226,6 +231,14 @@ class OscServerThread(ClientCommunicating):
             'daemon/bookmark_session_folder', True, type=bool)
         self.option_desktops_memory  = RS.settings.value(
             'daemon/desktops_memory', False, type=bool)
+        self.option_clone_copy       = RS.settings.value(
+            'daemon/clone_copy', False, type=bool)
+        self.option_verify_copy      = RS.settings.value(
+            'daemon/verify_copy', False, type=bool)
+        self.option_auto_snapshot    = RS.settings.value(
+            'daemon/auto_snapshot', False, type=bool)
+        self.option_copy_bandwidth   = RS.settings.value(
+            'daemon/copy_bandwidth', 0, type=int)
         
         self.option_has_wmctrl = bool(shutil.which('wmctrl'))
         if not self.option_has_wmctrl:
@@ -322,6 +335,12 @@ class OscServerThread(ClientCommunicating):
         
         signaler.copy_aborted.emit()
     
+    @make_method('/ray/client/abort_copy', 's')
+    def rayClientAbortCopy(self, path, args):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        signaler.client_copy_aborted.emit(args[0])
+    
     @make_method('/ray/server/change_root', 's')
     def rayServerChangeRoot(self, path, args, types, src_addr):
         ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
@@ -340,29 +359,47 @@ class OscServerThread(ClientCommunicating):
     def rayServerListPath(self, path, args, types, src_addr):
         ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
         
-        exec_list = []
         tmp_exec_list = []
         
-        pathlist = os.getenv('PATH').split(':')
-        for path in pathlist:
-            if os.path.isdir(path):
-                listexe = os.listdir(path)
-                for exe in listexe:
-                    fullexe = path + '/' + exe
-                    
-                    if (os.path.isfile(fullexe)
-                            and os.access(fullexe, os.X_OK)
-                            and not exe in exec_list):
-                        exec_list.append(exe)
-                        tmp_exec_list.append(exe)
-                        
-                        if len(tmp_exec_list) == 100:
-                            self.send(src_addr, '/reply_path', *tmp_exec_list)
-                            tmp_exec_list.clear()
+        for exe in ExecutableIndex.instance().executables():
+            tmp_exec_list.append(exe)
+            
+            if len(tmp_exec_list) == 100:
+                self.send(src_addr, '/reply_path', *tmp_exec_list)
+                tmp_exec_list.clear()
         
         if tmp_exec_list:
             self.send(src_addr, '/reply_path', *tmp_exec_list)
             
+    @make_method('/ray/server/list_client_timeouts', '')
+    def rayServerListClientTimeouts(self, path, args, types, src_addr):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        #one message per executable with learned announce, open and save
+        #timeouts in ms, 0 means not enough samples, default is used.
+        client_timeouts = ClientTimeouts.instance()
+        
+        for executable in client_timeouts.executables():
+            self.send(src_addr, '/reply_client_timeouts', executable,
+                      client_timeouts.learnedTimeout(executable, 'announce'),
+                      client_timeouts.learnedTimeout(executable, 'open'),
+                      client_timeouts.learnedTimeout(executable, 'save'))
+        
+        self.send(src_addr, '/reply', path, 'Client timeouts listed.')
+    
+    @make_method('/ray/server/save_from_client_stats', '')
+    def rayServerSaveFromClientStats(self, path, args, types, src_addr):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        #counts of save requests from clients, of saves done, of requests
+        #merged in a pending save, and of saves delayed by an operation.
+        save_coalescer = self.session.save_coalescer
+        
+        self.send(src_addr, '/reply_save_from_client_stats',
+                  save_coalescer.requests, save_coalescer.saves,
+                  save_coalescer.merged, save_coalescer.deferred)
+        self.send(src_addr, '/reply', path, 'Save from client stats sent.')
+    
     @make_method('/ray/server/list_session_templates', '')
     def rayServerListSessionTemplates(self, path, args, types, src_addr):
         ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
@@ -374,7 +411,11 @@ class OscServerThread(ClientCommunicating):
         
         all_files = os.listdir(TemplateRoots.user_sessions)
         for file in all_files:
-            if os.path.isdir("%s/%s" % (TemplateRoots.user_sessions, file)):
+            template_path = "%s/%s" % (TemplateRoots.user_sessions, file)
+            
+            #an aborted template copy is not a usable template
+            if (os.path.isdir(template_path)
+                    and not isUnfinishedCopy(template_path)):
                 template_list.append(file)
                 
                 if len(template_list) == 100:
@@ -407,6 +448,47 @@ class OscServerThread(ClientCommunicating):
         
         signaler.server_list_sessions.emit(src_addr, with_net)
     
+    @make_method('/ray/server/list_sessions_page', 'iss')
+    def rayServerListSessionsPage(self, path, args, types, src_addr):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        page_size, sort_key, cursor = args
+        
+        signaler.server_list_sessions_page.emit(src_addr, page_size,
+                                                sort_key, cursor)
+    
+    @make_method('/ray/server/plan_open', 's')
+    def rayServerPlanOpen(self, path, args, types, src_addr):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        if not pathIsValid(args[0]):
+            self.send(src_addr, "/error", path, ray.Err.NO_SUCH_FILE,
+                      "Invalid session name.")
+            return
+        
+        signaler.server_plan_open.emit(path, args, src_addr)
+    
+    @make_method('/ray/server/prefetch_session', 's')
+    def rayServerPrefetchSession(self, path, args, types, src_addr):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        #session is selected in open dialog,
+        #its files can be read ahead in case it is opened.
+        session_full_name = args[0]
+        
+        if not pathIsValid(session_full_name):
+            return
+        
+        if session_full_name.startswith('/'):
+            spath = session_full_name
+        else:
+            spath = "%s/%s" % (self.session.root, session_full_name)
+        
+        if spath == self.session.path:
+            return
+        
+        SessionPrefetcher.instance().prefetch(spath)
+    
     @make_method('/ray/server/new_session', 's')
     def nsmServerNew(self, path, args, types, src_addr):
         ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
@@ -490,6 +572,66 @@ class OscServerThread(ClientCommunicating):
         
         signaler.server_save.emit(path, args, src_addr)
     
+    @make_method('/ray/session/save_dirty', '')
+    def rayServerSaveDirty(self, path, args, types, src_addr):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        #save only clients with unsaved changes
+        #(or not capable of telling it)
+        if self.isOperationPending(src_addr, path):
+            return
+        
+        if not self.session.path:
+            self.send(src_addr, "/error", path, ray.Err.NO_SESSION_OPEN,
+                      "No session to save.")
+            return
+        
+        signaler.server_save_dirty.emit(path, args, src_addr)
+    
+    @make_method('/ray/session/take_snapshot', 's')
+    def rayServerTakeSnapshot(self, path, args, types, src_addr):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        if self.isOperationPending(src_addr, path):
+            return
+        
+        if not self.session.path:
+            self.send(src_addr, "/error", path, ray.Err.NO_SESSION_OPEN,
+                      "No session to snapshot.")
+            return
+        
+        signaler.server_take_snapshot.emit(path, args, src_addr)
+    
+    @make_method('/ray/session/list_snapshots', '')
+    def rayServerListSnapshots(self, path, args, types, src_addr):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        if not self.session.path:
+            self.send(src_addr, "/error", path, ray.Err.NO_SESSION_OPEN,
+                      "No session to list snapshots.")
+            return
+        
+        signaler.server_list_snapshots.emit(path, args, src_addr)
+    
+    @make_method('/ray/session/restore_snapshot', 's')
+    def rayServerRestoreSnapshot(self, path, args, types, src_addr):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        if self.isOperationPending(src_addr, path):
+            return
+        
+        if not self.session.path:
+            self.send(src_addr, "/error", path, ray.Err.NO_SESSION_OPEN,
+                      "No session to restore.")
+            return
+        
+        if not args[0] or '/' in args[0]:
+            self.send(src_addr, "/error", path, ray.Err.NO_SUCH_FILE,
+                      "Invalid snapshot name.")
+            return
+        
+        signaler.server_restore_snapshot.emit(path, args, src_addr)
+    
     @make_method('/ray/session/save_as_template', 's')
     def nsmServerSaveSessionTemplate(self, path, args, types, src_addr):
         ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
@@ -663,6 +805,9 @@ class OscServerThread(ClientCommunicating):
                       "Cannot add to session because no session is loaded.")
             return
         
+        if self.isOperationPending(src_addr, path):
+            return
+        
         signaler.server_add_client_template.emit(path, args, src_addr)
     
     @make_method('/ray/session/reorder_clients', None)
@@ -730,6 +875,83 @@ class OscServerThread(ClientCommunicating):
         if client and client.active:
             self.send(client.addr, "/nsm/client/hide_optional_gui")
 
+    @make_method('/ray/client/get_log', 'si')
+    def rayClientGetLog(self, path, args, types, src_addr):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        #args: client_id, count of last lines (0 for all)
+        client = self.session.getClient(args[0])
+        if not client:
+            self.send(src_addr, '/error', path, ray.Err.NO_SUCH_FILE,
+                      "No client with id %s" % args[0])
+            return
+        
+        lines, seq = client.log.lines(args[1])
+        self.sendClientLog(src_addr, path, client.client_id, lines, seq)
+    
+    @make_method('/ray/client/tail_log', 'si')
+    def rayClientTailLog(self, path, args, types, src_addr):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        #args: client_id, number of last line already received
+        client = self.session.getClient(args[0])
+        if not client:
+            self.send(src_addr, '/error', path, ray.Err.NO_SUCH_FILE,
+                      "No client with id %s" % args[0])
+            return
+        
+        lines, seq = client.log.linesSince(args[1])
+        self.sendClientLog(src_addr, path, client.client_id, lines, seq)
+    
+    def sendClientLog(self, src_addr, path, client_id, lines, seq):
+        #lines are sent in messages of about 8 kB (to fit UDP packets),
+        #with the number of the last line
+        #to give to /ray/client/tail_log next time.
+        max_size = 8192
+        chunk = []
+        chunk_size = 0
+        
+        for line in lines:
+            line_size = len(line.encode(errors='replace')) + 1
+            
+            if chunk and chunk_size + line_size > max_size:
+                self.send(src_addr, '/reply_client_log', client_id, seq,
+                          '\n'.join(chunk))
+                chunk.clear()
+                chunk_size = 0
+            
+            chunk.append(line)
+            chunk_size += line_size
+        
+        if chunk:
+            self.send(src_addr, '/reply_client_log', client_id, seq,
+                      '\n'.join(chunk))
+        
+        self.send(src_addr, '/reply', path, "Client log sent.")
+    
+    @make_method('/ray/client/get_stats', 's')
+    def rayClientGetStats(self, path, args, types, src_addr):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        client = self.session.getClient(args[0])
+        if not client:
+            self.send(src_addr, '/error', path, ray.Err.NO_SUCH_FILE,
+                      "No client with id %s" % args[0])
+            return
+        
+        #one message per sample, oldest first: client_id, seconds since
+        #sample, cpu percent, resident memory kB, read and write kB/s.
+        client_stats = self.session.resource_sampler.clientStats(client)
+        if client_stats is not None:
+            now = time.time()
+            
+            for sample in list(client_stats.history):
+                self.send(src_addr, '/reply_client_stats', client.client_id,
+                          now - sample.time, sample.cpu, sample.rss,
+                          sample.read_rate, sample.write_rate)
+        
+        self.send(src_addr, '/reply', path, "Client stats sent.")
+    
     @make_method('/ray/client/update_properties', 'ssssissssi')
     def rayGuiClientUpdateProperties(self, path, args):
         ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
@@ -737,6 +959,14 @@ class OscServerThread(ClientCommunicating):
         client_data = ray.ClientData(*args)
         signaler.gui_update_client_properties.emit(client_data)
         
+    @make_method('/ray/client/set_scheduling', 'ssiisii')
+    def rayGuiClientSetScheduling(self, path, args):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        #args: client_id, cpu_affinity, nice, io_class,
+        #      cgroup_slice, cpu_quota, memory_max
+        signaler.gui_client_scheduling.emit(args[0], args[1:])
+        
     @make_method('/ray/net_daemon/duplicate_state', 'f')
     def rayDuplicateState(self, path, args, types, src_addr):
         signaler.net_duplicate_state.emit(src_addr, args[0])
@@ -781,8 +1011,34 @@ class OscServerThread(ClientCommunicating):
         
         self.option_desktops_memory = bool(args[0])
     
+    @make_method('/ray/option/clone_copy', 'i')
+    def rayOptionCloneCopy(self, path, args):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        self.option_clone_copy = bool(args[0])
+    
+    @make_method('/ray/option/verify_copy', 'i')
+    def rayOptionVerifyCopy(self, path, args):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        self.option_verify_copy = bool(args[0])
+    
+    @make_method('/ray/option/auto_snapshot', 'i')
+    def rayOptionAutoSnapshot(self, path, args):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        self.option_auto_snapshot = bool(args[0])
+    
+    @make_method('/ray/option/copy_bandwidth', 'i')
+    def rayOptionCopyBandwidth(self, path, args):
+        ifDebug('serverOSC::ray-daemon_receives %s, %s' % (path, str(args)))
+        
+        #in kB/s, 0 means no limit
+        self.option_copy_bandwidth = max(0, args[0])
+        self.session.copy_scheduler.setBandwidth(self.option_copy_bandwidth)
+    
     def isOperationPending(self, src_addr, path):
-        if self.session.file_copier.isActive():
+        if self.session.copy_scheduler.conflictsWith(path):
             self.send(src_addr, "/error", path, ray.Err.COPY_RUNNING, 
                       "ray-daemon is copying files. "
                         + "Wait copy finish or abort copy, "
@@ -817,80 +1073,35 @@ class OscServerThread(ClientCommunicating):
         self.sendGui('/ray/gui/server/copying', int(copy_state))
     
     def listClientTemplates(self, src_addr, factory=False):
-        template_list = []
         tmp_template_list = []
         
-        templates_root    = TemplateRoots.user_clients
         response_osc_path = '/reply_user_client_templates'
-        
         if factory:
-            templates_root    = TemplateRoots.factory_clients
             response_osc_path = '/reply_factory_client_templates'
         
+        catalog = ClientTemplateCatalog.instance()
+        version_prober = VersionProber.instance()
         
-        templates_file = "%s/%s" % (templates_root, 'client_templates.xml')
-        
-        if not os.path.isfile(templates_file):
-            return
-        
-        if not os.access(templates_file, os.R_OK):
-            return
-        
-        file = open(templates_file)
-        xml = QDomDocument()
-        xml.setContent(file.read())
-        file.close()
-        
-        content = xml.documentElement()
-        
-        if content.tagName() != "RAY-CLIENT-TEMPLATES":
-            return
-        
-        nodes = content.childNodes()
-        
-        for i in range(nodes.count()):
-            node = nodes.at(i)
-            ct = node.toElement()
-            tag_name = ct.tagName()
-            if tag_name != 'Client-Template':
-                continue
-            
-            template_name = ct.attribute('template-name')
-            
-            if not template_name or template_name in template_list:
-                continue
-            
-            executable = ct.attribute('executable') 
-            
-            if not executable:
-                continue
-            
-            try_exec_line = ct.attribute('try-exec')
-            
-            try_exec_list = []
-            if try_exec_line:
-                try_exec_list = ct.attribute('try-exec').split(';')
+        for template in catalog.availableTemplates(factory):
+            if factory and template.needed_version:
+                executable = template.attributes.get('executable', '')
+                program_version = version_prober.cachedVersion(executable)
                 
-            try_exec_list.append(executable)
-            try_exec_ok = True
+                if program_version is None:
+                    #not probed yet, probe it now in background
+                    #for next listings.
+                    version_prober.probe(executable)
+                elif not versionIsEnough(program_version,
+                                         template.needed_version):
+                    continue
             
-            for try_exec in try_exec_list:
-                path = shutil.which(try_exec)
-                if not path:
-                    try_exec_ok = False
-                    break
-            
-            if not try_exec_ok:
-                continue
-            
-            template_list.append("%s/%s" % (template_name,
-                                            ct.attribute('icon')))
-            tmp_template_list.append("%s/%s" % (template_name,
-                                                ct.attribute('icon')))
+            tmp_template_list.append(
+                "%s/%s" % (template.name,
+                           template.attributes.get('icon', '')))
             
             if len(tmp_template_list) == 100:
                 self.send(src_addr, response_osc_path, *tmp_template_list)
-                template_list.clear()
+                tmp_template_list.clear()
         
         if tmp_template_list:
             self.send(src_addr, response_osc_path, *tmp_template_list)
@@ -917,7 +1128,10 @@ class OscServerThread(ClientCommunicating):
             + ray.Option.SAVE_FROM_CLIENT * self.option_save_from_client
             + ray.Option.BOOKMARK_SESSION * self.option_bookmark_session
             + ray.Option.HAS_WMCTRL * self.option_has_wmctrl
-            + ray.Option.DESKTOPS_MEMORY * self.option_desktops_memory)
+            + ray.Option.DESKTOPS_MEMORY * self.option_desktops_memory
+            + ray.Option.CLONE_COPY * self.option_clone_copy
+            + ray.Option.VERIFY_COPY * self.option_verify_copy
+            + ray.Option.AUTO_SNAPSHOT * self.option_auto_snapshot)
         
         self.send(gui_addr, "/ray/gui/daemon_announce", ray.VERSION,
                   self.server_status, options, self.session.root,
@@ -943,6 +1157,9 @@ class OscServerThread(ClientCommunicating):
             
             self.send(gui_addr, "/ray/client/status",
                       client.client_id,  client.status)
+            
+            self.send(gui_addr, '/ray/client/scheduling', client.client_id,
+                      *client.scheduling.oscArgs())
         
         self.gui_list.append(gui_addr)
         Terminal.message("Registered with GUI")
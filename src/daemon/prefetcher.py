@@ -0,0 +1,123 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from daemon_tools import RS
+
+#in MB, max size of files asked to be read ahead for one session
+DEFAULT_BUDGET = 512
+
+instance = None
+
+class SessionPrefetcher(object):
+    #asks the kernel to read session files into page cache
+    #(posix_fadvise WILLNEED), before clients read them all at once.
+    #It runs in one low priority worker thread. A new prefetch cancels
+    #the previous one, a session is only prefetched once while unchanged.
+    def __init__(self):
+        self._generation = 0
+        self._last_key = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        global instance
+        instance = self
+
+    @staticmethod
+    def instance():
+        global instance
+
+        if not instance:
+            instance = SessionPrefetcher()
+        return instance
+
+    def budget(self):
+        return max(0, RS.settings.value('daemon/prefetch_budget',
+                                        DEFAULT_BUDGET, type=int)) * 1048576
+
+    def prefetch(self, spath):
+        #can be called from any thread
+        if not hasattr(os, 'posix_fadvise'):
+            return
+
+        budget = self.budget()
+        if not budget:
+            return
+
+        try:
+            key = (spath, os.stat(spath).st_mtime_ns)
+        except OSError:
+            return
+
+        with self._lock:
+            if key == self._last_key:
+                return
+            self._last_key = key
+            self._generation += 1
+            generation = self._generation
+
+        self._executor.submit(self._prefetch, spath, budget, generation)
+
+    def _isCancelled(self, generation):
+        return bool(generation != self._generation)
+
+    def _sessionFiles(self, spath, generation):
+        files = []
+        to_scan = [spath]
+
+        while to_scan:
+            if self._isCancelled(generation):
+                return []
+
+            try:
+                entries = list(os.scandir(to_scan.pop()))
+            except OSError:
+                continue
+
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        to_scan.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        files.append(
+                            (entry.path,
+                             entry.stat(follow_symlinks=False).st_size))
+                except OSError:
+                    continue
+
+        #sorted paths keeps files of a same client together
+        files.sort()
+        return files
+
+    def _prefetch(self, spath, budget, generation):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+
+        for file_path, size in self._sessionFiles(spath, generation):
+            if self._isCancelled(generation):
+                return
+
+            if size > budget:
+                #only the start of the last file
+                size = budget
+
+            try:
+                fd = os.open(file_path, os.O_RDONLY | os.O_NONBLOCK)
+            except OSError:
+                continue
+
+            try:
+                os.posix_fadvise(fd, 0, size, os.POSIX_FADV_WILLNEED)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+
+            budget -= size
+            if budget <= 0:
+                return
@@ -133,6 +133,11 @@ if __name__ == '__main__':
     RS.settings.setValue('daemon/bookmark_session_folder', 
                       server.option_bookmark_session)
     RS.settings.setValue('daemon/desktops_memory', server.option_desktops_memory)
+    RS.settings.setValue('daemon/clone_copy', server.option_clone_copy)
+    RS.settings.setValue('daemon/verify_copy', server.option_verify_copy)
+    RS.settings.setValue('daemon/auto_snapshot', server.option_auto_snapshot)
+    RS.settings.setValue('daemon/copy_bandwidth', 
+                         server.option_copy_bandwidth)
     RS.settings.sync()
     
     #stop the server
@@ -0,0 +1,163 @@
+import os
+import time
+from collections import deque
+from PyQt5.QtCore import QTimer
+
+import ray
+from daemon_tools import RS
+
+#in ms, 0 disables sampling
+DEFAULT_INTERVAL = 2000
+DEFAULT_HISTORY = 60
+
+try:
+    CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    CLOCK_TICKS = 100
+    PAGE_SIZE = 4096
+
+def _readFile(file_path):
+    try:
+        file = open(file_path, 'r')
+        contents = file.read()
+        file.close()
+    except OSError:
+        return ''
+
+    return contents
+
+def residentMemory(pid):
+    #in bytes
+    elements = _readFile("/proc/%i/statm" % pid).split()
+    if len(elements) < 2:
+        return 0
+
+    return int(elements[1]) * PAGE_SIZE
+
+def ioBytes(pid):
+    #returns bytes read and written on storage
+    read_bytes = write_bytes = 0
+
+    for line in _readFile("/proc/%i/io" % pid).split('\n'):
+        if line.startswith('read_bytes:'):
+            read_bytes = int(line.split()[1])
+        elif line.startswith('write_bytes:'):
+            write_bytes = int(line.split()[1])
+
+    return (read_bytes, write_bytes)
+
+class StatsSample(object):
+    __slots__ = ['time',
+                 'cpu',
+                 'rss',
+                 'read_rate',
+                 'write_rate']
+
+    def __init__(self, time, cpu, rss, read_rate, write_rate):
+        self.time       = time
+        self.cpu        = cpu        #percent of one core
+        self.rss        = rss        #kB
+        self.read_rate  = read_rate  #kB/s
+        self.write_rate = write_rate #kB/s
+
+class ClientStats(object):
+    #rolling history of one client process tree
+    def __init__(self, history_length):
+        self.history = deque(maxlen=history_length)
+
+        #counters of the previous sample, rates are computed from them
+        self.pid = 0
+        self.time = 0.0
+        self.cpu_ticks = 0
+        self.read_bytes = 0
+        self.write_bytes = 0
+
+    def last(self):
+        if not self.history:
+            return None
+        return self.history[-1]
+
+class ResourceSampler(object):
+    #samples CPU, resident memory and storage I/O of running clients and
+    #of all their child processes, every 'daemon/stats_interval' ms.
+    #Last samples are sent to GUIs with /ray/client/stats,
+    #history can be asked with /ray/client/get_stats.
+    def __init__(self, session):
+        self.session = session
+        self.stats = {}
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.sample)
+
+        interval = RS.settings.value('daemon/stats_interval',
+                                     DEFAULT_INTERVAL, type=int)
+        if interval > 0:
+            self.timer.start(interval)
+
+    def historyLength(self):
+        return max(1, RS.settings.value('daemon/stats_history',
+                                        DEFAULT_HISTORY, type=int))
+
+    def clientStats(self, client):
+        return self.stats.get(client)
+
+    def sample(self):
+        running_clients = [c for c in self.session.clients
+                           if c.isRunning() and c.pid]
+
+        #forget stopped and removed clients
+        for client in list(self.stats.keys()):
+            if not client in running_clients:
+                del self.stats[client]
+
+        if not running_clients:
+            return
+
+        #one read of /proc for all clients
+        ray.ProcessTree.refresh()
+        now = time.monotonic()
+
+        for client in running_clients:
+            cpu_ticks = rss = read_bytes = write_bytes = 0
+
+            for pid in ray.ProcessTree.descendants(client.pid):
+                cpu_ticks += ray.ProcessTree.cpuTicks(pid)
+                rss += residentMemory(pid)
+                pid_read, pid_write = ioBytes(pid)
+                read_bytes += pid_read
+                write_bytes += pid_write
+
+            client_stats = self.stats.get(client)
+
+            if client_stats is None or client_stats.pid != client.pid:
+                #first sample of this process, no rates yet
+                client_stats = ClientStats(self.historyLength())
+                self.stats[client] = client_stats
+            else:
+                duration = now - client_stats.time
+                if duration <= 0:
+                    continue
+
+                #counters of finished children are lost, rates can't be < 0
+                sample = StatsSample(
+                    time.time(),
+                    max(0.0, (cpu_ticks - client_stats.cpu_ticks)
+                                * 100 / CLOCK_TICKS / duration),
+                    rss // 1024,
+                    max(0, int((read_bytes - client_stats.read_bytes)
+                                  / 1024 / duration)),
+                    max(0, int((write_bytes - client_stats.write_bytes)
+                                  / 1024 / duration)))
+
+                client_stats.history.append(sample)
+
+                self.session.sendGui('/ray/client/stats', client.client_id,
+                                     sample.cpu, sample.rss,
+                                     sample.read_rate, sample.write_rate)
+
+            client_stats.pid = client.pid
+            client_stats.time = now
+            client_stats.cpu_ticks = cpu_ticks
+            client_stats.read_bytes = read_bytes
+            client_stats.write_bytes = write_bytes
@@ -0,0 +1,72 @@
+import time
+from PyQt5.QtCore import QTimer
+
+from daemon_tools import RS
+
+DEFAULT_DEBOUNCE = 500
+
+#if an operation is pending, saving is tried again after this delay
+RETRY_INTERVAL = 200
+
+class SaveCoalescer(object):
+    #with save_from_client option, each client which becomes clean asks
+    #for a session save. Requests arriving within the debounce window
+    #are merged in only one save, where clients that saved themselves
+    #are not asked to save again.
+    def __init__(self, session):
+        self.session = session
+
+        self.client_ids = []
+        self.first_request_time = 0.0
+        self.osc_args = None
+
+        #counters, read by OSC thread for /ray/server/save_from_client_stats
+        self.requests = 0
+        self.saves    = 0
+        self.merged   = 0
+        self.deferred = 0
+
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.timeOut)
+
+    def debounce(self):
+        return max(0, RS.settings.value('daemon/save_from_client_debounce',
+                                        DEFAULT_DEBOUNCE, type=int))
+
+    def request(self, path, args, src_addr, client_id):
+        self.requests += 1
+        self.osc_args = (path, args, src_addr)
+
+        if self.client_ids:
+            self.merged += 1
+        else:
+            self.first_request_time = time.time()
+
+        if not client_id in self.client_ids:
+            self.client_ids.append(client_id)
+
+        #window counts from the first request,
+        #so a stream of requests can't delay save forever
+        if not self.timer.isActive():
+            self.timer.start(self.debounce())
+
+    def timeOut(self):
+        if not self.client_ids:
+            return
+
+        if self.session.process_order:
+            self.deferred += 1
+            self.timer.start(RETRY_INTERVAL)
+            return
+
+        client_ids = self.client_ids
+        self.client_ids = []
+        self.saves += 1
+
+        path, args, src_addr = self.osc_args
+        self.session.saveFromClients(path, args, src_addr, client_ids)
+
+    def clear(self):
+        self.client_ids = []
+        self.timer.stop()
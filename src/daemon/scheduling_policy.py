@@ -0,0 +1,135 @@
+import os
+import re
+
+import ray
+from daemon_tools import Terminal
+from executable_index import ExecutableIndex
+
+_AFFINITY_RE = re.compile(r'^[0-9]+(-[0-9]+)?(,[0-9]+(-[0-9]+)?)*$')
+
+def _cpuCount():
+    return os.cpu_count() or 1
+
+class SchedulingPolicy(object):
+    #scheduling attributes of a client, applied at launch by wrapping
+    #client executable with taskset, nice, ionice and systemd-run.
+    #All these tools exec the next command, so client pid is kept.
+    __slots__ = ['cpu_affinity',
+                 'nice',
+                 'io_class',
+                 'cgroup_slice',
+                 'cpu_quota',
+                 'memory_max']
+
+    def __init__(self):
+        self.cpu_affinity = ''              #taskset cpu list, as '2-3,6'
+        self.nice         = 0
+        self.io_class     = ray.IoClass.NONE
+        self.cgroup_slice = ''              #systemd user slice
+        self.cpu_quota    = 0               #percent of one cpu, 0 no limit
+        self.memory_max   = 0               #MB, 0 no limit
+
+    def update(self, cpu_affinity, nice, io_class, cgroup_slice,
+               cpu_quota, memory_max):
+        #invalid values are ignored, previous ones are kept
+        cpu_affinity = cpu_affinity.replace(' ', '')
+        if not cpu_affinity or _AFFINITY_RE.match(cpu_affinity):
+            self.cpu_affinity = cpu_affinity
+
+        self.nice = max(-20, min(19, nice))
+
+        if io_class in (ray.IoClass.NONE, ray.IoClass.REALTIME,
+                        ray.IoClass.BEST_EFFORT, ray.IoClass.IDLE):
+            self.io_class = io_class
+
+        cgroup_slice = cgroup_slice.strip()
+        if cgroup_slice and not cgroup_slice.endswith('.slice'):
+            cgroup_slice += '.slice'
+        if not '/' in cgroup_slice:
+            self.cgroup_slice = cgroup_slice
+
+        self.cpu_quota = max(0, min(100 * _cpuCount(), cpu_quota))
+        self.memory_max = max(0, memory_max)
+
+    def copy(self, other):
+        for attr in self.__slots__:
+            setattr(self, attr, getattr(other, attr))
+
+    def readXml(self, ctx):
+        def intAttribute(name):
+            value = ctx.attribute(name)
+            if value.lstrip('-').isdigit():
+                return int(value)
+            return 0
+
+        self.update(ctx.attribute('cpu_affinity'),
+                    intAttribute('nice'),
+                    intAttribute('io_class'),
+                    ctx.attribute('cgroup_slice'),
+                    intAttribute('cpu_quota'),
+                    intAttribute('memory_max'))
+
+    def writeXml(self, ctx):
+        #only not default attributes are written
+        if self.cpu_affinity:
+            ctx.setAttribute('cpu_affinity', self.cpu_affinity)
+
+        if self.nice:
+            ctx.setAttribute('nice', self.nice)
+
+        if self.io_class:
+            ctx.setAttribute('io_class', self.io_class)
+
+        if self.cgroup_slice:
+            ctx.setAttribute('cgroup_slice', self.cgroup_slice)
+
+        if self.cpu_quota:
+            ctx.setAttribute('cpu_quota', self.cpu_quota)
+
+        if self.memory_max:
+            ctx.setAttribute('memory_max', self.memory_max)
+
+    def oscArgs(self):
+        return [self.cpu_affinity, self.nice, self.io_class,
+                self.cgroup_slice, self.cpu_quota, self.memory_max]
+
+    def _wrapper(self, tool):
+        tool_path = ExecutableIndex.instance().which(tool)
+        if not tool_path:
+            Terminal.warning(
+                "%s not found, client scheduling is partially applied"
+                    % tool)
+        return tool_path
+
+    def wrapperArguments(self):
+        #returns wrapper commands to put before client executable
+        arguments = []
+
+        if self.cgroup_slice or self.cpu_quota or self.memory_max:
+            systemd_run = self._wrapper('systemd-run')
+            if systemd_run:
+                arguments += [systemd_run, '--user', '--scope', '--quiet']
+
+                if self.cgroup_slice:
+                    arguments.append('--slice=%s' % self.cgroup_slice)
+                if self.cpu_quota:
+                    arguments += ['-p', 'CPUQuota=%i%%' % self.cpu_quota]
+                if self.memory_max:
+                    arguments += ['-p', 'MemoryMax=%iM' % self.memory_max]
+
+        if self.cpu_affinity:
+            taskset = self._wrapper('taskset')
+            if taskset:
+                arguments += [taskset, '-c', self.cpu_affinity]
+
+        if self.nice:
+            nice = self._wrapper('nice')
+            if nice:
+                arguments += [nice, '-n', str(self.nice)]
+
+        if self.io_class:
+            ionice = self._wrapper('ionice')
+            if ionice:
+                arguments += [ionice, '-t', '-c', str(self.io_class)]
+
+        return arguments
@@ -16,12 +16,28 @@ from desktops_memory   import DesktopsMemory
 from multi_daemon_file import MultiDaemonFile
 from signaler          import Signaler
 from server_sender     import ServerSender
-from file_copier       import FileCopier
+from file_copier       import CopyScheduler
+from session_index     import SessionIndex
+from template_catalog  import ClientTemplateCatalog
+from version_prober    import VersionProber, versionIsEnough
+from copy_engine       import isUnfinishedCopy, CopyPriority
+from launch_scheduler  import LaunchScheduler, closeWaves
+from switch_planner    import SwitchPlan, planSwitch, readSessionClients
+from prefetcher        import SessionPrefetcher
+from snapshots         import SnapshotStore, SessionSnapshots
+from resource_sampler  import ResourceSampler
+from save_coalescer    import SaveCoalescer
+from client_timeouts   import ClientTimeouts
+from file_writer       import FileWriter
 from client            import Client
+from client_registry   import ClientList
 from daemon_tools import TemplateRoots, RS, Terminal, CommandLineArgs
 
 _translate = QCoreApplication.translate
 signaler = Signaler.instance()
+version_prober = VersionProber.instance()
+file_writer = FileWriter.instance()
+snapshot_store = SnapshotStore.instance()
 
 def dirname(*args):
     return os.path.dirname(*args)
@@ -35,7 +51,7 @@ class Session(ServerSender):
         self.root = root
         self.is_dummy = False
         
-        self.clients = []
+        self.clients = ClientList()
         self.new_clients = []
         self.removed_clients = []
         self.name = ""
@@ -44,9 +60,10 @@ class Session(ServerSender):
         self.is_renameable = True
         self.forbidden_ids_list = []
         
-        self.file_copier = FileCopier(self)
+        self.copy_scheduler = CopyScheduler(self)
         
         self.bookmarker = BookMarker()
+        self.session_index = SessionIndex()
         self.desktops_memory = DesktopsMemory(self)
     
     #############
@@ -111,19 +128,17 @@ class Session(ServerSender):
                 self.bookmarker.makeAll(self.path)
     
     def getClient(self, client_id):
-        for client in self.clients:
-            if client.client_id == client_id:
-                return client
-        else:
-            sys.stderr.write("client_id %s is not in ray-daemon session\n")
+        client = self.clients.byId(client_id)
+        if client is None:
+            sys.stderr.write("client_id %s is not in ray-daemon session\n"
+                             % client_id)
+        return client
     
     def getClientByAddress(self, addr):
         if not addr:
             return None
         
-        for client in self.clients:
-            if client.addr and client.addr.url == addr.url:
-                return client
+        return self.clients.byUrl(addr.url)
     
     def newClient(self, executable, client_id=None):
         client = Client(self)
@@ -322,10 +337,9 @@ class Session(ServerSender):
         client_newlist  = []
         
         for client_id in client_ids_list:
-            for client in self.clients:
-                if client.client_id == client_id:
-                    client_newlist.append(client)
-                    break
+            client = self.clients.byId(client_id)
+            if client is not None:
+                client_newlist.append(client)
         
         if len(client_ids_list) != len(self.clients):
             return
@@ -343,15 +357,17 @@ class OperatingSession(Session):
         self.timer = QTimer()
         self.expected_clients = []
         
-        self.timer_launch = QTimer()
-        self.timer_launch.setInterval(100)
-        self.timer_launch.timeout.connect(self.timerLaunchTimeOut)
-        self.clients_to_launch = []
+        self.launch_scheduler = LaunchScheduler(self)
+        self.save_coalescer = SaveCoalescer(self)
+        
+        #at close, clients are quit by waves,
+        #next wave is quit when all clients of current one exited
+        self.quit_waves = []
         
-        self.timer_quit = QTimer()
-        self.timer_quit.setInterval(100)
-        self.timer_quit.timeout.connect(self.timerQuitTimeOut)
-        self.clients_to_quit = []
+        #incremented when process_order is replaced by abort or terminate,
+        #callbacks of workers (file writer, snapshots) started before
+        #are then ignored.
+        self.operation_generation = 0
         
         self.err_loading = ray.Err.OK
         self.err_saving  = ray.Err.OK
@@ -361,6 +377,7 @@ class OperatingSession(Session):
         self.osc_src_addr = None
         
         self.process_order = []
+        self.switch_plan = SwitchPlan()
         
         self.terminated_yet = False
         
@@ -399,9 +416,18 @@ class OperatingSession(Session):
         else:
             follow()
     
+    def adaptiveTimeout(self, kind, default):
+        #timeout in ms learned from latencies of expected clients,
+        #kind is 'announce', 'open' or 'save'
+        return ClientTimeouts.instance().timeout(
+            [client.executable_path for client in self.expected_clients],
+            kind, default)
+    
     def endTimerIfLastExpected(self, client):
         if client in self.expected_clients:
             self.expected_clients.remove(client)
+        if self.quit_waves:
+            self.quitNextWave()
         if not self.expected_clients:
             self.timer.setSingleShot(True)
             self.timer.stop()
@@ -453,21 +479,25 @@ class OperatingSession(Session):
             self.process_order.__delitem__(0)
             next_function(*arguments)
     
-    def timerLaunchTimeOut(self):
-        if self.clients_to_launch:
-            self.clients_to_launch[0].start()
-            self.clients_to_launch.__delitem__(0)
-            
-        if not self.clients_to_launch:
-            self.timer_launch.stop()
+    def clientLaunched(self, client):
+        #announce timeout counts from the last launched client,
+        #not from the start of the launch
+        if (self.wait_for == ray.WaitFor.ANNOUNCE
+                and self.timer.isActive()):
+            self.timer.start(self.adaptiveTimeout('announce', 5000))
+        
+    def quitNextWave(self):
+        while self.quit_waves:
+            for client in self.quit_waves[0]:
+                if client in self.expected_clients:
+                    return
             
-    def timerQuitTimeOut(self):
-        if self.clients_to_quit:
-            self.clients_to_quit[0].quit()
-            self.clients_to_quit.__delitem__(0)
+            self.quit_waves.__delitem__(0)
             
-        if not self.clients_to_quit:
-            self.timer_quit.stop()
+            if self.quit_waves:
+                for client in self.quit_waves[0]:
+                    if client.isRunning():
+                        client.quit()
     
     def sendError(self, err, error_message):
         #clear process order to allow other new operations
@@ -526,9 +556,7 @@ class OperatingSession(Session):
         
         ray_file.close()
         
-        ray_file_w = open(session_file, 'w')
-        ray_file_w.write(xml.toString())
-        ray_file_w.close()
+        ray.writeFileAtomically(session_file, xml.toString())
         
         
         for client in tmp_clients:
@@ -542,7 +570,12 @@ class OperatingSession(Session):
     # then, when timer is timeout or when all client replied, 
     # save_step1 is launched.
         
-    def save(self, from_client_id=''):
+    def save(self, from_client_ids=[], dirty_only=False,
+             snapshot_label=None):
+        #clients of from_client_ids just saved themselves, they are skipped.
+        #with dirty_only, clients capable of :dirty: are asked to save
+        #only if they have unsaved changes.
+        #with snapshot_label, a snapshot is taken once session is saved.
         if not self.path:
             self.nextFunction()
             return
@@ -550,17 +583,19 @@ class OperatingSession(Session):
         self.setServerStatus(ray.ServerStatus.SAVE)
         
         for client in self.clients:
-            if from_client_id and client.client_id == from_client_id:
+            if client.client_id in from_client_ids:
                 continue
             
-            if client.active:
+            if client.active and not (dirty_only and client.isClean()):
                 self.expected_clients.append(client)
-            client.save()
+            client.save(dirty_only)
                 
-        self.waitAndGoTo(10000, self.save_step1, ray.WaitFor.REPLY)
+        self.waitAndGoTo(self.adaptiveTimeout('save', 10000),
+                         (self.save_step1, snapshot_label), ray.WaitFor.REPLY)
             
-    def save_step1(self):
+    def save_step1(self, snapshot_label=None):
         self.cleanExpected()
+        ClientTimeouts.instance().save()
         
         if not self.path:
             self.nextFunction()
@@ -573,12 +608,6 @@ class OperatingSession(Session):
                 self.err_saving = ray.Err.CREATE_FAILED
                 self.saveError()
                 return
-        try:
-            file = open(session_file, 'w')
-        except:
-            self.err_saving = ray.Err.CREATE_FAILED
-            self.saveError()
-            return
         
         self.err_saving = ray.Err.OK
         
@@ -629,13 +658,85 @@ class OperatingSession(Session):
         
         contents += xml.toString()
         
-        file.write(contents)
-        file.close()
+        #file is written in a worker thread,
+        #save continues in save_step2 once it is written.
+        file_writer.write(session_file, contents, self.save_step2,
+                          [self.operation_generation, snapshot_label],
+                          backup=True)
+    
+    def save_step2(self, success, generation, snapshot_label):
+        if generation != self.operation_generation:
+            #operation has been aborted meanwhile
+            return
+        
+        if not success:
+            self.err_saving = ray.Err.CREATE_FAILED
+            self.saveError()
+            return
         
         self.sendGuiMessage(_translate('GUIMSG', "Session saved."))
         self.message("Session saved.")
+        
+        if snapshot_label is not None:
+            #operation goes on once snapshot is taken
+            snapshot_store.take(self.path, snapshot_label, self.snapshotTaken,
+                                [self.operation_generation])
+            return
+        
+        #automatic snapshot is taken in background
+        server = self.getServer()
+        if (not self.is_dummy
+                and server and server.option_auto_snapshot):
+            snapshot_store.take(self.path)
+        
+        self.nextFunction()
+    
+    def snapshotTaken(self, snapshot_name, generation):
+        if generation != self.operation_generation:
+            return
+        
+        if snapshot_name is None:
+            m = _translate('GUIMSG', "Failed to take snapshot !")
+            self.message(m)
+            self.sendGuiMessage(m)
+            self.oscReply("/error", self.osc_path, ray.Err.SNAPSHOT_FAILED, m)
+            self.process_order.clear()
+            self.setServerStatus(ray.ServerStatus.READY)
+            return
+        
+        self.message("Snapshot %s taken." % snapshot_name)
         self.nextFunction()
     
+    def takeSnapshotDone(self):
+        self.oscReply("/reply", self.osc_path, "Snapshot taken.")
+        self.setServerStatus(ray.ServerStatus.READY)
+    
+    def restoreSnapshot(self, spath, snapshot_name):
+        self.sendGuiMessage(_translate('GUIMSG', "Restoring snapshot %s")
+                            % snapshot_name)
+        snapshot_store.restore(spath, snapshot_name, self.snapshotRestored,
+                               [spath, self.operation_generation])
+    
+    def snapshotRestored(self, snapshot_name, spath, generation):
+        if generation != self.operation_generation:
+            return
+        
+        if snapshot_name is None:
+            #session is reopened as it is
+            m = _translate('GUIMSG', "Failed to restore snapshot !")
+            self.message(m)
+            self.sendGuiMessage(m)
+            self.oscReply("/error", self.osc_path, ray.Err.SNAPSHOT_FAILED, m)
+            self.osc_src_addr = None
+            self.process_order = [(self.load, spath), self.loadDone]
+        
+        self.nextFunction()
+    
+    def restoreSnapshotDone(self):
+        self.oscReply("/reply", self.osc_path, "Snapshot restored.")
+        self.message("Done")
+        self.setServerStatus(ray.ServerStatus.READY)
+    
     def saveDone(self):
         if not self.err_loading:
             self.message("Done.")
@@ -662,6 +763,8 @@ class OperatingSession(Session):
         
         self.expected_clients.clear()
         self.removed_clients.clear()
+        self.launch_scheduler.clear()
+        self.save_coalescer.clear()
         
         if not self.path:
             self.nextFunction()
@@ -673,12 +776,24 @@ class OperatingSession(Session):
         for client in self.clients.__reversed__():
             if client.isRunning():
                 self.expected_clients.append(client)
-                self.clients_to_quit.append(client)
-                self.timer_quit.start()
+        
+        #all clients are quit at once, exits are notified by QProcess,
+        #so close takes as long as the slowest client.
+        #Optionally, launch groups are quit in reverse launch order.
+        if RS.settings.value('daemon/close_by_launch_group', False,
+                             type=bool):
+            self.quit_waves = closeWaves(self.expected_clients)
+        else:
+            self.quit_waves = [self.expected_clients.copy()]
+        
+        for client in self.quit_waves[0]:
+            client.quit()
         
         self.waitAndGoTo(30000, self.close_step1, ray.WaitFor.STOP)
     
     def close_step1(self):
+        self.quit_waves.clear()
+        
         for client in self.expected_clients:
             client.kill()
             
@@ -746,6 +861,17 @@ class OperatingSession(Session):
             self.process_order.clear()
             return
         
+        #session copy is merged in an existing folder,
+        #only an aborted copy can be resumed there.
+        spath = "%s/%s" % (self.root, new_session_full_name)
+        
+        if os.path.exists(spath) and not isUnfinishedCopy(spath):
+            self.sendError(ray.Err.CREATE_FAILED, 
+                           _translate("error", "Folder \n%s \nalready exists")
+                           % spath)
+            self.duplicateAborted(new_session_full_name)
+            return
+        
         self.sendGui('/ray/trash/clear')
         
         for client in self.clients:
@@ -769,11 +895,11 @@ class OperatingSession(Session):
         spath = "%s/%s" % (self.root, new_session_full_name)
         
         self.setServerStatus(ray.ServerStatus.COPY)
-        self.file_copier.startSessionCopy(self.path, 
-                                          spath, 
-                                          self.duplicate_step2, 
-                                          self.duplicateAborted, 
-                                          [new_session_full_name])
+        self.copy_scheduler.startSessionCopy(self.path, 
+                                             spath, 
+                                             self.duplicate_step2, 
+                                             self.duplicateAborted, 
+                                             [new_session_full_name])
     
     def duplicate_step2(self, new_session_full_name):
         self.cleanExpected()
@@ -804,8 +930,9 @@ class OperatingSession(Session):
         
         spath = "%s/%s" % (template_root, template_name)
         
-        #overwrite existing template
-        if os.path.isdir(spath):
+        #overwrite existing template,
+        #but resume template copy if it has been aborted
+        if os.path.isdir(spath) and not isUnfinishedCopy(spath):
             if not os.access(spath, os.W_OK):
                 self.sendError(
                     ray.Err.GENERAL_ERROR, 
@@ -840,11 +967,11 @@ class OperatingSession(Session):
                           client.net_session_root)
         
         self.setServerStatus(ray.ServerStatus.COPY)
-        self.file_copier.startSessionCopy(self.path, 
-                                          spath, 
-                                          self.saveSessionTemplate_step_1, 
-                                          self.saveSessionTemplateAborted, 
-                                          [template_name, net])
+        self.copy_scheduler.startSessionCopy(self.path, 
+                                             spath, 
+                                             self.saveSessionTemplate_step_1, 
+                                             self.saveSessionTemplateAborted, 
+                                             [template_name, net])
         
     def saveSessionTemplate_step_1(self, template_name, net):
         tp_mode = ray.Template.SESSION_SAVE_NET if net else ray.Template.SESSION_SAVE
@@ -879,7 +1006,8 @@ class OperatingSession(Session):
             template_path = "%s/%s" \
                             % (TemplateRoots.factory_sessions, template_name)
             
-        if not os.path.isdir(template_path):
+        if (not os.path.isdir(template_path)
+                or isUnfinishedCopy(template_path)):
             self.sendError(ray.Err.GENERAL_ERROR, 
                            _translate("error", "No template named %s")
                            % template_name)
@@ -888,7 +1016,7 @@ class OperatingSession(Session):
         new_session_name = basename(new_session_full_name)
         spath = "%s/%s" % (self.root, new_session_full_name)
         
-        if os.path.exists(spath):
+        if os.path.exists(spath) and not isUnfinishedCopy(spath):
             self.sendError(ray.Err.CREATE_FAILED, 
                            _translate("error", "Folder \n%s \nalready exists")
                            % spath)
@@ -901,11 +1029,11 @@ class OperatingSession(Session):
             self.sendGui("/ray/gui/session/name",  
                          new_session_name, new_session_name)
             
-        self.file_copier.startSessionCopy(template_path, 
-                                          spath, 
-                                          self.prepareTemplate_step1, 
-                                          self.prepareTemplateAborted, 
-                                          [new_session_full_name])
+        self.copy_scheduler.startSessionCopy(template_path, 
+                                             spath, 
+                                             self.prepareTemplate_step1, 
+                                             self.prepareTemplateAborted, 
+                                             [new_session_full_name])
         
     def prepareTemplate_step1(self, new_session_full_name):
         self.adjustFilesAfterCopy(new_session_full_name,
@@ -951,6 +1079,10 @@ class OperatingSession(Session):
             return
         
         
+        #clients files start to be read in page cache now,
+        #clients will read them later
+        SessionPrefetcher.instance().prefetch(spath)
+        
         self.message("Attempting to open %s" % spath)
         
         session_ray_file = spath + '/raysession.xml'
@@ -973,7 +1105,6 @@ class OperatingSession(Session):
                 self.sendGui('/ray/opening_nsm_session')
             except:
                 try:
-                    ray_file = open(session_ray_file, 'w')
                     xml = QDomDocument()
                     p = xml.createElement('RAYSESSION')
                     p.setAttribute('VERSION', ray.VERSION)
@@ -984,8 +1115,9 @@ class OperatingSession(Session):
                     
                     xml.appendChild(p)
                     
-                    ray_file.write(xml.toString())
-                    ray_file.close()
+                    if not ray.writeFileAtomically(session_ray_file,
+                                                   xml.toString()):
+                        raise OSError(session_ray_file)
                     
                     ray_file = open(session_ray_file, 'r')
                     
@@ -1004,7 +1136,6 @@ class OperatingSession(Session):
         
         
         self.new_clients = []
-        new_client_exec_args = []
         
         self.setPath(spath)
         
@@ -1045,11 +1176,6 @@ class OperatingSession(Session):
                             continue
                         
                         if tag_name == 'Clients':
-                            if client.auto_start:
-                                new_client_exec_args.append(
-                                    (client.executable_path, 
-                                     client.arguments))
-                            
                             self.new_clients.append(client)
                             
                         elif tag_name == 'RemovedClients':
@@ -1077,32 +1203,21 @@ class OperatingSession(Session):
                     client.client_id       = elements[2]
                     client.prefix_mode     = ray.PrefixMode.CLIENT_NAME
                     self.new_clients.append(client)
-                    new_client_exec_args.append((client.executable_path, ''))
                     
             file.close()
         
         self.message("Commanding unneeded and dumb clients to quit")
         
-        remove_client_list = []
+        #running clients capable of switch (or dumb clients kept alive)
+        #are matched with new clients, others quit.
+        self.switch_plan = planSwitch(self.clients, self.new_clients)
         
-        for client in self.clients:
-            if ((client.active and client.isCapableOf(':switch:')
-                    or (client.isDumbClient() and client.isRunning()))
-                and ((client.running_executable, client.running_arguments)
-                     in new_client_exec_args)):
-                # client will switch
-                # or keep alive if non active and running
-                new_client_exec_args.remove(
-                    (client.running_executable, client.running_arguments))
-                
-            else:
-                # client is not capable of switch, or is not wanted 
-                # in the new session
-                if client.isRunning():
-                    self.expected_clients.append(client)
-                    client.quit()
-                else:
-                    remove_client_list.append(client)
+        for client in self.switch_plan.quit:
+            self.expected_clients.append(client)
+            client.quit()
+        
+        remove_client_list = [client for client in self.clients
+                              if not client.isRunning()]
         
         for client in remove_client_list:
             if client in self.clients:
@@ -1123,26 +1238,14 @@ class OperatingSession(Session):
         has_switch = False
         
         new_client_id_list = []
+        clients_to_launch = []
         
         for new_client in self.new_clients:
             #/* in a duplicated session, clients will have the same
             #* IDs, so be sure to pick the right one to avoid race
             #* conditions in JACK name registration. */
-            for client in self.clients:
-                if (client.client_id == new_client.client_id
-                    and client.running_executable == new_client.executable_path
-                    and client.running_arguments == new_client.arguments):
-                    #we found the good existing client
-                    break
-            else:
-                for client in self.clients:
-                    if (client.running_executable == new_client.executable_path
-                        and client.running_arguments == new_client.arguments):
-                        #we found a switchable client
-                        break
-                else:
-                    client = None
-            
+            #switch plan prefers existing client with the same ID.
+            client = self.switch_plan.runningClientFor(new_client)
             
             if client and client.isRunning():
                 if client.active and not client.isReplyPending():
@@ -1151,22 +1254,22 @@ class OperatingSession(Session):
                     client.switch(new_client)
                     has_switch = True
             else:
-                #* sleep a little bit because liblo derives its sequence
-                #* of port numbers from the system time (second
-                #* resolution) and if too many clients start at once they
-                #* won't be able to find a free port. */
+                #clients are launched by the launch scheduler,
+                #see launch_scheduler.py
                 if not self.addClient(new_client):
                     continue
                     
                 if new_client.auto_start and not self.is_dummy:
-                    self.clients_to_launch.append(new_client)
+                    clients_to_launch.append(new_client)
                     
                     if (not new_client.executable_path
                             in RS.non_active_clients):
                         self.expected_clients.append(new_client)
             
             new_client_id_list.append(new_client.client_id)
-            
+        
+        self.switch_plan = SwitchPlan()
+        
         self.sendGui("/ray/gui/session/name",  self.name, self.name)
         
         
@@ -1184,12 +1287,13 @@ class OperatingSession(Session):
         #* dumb clients will never send an 'announce message', so we need
         #* to give up waiting on them fairly soon. */
         
-        self.timer_launch.start()
+        self.launch_scheduler.launch(clients_to_launch)
         
         self.reOrderClients(new_client_id_list)
         self.sendGui('/ray/gui/clients_reordered', *new_client_id_list)
         
-        self.waitAndGoTo(5000, self.load_step2, ray.WaitFor.ANNOUNCE)
+        self.waitAndGoTo(self.adaptiveTimeout('announce', 5000),
+                         self.load_step2, ray.WaitFor.ANNOUNCE)
     
     def load_step2(self):
         for client in self.expected_clients:
@@ -1208,10 +1312,12 @@ class OperatingSession(Session):
             elif client.isRunning() and client.isDumbClient():
                 client.setStatus(ray.ClientStatus.NOOP)
                 
-        self.waitAndGoTo(10000, self.load_step3, ray.WaitFor.REPLY)
+        self.waitAndGoTo(self.adaptiveTimeout('open', 10000),
+                         self.load_step3, ray.WaitFor.REPLY)
         
     def load_step3(self):
         self.cleanExpected()
+        ClientTimeouts.instance().save()
         
         server = self.getServer()
         if server and server.option_desktops_memory:
@@ -1268,10 +1374,18 @@ class SignaledSession(OperatingSession):
     def __init__(self, root):
         OperatingSession.__init__(self, root)
         
+        #dummy sessions never start clients, they are not sampled
+        self.resource_sampler = ResourceSampler(self)
+        
         signaler.server_new.connect(self.serverNewSession)
         signaler.server_new_from_tp.connect(self.serverNewSessionFromTemplate)
         signaler.server_open.connect(self.serverOpenSession)
         signaler.server_save.connect(self.serverSaveSession)
+        signaler.server_save_dirty.connect(self.serverSaveDirtySession)
+        signaler.server_plan_open.connect(self.serverPlanOpen)
+        signaler.server_take_snapshot.connect(self.serverTakeSnapshot)
+        signaler.server_list_snapshots.connect(self.serverListSnapshots)
+        signaler.server_restore_snapshot.connect(self.serverRestoreSnapshot)
         signaler.server_save_from_client.connect(
             self.serverSaveSessionFromClient)
         signaler.server_rename.connect(self.serverRenameSession)
@@ -1283,6 +1397,8 @@ class SignaledSession(OperatingSession):
         signaler.server_close.connect(self.serverCloseSession)
         signaler.server_abort.connect(self.serverAbortSession)
         signaler.server_list_sessions.connect(self.serverListSessions)
+        signaler.server_list_sessions_page.connect(
+            self.serverListSessionsPage)
         
         signaler.server_reorder_clients.connect(self.serverReorderClients)
         
@@ -1308,6 +1424,7 @@ class SignaledSession(OperatingSession):
         signaler.gui_client_icon.connect(self.guiClientIcon)
         signaler.gui_update_client_properties.connect(
             self.updateClientProperties)
+        signaler.gui_client_scheduling.connect(self.guiClientScheduling)
         
         signaler.gui_trash_restore.connect(self.guiTrashRestore)
         signaler.gui_trash_remove_definitely.connect(
@@ -1316,6 +1433,7 @@ class SignaledSession(OperatingSession):
         signaler.bookmark_option_changed.connect(self.bookmarkOptionChanged)
         
         signaler.copy_aborted.connect(self.abortCopy)
+        signaler.client_copy_aborted.connect(self.abortClientCopy)
         
         signaler.client_net_properties.connect(
             self.setClientNetworkProperties)
@@ -1372,13 +1490,25 @@ class SignaledSession(OperatingSession):
         self.rememberOscArgs(path, args, src_addr)
         self.process_order = [self.save, self.saveDone]
         self.nextFunction()
-        
-    def serverSaveSessionFromClient(self, path, args, src_addr, client_id):
+    
+    def serverSaveDirtySession(self, path, args, src_addr):
         if self.process_order:
             return
+        self.rememberOscArgs(path, args, src_addr)
+        self.process_order = [(self.save, [], True), self.saveDone]
+        self.nextFunction()
+        
+    def serverSaveSessionFromClient(self, path, args, src_addr, client_id):
+        #save is done later by save coalescer, merged with other requests
+        self.save_coalescer.request(path, args, src_addr, client_id)
+    
+    def saveFromClients(self, path, args, src_addr, client_ids):
+        dirty_only = RS.settings.value('daemon/save_from_client_dirty_only',
+                                       True, type=bool)
         
         self.rememberOscArgs(path, args, src_addr)
-        self.process_order = [(self.save, client_id), self.saveDone]
+        self.process_order = [(self.save, client_ids, dirty_only),
+                              self.saveDone]
         self.nextFunction()
         
         
@@ -1396,7 +1526,7 @@ class SignaledSession(OperatingSession):
         if not self.path:
             return
         
-        if self.file_copier.isActive():
+        if self.copy_scheduler.isActive():
             return
         
         if new_session_name == self.name:
@@ -1459,7 +1589,7 @@ class SignaledSession(OperatingSession):
     def serverDuplicateSessionOnly(self, path, args, src_addr):
         if (self.process_order
             or len(args) != 1
-            or self.file_copier.isActive()):
+            or self.copy_scheduler.isActive()):
                 self.oscReply('/ray/net_daemon/duplicate_state', 1)
                 return
         
@@ -1493,18 +1623,115 @@ class SignaledSession(OperatingSession):
                                net)]
         self.nextFunction()
         
+    def serverTakeSnapshot(self, path, args, src_addr):
+        if self.process_order:
+            return
+        
+        self.rememberOscArgs(path, args, src_addr)
+        self.process_order = [(self.save, [], False, args[0]),
+                              self.takeSnapshotDone]
+        self.nextFunction()
+    
+    def serverListSnapshots(self, path, args, src_addr):
+        snapshot_store.list(self.path, self.sendSnapshotsList,
+                            [path, src_addr])
+    
+    def sendSnapshotsList(self, snapshots, path, src_addr):
+        if snapshots is None:
+            self.send(src_addr, '/error', path, ray.Err.SNAPSHOT_FAILED,
+                      "Unable to list snapshots.")
+            return
+        
+        #one message per snapshot: name, label, files count, size in kB
+        for snapshot in snapshots:
+            self.send(src_addr, '/reply_snapshots_list', snapshot.name,
+                      snapshot.label, snapshot.file_count,
+                      snapshot.size // 1024)
+        
+        self.send(src_addr, '/reply', path, "Snapshots listed.")
+    
+    def serverRestoreSnapshot(self, path, args, src_addr):
+        if self.process_order:
+            return
+        
+        snapshot_name = args[0]
+        spath = self.path
+        
+        if (not spath or '/' in snapshot_name
+                or not snapshot_name
+                    in SessionSnapshots(spath).snapshotNames()):
+            self.send(src_addr, '/error', path, ray.Err.NO_SUCH_FILE,
+                      "No snapshot %s to restore." % snapshot_name)
+            return
+        
+        self.rememberOscArgs(path, args, src_addr)
+        #session is saved first, so current state of clients
+        #is in the snapshot taken before restore.
+        #clients are stopped, they would overwrite restored files
+        self.process_order = [self.save,
+                              self.close,
+                              (self.restoreSnapshot, spath, snapshot_name),
+                              (self.load, spath),
+                              self.restoreSnapshotDone]
+        self.nextFunction()
+    
     def serverAbortSession(self, path, args, src_addr):
         self.wait_for = ray.WaitFor.NONE
         self.timer.stop()
+        self.operation_generation += 1
         
         self.rememberOscArgs(path, args, src_addr)
         self.process_order = [self.close, self.abortDone]
         
-        if self.file_copier.isActive():
-            self.file_copier.abort(self.nextFunction, [])
+        if self.copy_scheduler.isActive():
+            self.copy_scheduler.abort(self.nextFunction, [])
         else:
             self.nextFunction()
     
+    def serverPlanOpen(self, path, args, src_addr):
+        #tells which running clients would be kept, switched or quit,
+        #and which clients would be started, if session was opened now.
+        session_full_name = args[0]
+        
+        spath = self.root + '/' + session_full_name
+        if session_full_name.startswith('/'):
+            spath = session_full_name
+        
+        new_clients = readSessionClients(spath)
+        if new_clients is None:
+            self.send(src_addr, '/error', path, ray.Err.NO_SUCH_FILE,
+                      "No session %s to plan." % session_full_name)
+            return
+        
+        plan = planSwitch(self.clients, new_clients)
+        
+        #each set is sent as its name followed by triplets
+        #running client_id, new client_id, executable
+        keep_args   = ['keep']
+        switch_args = ['switch']
+        quit_args   = ['quit']
+        start_args  = ['start']
+        
+        for client, new_client in plan.keep:
+            keep_args += [client.client_id, new_client.client_id,
+                          new_client.executable_path]
+        
+        for client, new_client in plan.switch:
+            switch_args += [client.client_id, new_client.client_id,
+                            new_client.executable_path]
+        
+        for client in plan.quit:
+            quit_args += [client.client_id, '', client.running_executable]
+        
+        for new_client in plan.start:
+            start_args += ['', new_client.client_id,
+                           new_client.executable_path]
+        
+        for plan_args in (keep_args, switch_args, quit_args, start_args):
+            self.send(src_addr, '/reply_plan_open', *plan_args)
+        
+        self.send(src_addr, '/reply', path, "Plan done.")
+    
     def serverListSessions(self, src_addr, with_net):
         if with_net:
             for client in self.clients:
@@ -1517,31 +1744,51 @@ class SignaledSession(OperatingSession):
         
         session_list = []
         
-        for root, dirs, files in os.walk(self.root):
-            #exclude hidden files and dirs
-            files   = [f for f in files if not f.startswith('.')]
-            dirs[:] = [d for d in dirs  if not d.startswith('.')]
-            
-            if root == self.root:
-                continue
+        for basefolder in self.session_index.listSessions(self.root):
+            session_list.append(basefolder)
             
-            already_send = False
-            
-            for file in files:
-                if file in ('raysession.xml', 'session.nsm'):
-                    if not already_send:
-                        basefolder = root.replace(self.root + '/', '', 1)
-                        session_list.append(basefolder)
-                        if len(session_list) == 100:
-                            self.send(src_addr, "/reply_sessions_list",
-                                      *session_list)
-                            
-                            session_list.clear()
-                        already_send = True
-                    
+            if len(session_list) == 100:
+                self.send(src_addr, "/reply_sessions_list", *session_list)
+                session_list.clear()
+        
         if session_list:
             self.send(src_addr, "/reply_sessions_list", *session_list)
         
+    def serverListSessionsPage(self, src_addr, page_size, sort_key, cursor):
+        #reply is "root next_cursor" followed by sessions records,
+        #each one is "name mtime client_count size_in_kB locked".
+        #next_cursor is empty for the last page.
+        if not self.root:
+            self.send(src_addr, '/reply_sessions_page', '', '')
+            return
+        
+        #keep the message small enough for UDP
+        page_size = min(max(1, page_size), 100)
+        
+        locked_paths = []
+        multi_daemon_file = MultiDaemonFile.getInstance()
+        if multi_daemon_file:
+            locked_paths = multi_daemon_file.getAllSessionPaths()
+        
+        #sizes are computed in background, size is -1 if not known yet,
+        #changed sizes are sent later with /reply_session_size.
+        records, next_cursor = self.session_index.listSessionsPage(
+            self.root, page_size, sort_key, cursor, locked_paths,
+            self.sendSessionSize, [self.root, src_addr])
+        
+        reply = [self.root, next_cursor]
+        for record in records:
+            reply += [record.name, record.mtime, record.client_count,
+                      record.size // 1024 if record.size >= 0 else -1,
+                      int(record.locked)]
+        
+        self.send(src_addr, '/reply_sessions_page', *reply)
+    
+    def sendSessionSize(self, session_name, size, root, src_addr):
+        #size is in kB
+        self.send(src_addr, '/reply_session_size', root, session_name,
+                  size // 1024)
+    
     def serverReorderClients(self, path, args):
         client_ids_list = args
         
@@ -1580,104 +1827,65 @@ class SignaledSession(OperatingSession):
             client.start()
     
     def addClientTemplate(self, template_name, factory=False):
+        template = ClientTemplateCatalog.instance().getTemplate(
+            template_name, factory)
+        if template is None:
+            return
+        
+        if factory and template.needed_version:
+            #version is probed in a worker thread, or read from cache
+            version_prober.probe(template.attributes.get('executable', ''),
+                                 self.addClientTemplateVersionChecked,
+                                 [template, factory])
+            return
+        
+        self.addClientTemplateChecked(template, factory)
+    
+    def addClientTemplateVersionChecked(self, program_version,
+                                        template, factory):
+        if not self.path:
+            return
+        
+        if not versionIsEnough(program_version, template.needed_version):
+            return
+        
+        self.addClientTemplateChecked(template, factory)
+    
+    def addClientTemplateChecked(self, template, factory):
         templates_root = TemplateRoots.user_clients
         if factory:
             templates_root = TemplateRoots.factory_clients
-            
-        xml_file = "%s/%s" % (templates_root, 'client_templates.xml')
-        file = open(xml_file, 'r')
-        xml = QDomDocument()
-        xml.setContent(file.read())
-        file.close()
         
-        if xml.documentElement().tagName() != 'RAY-CLIENT-TEMPLATES':
-            return
+        template_name = template.name
+        needed_version = template.needed_version
+        
+        client = Client(self)
+        client.readXmlProperties(template.toXmlElement())
         
-        nodes = xml.documentElement().childNodes()
+        full_name_files = []
         
-        for i in range(nodes.count()):
-            node = nodes.at(i)
-            ct = node.toElement()
-            
-            if ct.tagName() != 'Client-Template':
-                continue
+        if not needed_version: 
+            #if there is a needed version, 
+            #then files are ignored because factory templates with
+            #version must be NSM compatible
+            #and dont need files (factory)
+            template_path = "%s/%s" % (templates_root, template_name)
             
-            if ct.attribute('template-name') == template_name:
-                client = Client(self)
-                client.readXmlProperties(ct)
-                
-                needed_version = ct.attribute('needed-version')
-                
-                if (needed_version.startswith('.')
-                    or needed_version.endswith('.')
-                    or not needed_version.replace('.', '').isdigit()):
-                        #needed-version not writed correctly, ignores it
-                        needed_version = ''
-                
-                if factory and needed_version:
-                    try:
-                        full_program_version = subprocess.check_output(
-                            [client.executable_path, '--version']).decode()
-                    except:
-                        continue
-                    
-                    previous_is_digit = False
-                    program_version = ''
-                    
-                    for character in full_program_version:
-                        if character.isdigit():
-                            program_version+=character
-                            previous_is_digit = True
-                        elif character == '.':
-                            if previous_is_digit:
-                                program_version+=character
-                            previous_is_digit = False
-                        else:
-                            if program_version:
-                                break
-                            
-                    if not program_version:
-                        continue
-                    
-                    
-                    neededs = []
-                    progvss = []
-                    
-                    for n in needed_version.split('.'):
-                        neededs.append(int(n))
-                        
-                    for n in program_version.split('.'):
-                        progvss.append(int(n))
-                    
-                    if neededs > progvss:
-                        node = node.nextSibling()
-                        continue
-                
-                full_name_files = []
-                
-                if not needed_version: 
-                    #if there is a needed version, 
-                    #then files are ignored because factory templates with
-                    #version must be NSM compatible
-                    #and dont need files (factory)
-                    template_path = "%s/%s" % (templates_root, template_name)
+            if os.path.isdir(template_path):
+                for file in os.listdir(template_path):
+                    full_name_files.append("%s/%s"
+                                           % (template_path, file))
                     
-                    if os.path.isdir(template_path):
-                        for file in os.listdir(template_path):
-                            full_name_files.append("%s/%s"
-                                                   % (template_path, file))
-                            
-                if self.addClient(client):
-                    if full_name_files:
-                        client.setStatus(ray.ClientStatus.PRECOPY)
-                        self.file_copier.startClientCopy(
-                            client.client_id, full_name_files, self.path, 
-                            self.addClientTemplate_step_1, 
-                            self.addClientTemplateAborted, [client])
-                    else:
-                        self.addClientTemplate_step_1(client)
-                    
-                break
+        if self.addClient(client):
+            if full_name_files:
+                client.setStatus(ray.ClientStatus.PRECOPY)
+                self.copy_scheduler.startClientCopy(
+                    client.client_id, full_name_files, self.path, 
+                    self.addClientTemplate_step_1, 
+                    self.addClientTemplateAborted, [client],
+                    resumable=False, priority=CopyPriority.NORMAL)
+            else:
+                self.addClientTemplate_step_1(client)
     
     def addClientTemplate_step_1(self, client):
         client.adjustFilesAfterCopy(self.name, ray.Template.CLIENT_LOAD)
@@ -1717,42 +1925,41 @@ class SignaledSession(OperatingSession):
         #we can't be absolutely sure that the announcer is the good one
         #but if client announce a known PID, 
         #we can be sure of which client is announcing
-        for client in self.clients: 
-            if client.pid == pid and not client.active and client.isRunning():
-                client.serverAnnounce(path, args, src_addr, False)
-                break
-        else:
-            n=0
-            for client in self.clients:
-                if (basename(client.executable_path) \
-                        == basename(executable_path)
-                    and not client.active
-                    and client.pending_command == ray.Command.START):
-                        n+=1
-                        if n>1:
-                            break
-            
-            if n==1:
-                for client in self.clients:
-                    if (basename(client.executable_path) \
-                            == basename(executable_path)
-                        and not client.active
-                        and client.pending_command == ray.Command.START):
-                            client.serverAnnounce(path, args, src_addr, False)
-                            break
+        client = self.clients.byPid(pid)
+        
+        if not (client and not client.active and client.isRunning()):
+            client = None
+            pending_clients = [c for c in self.clients
+                               if (not c.active
+                                   and c.pending_command == ray.Command.START)]
+            same_exec_clients = [
+                c for c in pending_clients
+                if basename(c.executable_path) == basename(executable_path)]
+            
+            if len(same_exec_clients) == 1:
+                client = same_exec_clients[0]
             else:
-                for client in self.clients:
-                    if (not client.active
-                        and client.pending_command == ray.Command.START):
-                            if ray.isPidChildOf(pid, client.pid):
-                                client.serverAnnounce(path, args, 
-                                                      src_addr, False)
-                                break
+                #find launched client with pid in announcer ancestors,
+                #in one walk for all clients
+                pending_pids = {}
+                for pending_client in pending_clients:
+                    if pending_client.pid and pid >= pending_client.pid:
+                        pending_pids[pending_client.pid] = pending_client
+                
+                client_pid = ray.ProcessTree.findAncestor(pid, pending_pids)
+                if client_pid:
+                    client = pending_pids[client_pid]
                 
                 #Ray Session won't add clients that aren't launched 
                 #by Ray Session itself. 
+        
+        if client:
+            client.serverAnnounce(path, args, src_addr, False)
+        
+        #next client of launch group can be launched now
+        self.launch_scheduler.check()
             
-        if self.wait_for == ray.WaitFor.ANNOUNCE:
+        if self.wait_for == ray.WaitFor.ANNOUNCE and client:
             self.endTimerIfLastExpected(client)
     
     def serverReply(self, path, args, src_addr):
@@ -1770,6 +1977,16 @@ class SignaledSession(OperatingSession):
             if client.pending_command == ray.Command.SAVE:
                 client.last_save_time = time.time()
             
+            if (client.pending_command in (ray.Command.OPEN,
+                                           ray.Command.SAVE)
+                    and client.command_time):
+                ClientTimeouts.instance().record(
+                    client.executable_path,
+                    'open' if client.pending_command == ray.Command.OPEN
+                        else 'save',
+                    time.time() - client.command_time)
+                client.command_time = 0.00
+            
             client.pending_command = ray.Command.NONE
             
             client.setStatus(ray.ClientStatus.READY)
@@ -1797,10 +2014,9 @@ class SignaledSession(OperatingSession):
     
     def setClientNetworkProperties(self, client_id, 
                                    net_daemon_url, net_session_root):
-        for client in self.clients:
-            if client.client_id == client_id:
-                client.setNetworkProperties(net_daemon_url, net_session_root)
-                break
+        client = self.clients.byId(client_id)
+        if client:
+            client.setNetworkProperties(net_daemon_url, net_session_root)
     
     def setClientNetDuplicateState(self, src_addr, state):
         for client in self.clients:
@@ -1824,88 +2040,86 @@ class SignaledSession(OperatingSession):
             
     
     def guiClientStop(self, path, args):
-        for client in self.clients:
-            if client.client_id == args[0]:
-                client.stop()
-                self.sendGui("/reply", "Client stopped." )
-                break
+        client = self.clients.byId(args[0])
+        if client:
+            client.stop()
+            self.sendGui("/reply", "Client stopped." )
         else:
             self.sendGui("/error", -10, "No such client." )
     
     def guiClientKill(self, path, args):
-        for client in self.clients:
-            if client.client_id == args[0]:
-                client.kill()
-                self.sendGui("/reply", "Client killed." )
-                break
+        client = self.clients.byId(args[0])
+        if client:
+            client.kill()
+            self.sendGui("/reply", "Client killed." )
         else:
             self.sendGui("/error", -10, "No such client." )
     
     def guiClientTrash(self, path, args):
         client_id = args[0]
         
-        for client in self.clients:
-            if client.client_id == client_id:
-                if client.isRunning():
-                    return
-                
-                if self.file_copier.isActive(client_id):
-                    self.file_copier.abort()
-                    return
-                
-                self.trashClient(client)
-                
-                self.sendGui("/reply", "Client removed.")
-                break
-        else:
+        client = self.clients.byId(client_id)
+        if not client:
             self.sendGui("/error", -10, "No such client.")
+            return
+        
+        if client.isRunning():
+            return
+        
+        if self.copy_scheduler.isActive(client_id):
+            self.copy_scheduler.abort(client_id=client_id, discard=True)
+            return
+        
+        self.trashClient(client)
+        
+        self.sendGui("/reply", "Client removed.")
             
     def guiClientResume(self, path, args):
-        for client in self.clients:
-            if client.client_id == args[0] and not client.isRunning():
-                if self.file_copier.isActive(client.client_id):
-                    self.sendGui("/error", -13, "Impossible, copy running")
-                    return
-                
-                client.start()
-                break
+        client = self.clients.byId(args[0])
+        if client and not client.isRunning():
+            if self.copy_scheduler.isActive(client.client_id):
+                self.sendGui("/error", -13, "Impossible, copy running")
+                return
+            
+            client.start()
     
     def guiClientSave(self, path, args):
-        for client in self.clients:
-            if client.client_id == args[0] and client.active:
-                if self.file_copier.isActive(client.client_id):
-                    self.sendGui("/error", -13, "Impossible, copy running")
-                    return
-                client.save()
-                break
+        client = self.clients.byId(args[0])
+        if client and client.active:
+            if self.copy_scheduler.isActive(client.client_id):
+                self.sendGui("/error", -13, "Impossible, copy running")
+                return
+            client.save()
     
     def guiClientSaveTemplate(self, path, args):
-        if self.file_copier.isActive():
+        if (self.copy_scheduler.isActive('')
+                or self.copy_scheduler.isActive(args[0])):
             self.sendGui("/error", -13, "Impossible, copy running")
             return
         
-        for client in self.clients:
-            if client.client_id == args[0]:
-                client.saveAsTemplate(args[1])
-                break
+        client = self.clients.byId(args[0])
+        if client:
+            client.saveAsTemplate(args[1])
     
     def guiClientLabel(self, client_id, label):
-        for client in self.clients:
-            if client.client_id == client_id:
-                client.setLabel(label)
-                break
+        client = self.clients.byId(client_id)
+        if client:
+            client.setLabel(label)
             
+    def guiClientScheduling(self, client_id, scheduling_args):
+        client = self.clients.byId(client_id)
+        if client:
+            client.updateScheduling(scheduling_args)
+    
     def guiClientIcon(self, client_id, icon):
-        for client in self.clients:
-            if client.client_id == client_id:
-                client.setIcon(icon)
-                break
+        client = self.clients.byId(client_id)
+        if client:
+            client.setIcon(icon)
     
     def updateClientProperties(self, client_data):
-        for client in self.clients:
-            if client.client_id == client_data.client_id:
-                client.updateClientProperties(client_data)
-                break
+        client = self.clients.byId(client_data.client_id)
+        if client:
+            client.updateClientProperties(client_data)
     
     def guiTrashRestore(self, client_id):
         for client in self.removed_clients:
@@ -1940,16 +2154,24 @@ class SignaledSession(OperatingSession):
                 self.bookmarker.removeAll(self.path)
     
     def abortCopy(self):
-        self.file_copier.abort()
+        #abort session copy if any, else all client copies
+        if self.copy_scheduler.isActive(''):
+            self.copy_scheduler.abort(client_id='')
+        else:
+            self.copy_scheduler.abort()
+    
+    def abortClientCopy(self, client_id):
+        self.copy_scheduler.abort(client_id=client_id)
     
     def terminate(self):
         if self.terminated_yet:
             return
         
-        if self.file_copier.isActive():
-            self.file_copier.abort()
+        if self.copy_scheduler.isActive():
+            self.copy_scheduler.abort()
         
         self.terminated_yet = True
+        self.operation_generation += 1
         self.process_order = [self.close, self.exitNow]
         self.nextFunction()
 
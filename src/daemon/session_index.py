@@ -0,0 +1,540 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, QFileSystemWatcher, pyqtSignal
+from PyQt5.QtXml import QDomDocument
+
+from copy_engine import MANIFEST_NAME
+from daemon_tools import RS, CommandLineArgs, getAppConfigPath
+
+SESSION_FILES = ('raysession.xml', 'session.nsm')
+
+SORT_KEYS = ('name', 'mtime', 'size', 'clients')
+
+class IndexedDir(object):
+    __slots__ = ['mtime_ns',
+                 'is_session',
+                 'is_unfinished',
+                 'children',
+                 'file_mtime_ns',
+                 'client_count',
+                 'size',
+                 'size_key']
+
+    def __init__(self, mtime_ns=0):
+        self.mtime_ns      = mtime_ns
+        self.is_session    = False
+        self.is_unfinished = False
+        self.children      = []
+
+        #session metadata, valid while session file mtime is file_mtime_ns.
+        #size is valid while size_key is _sizeKey() of session folder.
+        self.file_mtime_ns = 0
+        self.client_count  = 0
+        self.size          = 0
+        self.size_key      = -1
+
+    def keepMetadata(self, other):
+        self.file_mtime_ns = other.file_mtime_ns
+        self.client_count  = other.client_count
+        self.size          = other.size
+        self.size_key      = other.size_key
+
+class SessionRecord(object):
+    __slots__ = ['name',
+                 'mtime',
+                 'client_count',
+                 'size',
+                 'locked']
+
+    def sortValue(self, sort_key):
+        if sort_key == 'name':
+            return self.name
+        if sort_key == 'mtime':
+            return self.mtime
+        if sort_key == 'size':
+            return self.size
+        return self.client_count
+
+def _countClients(session_file):
+    if session_file.endswith('.nsm'):
+        #each line is "name:executable:client_id"
+        with open(session_file, 'r') as file:
+            return len([line for line in file.read().split('\n')
+                        if len(line.split(':')) >= 3])
+
+    with open(session_file, 'r') as file:
+        xml = QDomDocument()
+        xml.setContent(file.read())
+
+    nodes = xml.documentElement().childNodes()
+
+    for i in range(nodes.count()):
+        node = nodes.at(i)
+        if node.toElement().tagName() == 'Clients':
+            return node.childNodes().count()
+
+    return 0
+
+def _sizeKey(dir_path):
+    #latest mtime of session folder and of its direct sub folders
+    #(clients folders), it changes when files are added or removed.
+    try:
+        size_key = os.stat(dir_path).st_mtime_ns
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    size_key = max(size_key,
+                                   entry.stat(follow_symlinks=False).st_mtime_ns)
+    except OSError:
+        return -1
+
+    return size_key
+
+def _computeSize(dir_path, size_key):
+    #runs in worker thread.
+    #returns size_key and size, size is None if size_key didn't change.
+    new_size_key = _sizeKey(dir_path)
+    if new_size_key == size_key:
+        return new_size_key, None
+
+    return new_size_key, _diskUsage(dir_path)
+
+def _diskUsage(dir_path):
+    size = 0
+    to_scan = [dir_path]
+
+    while to_scan:
+        try:
+            entries = list(os.scandir(to_scan.pop()))
+        except OSError:
+            continue
+
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    to_scan.append(entry.path)
+                size += entry.stat(follow_symlinks=False).st_blocks * 512
+            except OSError:
+                continue
+
+    return size
+
+class SessionIndex(QObject):
+    #index of session folders under a session root.
+    #Walk stops in session folders, other folders are only scanned again
+    #when their mtime changed (or when inotify says they changed).
+    #Sessions sizes are computed in a worker thread, known sizes are
+    #given at once and updated later.
+    #Index is saved in config dir to be fast even at daemon start.
+    size_computed = pyqtSignal(str, str, object, object)
+
+    def __init__(self):
+        QObject.__init__(self)
+        self.root = ''
+        self.dirs = {}
+        self.modified = False
+
+        #with daemon/watch_session_root setting, folders are watched
+        #with inotify (QFileSystemWatcher) and not stated while unchanged.
+        self.watcher = None
+        self.watched = set()
+        self.dirty_paths = set()
+
+        #sessions whose size is being computed,
+        #with {rel_path: [(callback, args)]} to call when it changed.
+        self._size_pending = set()
+        self._size_callbacks = {}
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self.size_computed.connect(self.sizeComputed)
+
+    def indexFilePath(self):
+        if CommandLineArgs.config_dir:
+            app_config_path = CommandLineArgs.config_dir
+        else:
+            app_config_path = getAppConfigPath()
+
+        root_hash = hashlib.md5(self.root.encode()).hexdigest()
+        return "%s/session_indexes/%s.xml" % (app_config_path, root_hash)
+
+    def setRoot(self, root):
+        if root == self.root:
+            return
+
+        self.root = root
+        self.dirs.clear()
+        self.dirty_paths.clear()
+
+        #sizes of previous root are ignored when computed
+        self._size_pending.clear()
+        self._size_callbacks.clear()
+
+        if self.watcher is not None:
+            watched = self.watcher.directories()
+            if watched:
+                self.watcher.removePaths(watched)
+
+        self.load()
+
+    def load(self):
+        try:
+            file = open(self.indexFilePath(), 'r')
+            xml = QDomDocument()
+            xml.setContent(file.read())
+            file.close()
+        except:
+            return
+
+        content = xml.documentElement()
+        if (content.tagName() != 'RAY-SESSION-INDEX'
+                or content.attribute('root') != self.root):
+            return
+
+        nodes = content.childNodes()
+
+        for i in range(nodes.count()):
+            el = nodes.at(i).toElement()
+            if el.tagName() != 'Dir':
+                continue
+
+            mtime_ns = el.attribute('mtime')
+            if not mtime_ns.isdigit():
+                continue
+
+            indexed = IndexedDir(int(mtime_ns))
+            indexed.is_session    = bool(el.attribute('session') == '1')
+            indexed.is_unfinished = bool(el.attribute('unfinished') == '1')
+
+            children = el.attribute('children')
+            if children:
+                indexed.children = children.split('/')
+
+            if indexed.is_session:
+                file_mtime_ns = el.attribute('file_mtime')
+                client_count  = el.attribute('clients')
+                size          = el.attribute('size')
+                size_key      = el.attribute('size_key')
+
+                if file_mtime_ns.isdigit() and client_count.isdigit():
+                    indexed.file_mtime_ns = int(file_mtime_ns)
+                    indexed.client_count  = int(client_count)
+
+                if size.isdigit() and size_key.isdigit():
+                    indexed.size          = int(size)
+                    indexed.size_key      = int(size_key)
+
+            self.dirs[el.attribute('path')] = indexed
+
+    def save(self):
+        xml = QDomDocument()
+        content = xml.createElement('RAY-SESSION-INDEX')
+        content.setAttribute('root', self.root)
+
+        for rel_path in sorted(self.dirs):
+            indexed = self.dirs[rel_path]
+            el = xml.createElement('Dir')
+            el.setAttribute('path', rel_path)
+            el.setAttribute('mtime', str(indexed.mtime_ns))
+            if indexed.is_session:
+                el.setAttribute('session', 1)
+            if indexed.is_unfinished:
+                el.setAttribute('unfinished', 1)
+            if indexed.children:
+                el.setAttribute('children', '/'.join(indexed.children))
+            if indexed.is_session and indexed.file_mtime_ns:
+                el.setAttribute('file_mtime', str(indexed.file_mtime_ns))
+                el.setAttribute('clients', indexed.client_count)
+            if indexed.is_session and indexed.size_key >= 0:
+                el.setAttribute('size', str(indexed.size))
+                el.setAttribute('size_key', str(indexed.size_key))
+
+            content.appendChild(el)
+
+        xml.appendChild(content)
+
+        index_path = self.indexFilePath()
+        tmp_path = "%s.tmp" % index_path
+
+        try:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            file = open(tmp_path, 'w')
+            file.write(xml.toString())
+            file.close()
+            os.replace(tmp_path, index_path)
+        except:
+            return
+
+        self.modified = False
+
+    def dirChanged(self, path):
+        self.dirty_paths.add(path)
+
+    def startWatcher(self):
+        if self.watcher is None:
+            self.watcher = QFileSystemWatcher()
+            self.watcher.directoryChanged.connect(self.dirChanged)
+
+    def fullPath(self, rel_path):
+        if not rel_path:
+            return self.root
+        return "%s/%s" % (self.root, rel_path)
+
+    def scanDir(self, rel_path, watching):
+        path = self.fullPath(rel_path)
+        indexed = self.dirs.get(rel_path)
+
+        #dir is watched and didn't change, no need to stat it
+        if (watching and indexed is not None
+                and not path in self.dirty_paths
+                and path in self.watched):
+            return indexed
+
+        self.dirty_paths.discard(path)
+
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+        if indexed is not None and indexed.mtime_ns == mtime_ns:
+            return indexed
+
+        old_indexed = indexed
+        indexed = IndexedDir(mtime_ns)
+        if old_indexed is not None:
+            indexed.keepMetadata(old_indexed)
+
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        if entry.name == MANIFEST_NAME:
+                            indexed.is_unfinished = True
+                        continue
+
+                    try:
+                        if (entry.is_dir()
+                                and not entry.is_symlink()):
+                            indexed.children.append(entry.name)
+                        elif (rel_path
+                                and entry.name in SESSION_FILES
+                                and entry.is_file()):
+                            indexed.is_session = True
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+
+        indexed.children.sort()
+        self.modified = True
+        return indexed
+
+    def listSessions(self, root):
+        #returns relative paths of sessions under root
+        self.setRoot(root)
+
+        watching = bool(RS.settings.value('daemon/watch_session_root',
+                                          True, type=bool))
+        if watching:
+            self.startWatcher()
+            self.watched = set(self.watcher.directories())
+        else:
+            self.watched = set()
+
+        sessions = []
+        new_dirs = {}
+        to_scan = ['']
+
+        while to_scan:
+            rel_path = to_scan.pop()
+            indexed = self.scanDir(rel_path, watching)
+            if indexed is None:
+                continue
+
+            new_dirs[rel_path] = indexed
+
+            if rel_path and indexed.is_unfinished:
+                #aborted duplicate, not a session to open
+                continue
+
+            if indexed.is_session:
+                #don't search sessions in session folders
+                sessions.append(rel_path)
+                continue
+
+            for child in reversed(indexed.children):
+                if rel_path:
+                    to_scan.append("%s/%s" % (rel_path, child))
+                else:
+                    to_scan.append(child)
+
+        if len(new_dirs) != len(self.dirs):
+            self.modified = True
+
+        self.dirs = new_dirs
+
+        if watching:
+            paths = set([self.fullPath(rel_path) for rel_path in new_dirs])
+
+            removed = self.watched - paths
+            if removed:
+                self.watcher.removePaths(list(removed))
+
+            added = paths - self.watched
+            if added:
+                self.watcher.addPaths(list(added))
+
+        if self.modified:
+            self.save()
+
+        return sessions
+
+    def _runSize(self, root, rel_path, size_key):
+        try:
+            size_key, size = _computeSize(
+                "%s/%s" % (root, rel_path), size_key)
+        except Exception:
+            size_key, size = -1, None
+
+        self.size_computed.emit(root, rel_path, size_key, size)
+
+    def requestSize(self, rel_path, callback=None, args=[]):
+        #returns last known size, -1 if unknown.
+        #Size is checked in worker thread, callback(rel_path, size, *args)
+        #is called in main thread if it changed.
+        indexed = self.dirs[rel_path]
+
+        if callback is not None:
+            if not rel_path in self._size_callbacks:
+                self._size_callbacks[rel_path] = []
+            self._size_callbacks[rel_path].append((callback, args))
+
+        if not rel_path in self._size_pending:
+            self._size_pending.add(rel_path)
+            self._executor.submit(self._runSize, self.root, rel_path,
+                                  indexed.size_key)
+
+        if indexed.size_key < 0:
+            return -1
+        return indexed.size
+
+    def sizeComputed(self, root, rel_path, size_key, size):
+        if root != self.root:
+            return
+
+        self._size_pending.discard(rel_path)
+        callbacks = self._size_callbacks.pop(rel_path, [])
+
+        indexed = self.dirs.get(rel_path)
+        if indexed is None or size is None:
+            return
+
+        indexed.size = size
+        indexed.size_key = size_key
+        self.modified = True
+
+        for callback, args in callbacks:
+            callback(rel_path, size, *args)
+
+    def sessionRecord(self, rel_path, locked_paths):
+        indexed = self.dirs[rel_path]
+        path = self.fullPath(rel_path)
+
+        for session_file in ("%s/%s" % (path, f) for f in SESSION_FILES):
+            try:
+                file_mtime_ns = os.stat(session_file).st_mtime_ns
+            except OSError:
+                continue
+            break
+        else:
+            return None
+
+        if file_mtime_ns != indexed.file_mtime_ns:
+            try:
+                indexed.client_count = _countClients(session_file)
+            except:
+                indexed.client_count = 0
+
+            indexed.file_mtime_ns = file_mtime_ns
+            self.modified = True
+
+        record = SessionRecord()
+        record.name         = rel_path
+        record.mtime        = file_mtime_ns // 1000000000
+        record.client_count = indexed.client_count
+        record.size         = -1
+        record.locked       = bool(path in locked_paths
+                                   or os.path.isfile(path + '/.lock'))
+        return record
+
+    def listSessionsPage(self, root, page_size, sort_key, cursor,
+                         locked_paths=[], size_callback=None, args=[]):
+        #sort_key is one of SORT_KEYS, prefixed with '-' for descending.
+        #cursor is the one returned with previous page, empty for first page.
+        #returns a list of SessionRecord and the cursor of next page,
+        #empty if this page is the last one.
+        #Records have last known sizes (-1 if unknown), new sizes of page
+        #sessions are given later with size_callback(rel_path, size, *args).
+        #Sort by size uses last known sizes.
+        reverse = sort_key.startswith('-')
+        sort_key = sort_key.lstrip('-')
+        if not sort_key in SORT_KEYS:
+            sort_key = 'name'
+
+        sessions = self.listSessions(root)
+        sort_by_size = bool(sort_key == 'size')
+
+        records = []
+        for rel_path in sessions:
+            record = self.sessionRecord(rel_path, locked_paths)
+            if record is None:
+                continue
+
+            if sort_by_size:
+                indexed = self.dirs[rel_path]
+                if indexed.size_key >= 0:
+                    record.size = indexed.size
+
+            records.append(record)
+
+        records.sort(key=lambda r: (r.sortValue(sort_key), r.name),
+                     reverse=reverse)
+
+        if cursor:
+            #cursor is "sort_value name" of the last sent record,
+            #it stays valid even if sessions have been added or removed.
+            value, space, name = cursor.partition(' ')
+            if sort_key != 'name':
+                try:
+                    value = int(value)
+                except ValueError:
+                    value = 0
+            else:
+                value = name
+
+            cursor_value = (value, name)
+
+            if reverse:
+                records = [r for r in records
+                           if (r.sortValue(sort_key), r.name) < cursor_value]
+            else:
+                records = [r for r in records
+                           if (r.sortValue(sort_key), r.name) > cursor_value]
+
+        page = records[:max(1, page_size)]
+
+        for record in page:
+            record.size = self.requestSize(record.name, size_callback, args)
+
+        if self.modified:
+            self.save()
+
+        next_cursor = ''
+        if len(records) > len(page):
+            last = page[-1]
+            if sort_key == 'name':
+                next_cursor = "0 %s" % last.name
+            else:
+                next_cursor = "%i %s" % (last.sortValue(sort_key), last.name)
+
+        return page, next_cursor
@@ -16,8 +16,14 @@ class Signaler(QObject):
     server_new_from_tp = pyqtSignal(str, list, object, bool)
     server_open        = pyqtSignal(str, list, object)
     server_save        = pyqtSignal(str, list, object)
+    server_save_dirty  = pyqtSignal(str, list, object)
     server_save_from_client = pyqtSignal(str, list, object, str)
     server_list_sessions = pyqtSignal(object, bool)
+    server_plan_open   = pyqtSignal(str, list, object)
+    server_take_snapshot    = pyqtSignal(str, list, object)
+    server_list_snapshots   = pyqtSignal(str, list, object)
+    server_restore_snapshot = pyqtSignal(str, list, object)
+    server_list_sessions_page = pyqtSignal(object, int, str, str)
     server_add       = pyqtSignal(str, list, object)
     server_add_proxy = pyqtSignal(str, list, object)
     server_add_client_template = pyqtSignal(str, list, object)
@@ -33,7 +39,9 @@ class Signaler(QObject):
     gui_client_label = pyqtSignal(str, str)
     gui_client_icon  = pyqtSignal(str, str)
     gui_update_client_properties = pyqtSignal(object)
+    gui_client_scheduling = pyqtSignal(str, list)
     copy_aborted = pyqtSignal()
+    client_copy_aborted = pyqtSignal(str)
     gui_trash_restore           = pyqtSignal(str)
     gui_trash_remove_definitely = pyqtSignal(str)
     
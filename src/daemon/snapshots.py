@@ -0,0 +1,521 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from copy_engine import SNAPSHOTS_DIR, cloneData
+from daemon_tools import RS
+
+#in SNAPSHOTS_DIR of session folder, objects/ contains files contents
+#named by their hash, manifests/ contains one manifest per snapshot.
+
+#per file "size mtime_ns inode hash rel_path",
+#an unchanged file is not read again to know its hash.
+STAT_CACHE_NAME = 'stat_cache'
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+DEFAULT_KEEP_LAST = 10
+DEFAULT_KEEP_DAYS = 30
+
+instance = None
+
+class SnapshotInfo(object):
+    __slots__ = ['name',
+                 'label',
+                 'time',
+                 'file_count',
+                 'size']
+
+def _isExcluded(rel_path):
+    #daemon files are not part of session state
+    top_name = rel_path.partition('/')[0]
+    return bool(top_name.startswith('.ray-') or top_name == '.lock')
+
+def _newSnapshotName(manifests_dir):
+    name = time.strftime('%Y%m%d-%H%M%S')
+    snapshot_name = name
+    n = 1
+
+    while os.path.exists("%s/%s" % (manifests_dir, snapshot_name)):
+        n += 1
+        snapshot_name = "%s-%i" % (name, n)
+
+    return snapshot_name
+
+class SessionSnapshots(object):
+    #content-addressed snapshot store of a session folder.
+    #A file is stored once whatever the count of snapshots containing it,
+    #so a snapshot of an unchanged session only costs its manifest.
+    #Not thread safe, it is only used in the SnapshotStore worker,
+    #except snapshotNames() which only lists manifests.
+    def __init__(self, session_path):
+        self.session_path = session_path
+        self.store_dir = "%s/%s" % (session_path, SNAPSHOTS_DIR)
+        self.objects_dir = "%s/objects" % self.store_dir
+        self.manifests_dir = "%s/manifests" % self.store_dir
+
+    def objectPath(self, file_hash):
+        return "%s/%s/%s" % (self.objects_dir, file_hash[:2], file_hash[2:])
+
+    def _readStatCache(self):
+        stat_cache = {}
+
+        try:
+            file = open("%s/%s" % (self.store_dir, STAT_CACHE_NAME), 'r')
+            contents = file.read()
+            file.close()
+        except OSError:
+            return stat_cache
+
+        for line in contents.split('\n'):
+            elements = line.split(' ', 4)
+            if len(elements) != 5:
+                continue
+
+            try:
+                stat_cache[elements[4]] = (int(elements[0]), int(elements[1]),
+                                           int(elements[2]), elements[3])
+            except ValueError:
+                continue
+
+        return stat_cache
+
+    def _writeStatCache(self, stat_cache):
+        cache_path = "%s/%s" % (self.store_dir, STAT_CACHE_NAME)
+        tmp_path = "%s.tmp" % cache_path
+
+        with open(tmp_path, 'w') as file:
+            for rel_path in sorted(stat_cache):
+                size, mtime_ns, inode, file_hash = stat_cache[rel_path]
+                file.write("%i %i %i %s %s\n"
+                           % (size, mtime_ns, inode, file_hash, rel_path))
+
+        os.replace(tmp_path, cache_path)
+
+    def _storeObject(self, file_path):
+        #clones file in objects when filesystem allows it, so object
+        #shares its data with the file, else copies it.
+        #File is hashed while reading. returns hash of file.
+        os.makedirs(self.objects_dir, exist_ok=True)
+        tmp_path = "%s/tmp-%i-%i" % (self.objects_dir, os.getpid(),
+                                     threading.get_ident())
+        file_hash = hashlib.blake2b(digest_size=20)
+
+        try:
+            with open(file_path, 'rb') as orig_file:
+                with open(tmp_path, 'w+b') as tmp_file:
+                    if cloneData(orig_file.fileno(), tmp_file.fileno()):
+                        #hash the clone, file may be written meanwhile
+                        while True:
+                            data = tmp_file.read(CHUNK_SIZE)
+                            if not data:
+                                break
+                            file_hash.update(data)
+                    else:
+                        while True:
+                            data = orig_file.read(CHUNK_SIZE)
+                            if not data:
+                                break
+                            file_hash.update(data)
+                            tmp_file.write(data)
+
+                    tmp_file.flush()
+                    os.fsync(tmp_file.fileno())
+
+            object_path = self.objectPath(file_hash.hexdigest())
+
+            if os.path.exists(object_path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.chmod(tmp_path, 0o444)
+                os.replace(tmp_path, object_path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return file_hash.hexdigest()
+
+    def _storeData(self, data):
+        file_hash = hashlib.blake2b(data, digest_size=20).hexdigest()
+        object_path = self.objectPath(file_hash)
+
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            tmp_path = "%s.tmp" % object_path
+            with open(tmp_path, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, object_path)
+
+        return file_hash
+
+    def _walk(self):
+        #yields (rel_path, DirEntry) of session folder, parents first
+        to_scan = ['']
+
+        while to_scan:
+            rel_dir = to_scan.pop()
+            dir_path = self.session_path
+            if rel_dir:
+                dir_path = "%s/%s" % (self.session_path, rel_dir)
+
+            try:
+                entries = sorted(os.scandir(dir_path), key=lambda e: e.name)
+            except OSError:
+                continue
+
+            for entry in entries:
+                if rel_dir:
+                    rel_path = "%s/%s" % (rel_dir, entry.name)
+                else:
+                    rel_path = entry.name
+
+                if _isExcluded(rel_path):
+                    continue
+
+                yield rel_path, entry
+
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        to_scan.append(rel_path)
+                except OSError:
+                    continue
+
+    def take(self, label=''):
+        #returns name of the new snapshot
+        os.makedirs(self.manifests_dir, exist_ok=True)
+
+        old_cache = self._readStatCache()
+        stat_cache = {}
+        lines = []
+
+        for rel_path, entry in self._walk():
+            try:
+                entry_stat = entry.stat(follow_symlinks=False)
+
+                if entry.is_symlink():
+                    file_hash = self._storeData(
+                        os.readlink(entry.path).encode())
+                    lines.append("l %s %o 0 0 %s"
+                                 % (file_hash, entry_stat.st_mode & 0o7777,
+                                    rel_path))
+
+                elif entry.is_dir(follow_symlinks=False):
+                    lines.append("d - %o 0 0 %s"
+                                 % (entry_stat.st_mode & 0o7777, rel_path))
+
+                elif entry.is_file(follow_symlinks=False):
+                    stat_key = (entry_stat.st_size, entry_stat.st_mtime_ns,
+                                entry_stat.st_ino)
+                    cached = old_cache.get(rel_path)
+
+                    if (cached is not None and cached[:3] == stat_key
+                            and os.path.exists(self.objectPath(cached[3]))):
+                        file_hash = cached[3]
+                    else:
+                        file_hash = self._storeObject(entry.path)
+
+                    stat_cache[rel_path] = stat_key + (file_hash,)
+                    lines.append("f %s %o %i %i %s"
+                                 % (file_hash, entry_stat.st_mode & 0o7777,
+                                    entry_stat.st_size,
+                                    entry_stat.st_mtime_ns, rel_path))
+            except OSError:
+                #file removed or unreadable during snapshot
+                continue
+
+        snapshot_name = _newSnapshotName(self.manifests_dir)
+        manifest_path = "%s/%s" % (self.manifests_dir, snapshot_name)
+        tmp_path = "%s.tmp" % manifest_path
+
+        with open(tmp_path, 'w') as file:
+            file.write("#time %i\n" % int(time.time()))
+            file.write("#label %s\n" % label.replace('\n', ' '))
+            for line in lines:
+                file.write(line + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(tmp_path, manifest_path)
+        self._writeStatCache(stat_cache)
+
+        return snapshot_name
+
+    def _readManifest(self, snapshot_name):
+        #returns SnapshotInfo and list of
+        #(type, hash, mode, size, mtime_ns, rel_path)
+        with open("%s/%s" % (self.manifests_dir, snapshot_name), 'r') as file:
+            contents = file.read()
+
+        info = SnapshotInfo()
+        info.name = snapshot_name
+        info.label = ''
+        info.time = 0
+        info.file_count = 0
+        info.size = 0
+        entries = []
+
+        for line in contents.split('\n'):
+            if line.startswith('#time '):
+                if line[6:].isdigit():
+                    info.time = int(line[6:])
+                continue
+
+            if line.startswith('#label '):
+                info.label = line[7:]
+                continue
+
+            elements = line.split(' ', 5)
+            if len(elements) != 6 or not elements[0] in ('f', 'd', 'l'):
+                continue
+
+            try:
+                entry = (elements[0], elements[1], int(elements[2], 8),
+                         int(elements[3]), int(elements[4]), elements[5])
+            except ValueError:
+                continue
+
+            if entry[0] == 'f':
+                info.file_count += 1
+                info.size += entry[3]
+
+            entries.append(entry)
+
+        return info, entries
+
+    def snapshotNames(self):
+        try:
+            return sorted([name for name in os.listdir(self.manifests_dir)
+                           if not name.endswith('.tmp')])
+        except OSError:
+            return []
+
+    def listSnapshots(self):
+        snapshots = []
+
+        for snapshot_name in self.snapshotNames():
+            try:
+                info, entries = self._readManifest(snapshot_name)
+            except OSError:
+                continue
+            snapshots.append(info)
+
+        return snapshots
+
+    def restore(self, snapshot_name):
+        #session folder gets back the state of the snapshot.
+        #Files not in snapshot are removed, unchanged files are not touched.
+        info, entries = self._readManifest(snapshot_name)
+        old_cache = self._readStatCache()
+        stat_cache = {}
+        wanted = set()
+
+        for entry_type, file_hash, mode, size, mtime_ns, rel_path in entries:
+            wanted.add(rel_path)
+            path = "%s/%s" % (self.session_path, rel_path)
+
+            if entry_type == 'd':
+                if os.path.islink(path) or os.path.isfile(path):
+                    os.remove(path)
+                os.makedirs(path, exist_ok=True)
+                os.chmod(path, mode)
+                continue
+
+            if entry_type == 'l':
+                with open(self.objectPath(file_hash), 'rb') as file:
+                    target = file.read().decode()
+
+                if os.path.islink(path) and os.readlink(path) == target:
+                    continue
+
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                elif os.path.lexists(path):
+                    os.remove(path)
+
+                os.symlink(target, path)
+                continue
+
+            try:
+                path_stat = os.lstat(path)
+            except OSError:
+                path_stat = None
+
+            if path_stat is not None:
+                cached = old_cache.get(rel_path)
+                if (cached is not None
+                        and cached == (path_stat.st_size,
+                                       path_stat.st_mtime_ns,
+                                       path_stat.st_ino, file_hash)):
+                    #file is already the one of the snapshot
+                    stat_cache[rel_path] = cached
+                    continue
+
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+
+            tmp_path = "%s.ray-restore" % path
+            shutil.copyfile(self.objectPath(file_hash), tmp_path)
+            os.chmod(tmp_path, mode)
+            os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+            os.replace(tmp_path, path)
+
+            path_stat = os.lstat(path)
+            stat_cache[rel_path] = (path_stat.st_size, path_stat.st_mtime_ns,
+                                    path_stat.st_ino, file_hash)
+
+        #remove what is not in snapshot, deepest paths first
+        for rel_path, entry in reversed(list(self._walk())):
+            if rel_path in wanted:
+                continue
+
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
+            except OSError:
+                continue
+
+        self._writeStatCache(stat_cache)
+
+    def collectGarbage(self, keep_last, keep_days):
+        #keeps the keep_last last snapshots, and the last snapshot of each
+        #day of the last keep_days days. Then removes unused objects.
+        snapshots = self.listSnapshots()
+        snapshots.sort(key=lambda s: (s.time, s.name))
+
+        kept = set([s.name for s in snapshots[-keep_last:]])
+        days = set()
+        min_time = time.time() - keep_days * 86400
+
+        for snapshot in reversed(snapshots):
+            if snapshot.time < min_time:
+                break
+
+            day = time.strftime('%Y%m%d', time.localtime(snapshot.time))
+            if not day in days:
+                days.add(day)
+                kept.add(snapshot.name)
+
+        for snapshot in snapshots:
+            if not snapshot.name in kept:
+                try:
+                    os.remove("%s/%s" % (self.manifests_dir, snapshot.name))
+                except OSError:
+                    pass
+
+        used = set()
+        for snapshot_name in self.snapshotNames():
+            try:
+                info, entries = self._readManifest(snapshot_name)
+            except OSError:
+                #can't know which objects are used, remove nothing
+                return
+            for entry in entries:
+                if entry[0] in ('f', 'l'):
+                    used.add(entry[1])
+
+        try:
+            prefixes = os.listdir(self.objects_dir)
+        except OSError:
+            return
+
+        for prefix in prefixes:
+            prefix_dir = "%s/%s" % (self.objects_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+
+            for name in os.listdir(prefix_dir):
+                if not prefix + name in used:
+                    try:
+                        os.remove("%s/%s" % (prefix_dir, name))
+                    except OSError:
+                        continue
+
+class SnapshotStore(QObject):
+    #runs snapshots operations in one low priority worker thread,
+    #calls callback(result, *args) in main thread when done.
+    #result is None if operation failed.
+    done = pyqtSignal(int, object)
+
+    def __init__(self):
+        QObject.__init__(self)
+        self._callbacks = {}
+        self._last_job = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        self.done.connect(self.jobDone)
+
+        global instance
+        instance = self
+
+    @staticmethod
+    def instance():
+        global instance
+
+        if not instance:
+            instance = SnapshotStore()
+        return instance
+
+    def _run(self, job, function, args):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 15)
+        except (AttributeError, OSError):
+            pass
+
+        try:
+            result = function(*args)
+        except Exception:
+            result = None
+
+        self.done.emit(job, result)
+
+    def _submit(self, function, args, callback, callback_args):
+        with self._lock:
+            self._last_job += 1
+            job = self._last_job
+
+        if callback is not None:
+            self._callbacks[job] = (callback, callback_args)
+
+        self._executor.submit(self._run, job, function, args)
+
+    def _takeAndCollect(self, session_path, label):
+        snapshots = SessionSnapshots(session_path)
+        snapshot_name = snapshots.take(label)
+        snapshots.collectGarbage(
+            max(1, RS.settings.value('daemon/snapshots_keep_last',
+                                     DEFAULT_KEEP_LAST, type=int)),
+            max(0, RS.settings.value('daemon/snapshots_keep_days',
+                                     DEFAULT_KEEP_DAYS, type=int)))
+        return snapshot_name
+
+    def take(self, session_path, label='', callback=None, args=[]):
+        self._submit(self._takeAndCollect, (session_path, label),
+                     callback, args)
+
+    def restore(self, session_path, snapshot_name, callback=None, args=[]):
+        def restore():
+            snapshots = SessionSnapshots(session_path)
+            #current state can be restored back
+            snapshots.take('before restore %s' % snapshot_name)
+            snapshots.restore(snapshot_name)
+            return snapshot_name
+
+        self._submit(restore, (), callback, args)
+
+    def list(self, session_path, callback=None, args=[]):
+        self._submit(SessionSnapshots(session_path).listSnapshots, (),
+                     callback, args)
+
+    def jobDone(self, job, result):
+        if job in self._callbacks:
+            callback, args = self._callbacks.pop(job)
+            callback(result, *args)
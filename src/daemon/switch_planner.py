@@ -0,0 +1,158 @@
+from PyQt5.QtXml import QDomDocument
+
+class PlannedClient(object):
+    #light client read from a session file,
+    #with only the attributes needed to plan a switch.
+    __slots__ = ['client_id',
+                 'executable_path',
+                 'arguments',
+                 'auto_start']
+
+    def __init__(self, client_id, executable_path, arguments, auto_start):
+        self.client_id       = client_id
+        self.executable_path = executable_path
+        self.arguments       = arguments
+        self.auto_start      = auto_start
+
+class SwitchPlan(object):
+    #keep:   (running, new) pairs, running client reused with same client_id
+    #switch: (running, new) pairs, running client switches to another id
+    #quit:   running clients not wanted in new session
+    #start:  new clients to launch
+    def __init__(self):
+        self.keep    = []
+        self.switch  = []
+        self.quit    = []
+        self.start   = []
+        self.matches = {}
+
+    def runningClientFor(self, new_client):
+        return self.matches.get(id(new_client))
+
+def readSessionClients(spath):
+    #returns PlannedClient list of session at spath, None if no session
+    try:
+        file = open(spath + '/raysession.xml', 'r')
+        xml = QDomDocument()
+        xml.setContent(file.read())
+        file.close()
+    except:
+        xml = None
+
+    planned_clients = []
+    client_ids = set()
+
+    if xml is None:
+        try:
+            file = open(spath + '/session.nsm', 'r')
+            contents = file.read()
+            file.close()
+        except:
+            return None
+
+        for line in contents.split('\n'):
+            elements = line.split(':')
+            if len(elements) >= 3 and not elements[2] in client_ids:
+                client_ids.add(elements[2])
+                planned_clients.append(
+                    PlannedClient(elements[2], elements[1], '', True))
+
+        return planned_clients
+
+    content = xml.documentElement()
+    if content.tagName() != "RAYSESSION":
+        return None
+
+    nodes = content.childNodes()
+
+    for i in range(nodes.count()):
+        node = nodes.at(i)
+        if node.toElement().tagName() != 'Clients':
+            continue
+
+        clients_xml = node.childNodes()
+
+        for j in range(clients_xml.count()):
+            cx = clients_xml.at(j).toElement()
+            client_id = cx.attribute('id')
+            if client_id in client_ids:
+                continue
+
+            client_ids.add(client_id)
+            planned_clients.append(
+                PlannedClient(client_id,
+                              cx.attribute('executable'),
+                              cx.attribute('arguments'),
+                              bool(cx.attribute('launched') != '0')))
+
+    return planned_clients
+
+def planSwitch(clients, new_clients):
+    #match running clients with auto started clients of new session.
+    #Running clients are indexed by (executable, arguments, client_id)
+    #and by (executable, arguments), a running client is matched once,
+    #preferably with the new client which has the same client_id.
+    plan = SwitchPlan()
+
+    by_id = {}
+    by_exec = {}
+
+    for client in clients:
+        if not client.isRunning():
+            continue
+
+        if not ((client.active and client.isCapableOf(':switch:'))
+                or client.isDumbClient()):
+            plan.quit.append(client)
+            continue
+
+        exec_args = (client.running_executable, client.running_arguments)
+        key = exec_args + (client.client_id,)
+
+        if not key in by_id:
+            by_id[key] = []
+        by_id[key].append(client)
+
+        if not exec_args in by_exec:
+            by_exec[exec_args] = []
+        by_exec[exec_args].append(client)
+
+    matched = set()
+    wanted = [c for c in new_clients if c.auto_start]
+    unmatched = []
+
+    for new_client in wanted:
+        key = (new_client.executable_path, new_client.arguments,
+               new_client.client_id)
+
+        for client in by_id.get(key, []):
+            if not id(client) in matched:
+                matched.add(id(client))
+                plan.matches[id(new_client)] = client
+                plan.keep.append((client, new_client))
+                break
+        else:
+            unmatched.append(new_client)
+
+    for new_client in unmatched:
+        exec_args = (new_client.executable_path, new_client.arguments)
+
+        for client in by_exec.get(exec_args, []):
+            if not id(client) in matched:
+                matched.add(id(client))
+                plan.matches[id(new_client)] = client
+                if client.isDumbClient():
+                    #dumb client can't switch, it is only kept alive
+                    plan.keep.append((client, new_client))
+                else:
+                    plan.switch.append((client, new_client))
+                break
+        else:
+            plan.start.append(new_client)
+
+    for client_list in by_exec.values():
+        for client in client_list:
+            if not id(client) in matched:
+                plan.quit.append(client)
+
+    return plan
@@ -0,0 +1,167 @@
+import os
+import threading
+from PyQt5.QtXml import QDomDocument
+
+from daemon_tools import TemplateRoots
+from executable_index import ExecutableIndex
+
+instance = None
+
+class ClientTemplate(object):
+    __slots__ = ['name',
+                 'attributes',
+                 'try_exec_list',
+                 'needed_version']
+
+    def toXmlElement(self):
+        #returns a new 'Client-Template' element for this template,
+        #for Client.readXmlProperties
+        xml = QDomDocument()
+        ct = xml.createElement('Client-Template')
+        for attribute, value in self.attributes.items():
+            ct.setAttribute(attribute, value)
+
+        xml.appendChild(ct)
+        return ct
+
+class ClientTemplateCatalog(object):
+    #client templates of client_templates.xml files, kept in memory.
+    #A file is parsed again only if it changed, and templates available
+    #on this system are found again only if file or $PATH changed.
+    #Catalog is used from OSC thread and from main thread, so it keeps
+    #python data only, no xml nodes.
+    def __init__(self):
+        self._files = {}
+        self._available = {}
+        self._lock = threading.Lock()
+
+        global instance
+        instance = self
+
+    @staticmethod
+    def instance():
+        global instance
+
+        if not instance:
+            instance = ClientTemplateCatalog()
+        return instance
+
+    def templatesRoot(self, factory):
+        if factory:
+            return TemplateRoots.factory_clients
+        return TemplateRoots.user_clients
+
+    def _readFile(self, templates_file):
+        templates = []
+        template_names = set()
+
+        try:
+            file = open(templates_file, 'r')
+            xml = QDomDocument()
+            xml.setContent(file.read())
+            file.close()
+        except:
+            return templates
+
+        content = xml.documentElement()
+
+        if content.tagName() != "RAY-CLIENT-TEMPLATES":
+            return templates
+
+        nodes = content.childNodes()
+
+        for i in range(nodes.count()):
+            ct = nodes.at(i).toElement()
+            if ct.tagName() != 'Client-Template':
+                continue
+
+            template_name = ct.attribute('template-name')
+
+            if not template_name or template_name in template_names:
+                continue
+
+            template = ClientTemplate()
+            template.name = template_name
+            template.attributes = {}
+
+            attributes = ct.attributes()
+            for j in range(attributes.count()):
+                attribute = attributes.item(j).toAttr()
+                template.attributes[attribute.name()] = attribute.value()
+
+            template.try_exec_list = []
+            try_exec_line = ct.attribute('try-exec')
+            if try_exec_line:
+                template.try_exec_list = try_exec_line.split(';')
+
+            needed_version = ct.attribute('needed-version')
+            if (needed_version.startswith('.')
+                    or needed_version.endswith('.')
+                    or not needed_version.replace('.', '').isdigit()):
+                #needed-version not writed correctly, ignores it
+                needed_version = ''
+
+            template.needed_version = needed_version
+
+            template_names.add(template_name)
+            templates.append(template)
+
+        return templates
+
+    def _fileTemplates(self, factory):
+        #returns templates of file and the key of file state
+        templates_file = "%s/%s" % (self.templatesRoot(factory),
+                                    'client_templates.xml')
+
+        try:
+            file_stat = os.stat(templates_file)
+        except OSError:
+            self._files.pop(factory, None)
+            return [], None
+
+        file_key = (file_stat.st_mtime_ns, file_stat.st_size,
+                    file_stat.st_ino)
+
+        cached = self._files.get(factory)
+        if cached is not None and cached[0] == file_key:
+            return cached[1], file_key
+
+        templates = self._readFile(templates_file)
+        self._files[factory] = (file_key, templates)
+        return templates, file_key
+
+    def getTemplate(self, template_name, factory):
+        with self._lock:
+            templates, file_key = self._fileTemplates(factory)
+
+        for template in templates:
+            if template.name == template_name:
+                return template
+
+    def availableTemplates(self, factory):
+        #templates whose executable and try-exec are all in $PATH
+        executable_index = ExecutableIndex.instance()
+
+        with self._lock:
+            templates, file_key = self._fileTemplates(factory)
+            path_key = executable_index.pathState()
+
+            cached = self._available.get(factory)
+            if cached is not None and cached[0] == (file_key, path_key):
+                return cached[1]
+
+            available = []
+
+            for template in templates:
+                executable = template.attributes.get('executable')
+                if not executable:
+                    continue
+
+                for try_exec in template.try_exec_list + [executable]:
+                    if not executable_index.which(try_exec):
+                        break
+                else:
+                    available.append(template)
+
+            self._available[factory] = ((file_key, path_key), available)
+            return available
@@ -0,0 +1,218 @@
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from daemon_tools import CommandLineArgs, getAppConfigPath
+from executable_index import ExecutableIndex
+
+PROBE_TIMEOUT = 5
+
+instance = None
+
+def parseVersion(full_program_version):
+    #returns the first version number found in '--version' output
+    previous_is_digit = False
+    program_version = ''
+
+    for character in full_program_version:
+        if character.isdigit():
+            program_version+=character
+            previous_is_digit = True
+        elif character == '.':
+            if previous_is_digit:
+                program_version+=character
+            previous_is_digit = False
+        else:
+            if program_version:
+                break
+
+    return program_version.strip('.')
+
+def versionIsEnough(program_version, needed_version):
+    if not program_version:
+        return False
+
+    neededs = [int(n) for n in needed_version.split('.')]
+    progvss = [int(n) for n in program_version.split('.')]
+
+    return bool(neededs <= progvss)
+
+class VersionProber(QObject):
+    #runs 'executable --version' in worker threads, with a timeout.
+    #Executable is run as found in PATH (some binaries depend on the name
+    #they are called with). Versions are cached on disk, keyed by resolved
+    #binary path and its mtime and inode, so a binary is only probed again
+    #if it changed.
+    probed = pyqtSignal(str, str)
+
+    def __init__(self):
+        QObject.__init__(self)
+        self._cache = {}
+        self._pending = set()
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4)
+        self._cache_loaded = False
+
+        self.probed.connect(self.probeFinished)
+
+        global instance
+        instance = self
+
+    @staticmethod
+    def instance():
+        global instance
+
+        if not instance:
+            instance = VersionProber()
+        return instance
+
+    def cacheFilePath(self):
+        if CommandLineArgs.config_dir:
+            app_config_path = CommandLineArgs.config_dir
+        else:
+            app_config_path = getAppConfigPath()
+
+        return "%s/version_cache" % app_config_path
+
+    def _loadCache(self):
+        #each line is "mtime_ns inode version binary_path",
+        #version is '-' if no version was found.
+        self._cache_loaded = True
+
+        try:
+            file = open(self.cacheFilePath(), 'r')
+            contents = file.read()
+            file.close()
+        except:
+            return
+
+        for line in contents.split('\n'):
+            elements = line.split(' ', 3)
+            if (len(elements) != 4 or not elements[0].isdigit()
+                    or not elements[1].isdigit()):
+                continue
+
+            mtime_ns, inode, version, binary_path = elements
+            if version == '-':
+                version = ''
+
+            self._cache[binary_path] = (int(mtime_ns), int(inode), version)
+
+    def _saveCache(self):
+        contents = ''
+        for binary_path, values in self._cache.items():
+            mtime_ns, inode, version = values
+            contents += "%i %i %s %s\n" % (mtime_ns, inode,
+                                           version if version else '-',
+                                           binary_path)
+
+        cache_path = self.cacheFilePath()
+        tmp_path = "%s.tmp" % cache_path
+
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            file = open(tmp_path, 'w')
+            file.write(contents)
+            file.close()
+            os.replace(tmp_path, cache_path)
+        except:
+            return
+
+    def _binaryKey(self, path):
+        #returns resolved binary path, mtime and inode
+        if not path:
+            return None
+
+        binary_path = os.path.realpath(path)
+
+        try:
+            binary_stat = os.stat(binary_path)
+        except OSError:
+            return None
+
+        return (binary_path, binary_stat.st_mtime_ns, binary_stat.st_ino)
+
+    def _cachedVersion(self, binary_key):
+        if binary_key is None:
+            return ''
+
+        binary_path, mtime_ns, inode = binary_key
+
+        with self._lock:
+            if not self._cache_loaded:
+                self._loadCache()
+
+            cached = self._cache.get(binary_path)
+
+        if cached is not None and cached[:2] == (mtime_ns, inode):
+            return cached[2]
+
+        return None
+
+    def cachedVersion(self, executable):
+        #returns version if known, '' if binary has no version,
+        #None if binary has not been probed yet.
+        return self._cachedVersion(
+            self._binaryKey(ExecutableIndex.instance().which(executable)))
+
+    def _probe(self, path, binary_key):
+        binary_path, mtime_ns, inode = binary_key
+        program_version = ''
+        timed_out = False
+
+        try:
+            full_program_version = subprocess.run(
+                [path, '--version'],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                timeout=PROBE_TIMEOUT).stdout.decode(errors='replace')
+            program_version = parseVersion(full_program_version)
+        except subprocess.TimeoutExpired:
+            #binary may just be slow this time, it is not cached
+            timed_out = True
+        except:
+            pass
+
+        with self._lock:
+            self._pending.discard(binary_path)
+            if not timed_out:
+                self._cache[binary_path] = (mtime_ns, inode, program_version)
+                self._saveCache()
+
+        self.probed.emit(binary_path, program_version)
+
+    def probe(self, executable, callback=None, args=[]):
+        #calls callback(version, *args) in main thread once version is
+        #known, immediately if it is cached.
+        #Without callback, it only fills the cache,
+        #and it can be called from any thread.
+        path = ExecutableIndex.instance().which(executable)
+        binary_key = self._binaryKey(path)
+        program_version = self._cachedVersion(binary_key)
+
+        if program_version is not None:
+            if callback is not None:
+                callback(program_version, *args)
+            return
+
+        binary_path = binary_key[0]
+
+        if callback is not None:
+            if not binary_path in self._callbacks:
+                self._callbacks[binary_path] = []
+            self._callbacks[binary_path].append((callback, args))
+
+        with self._lock:
+            if binary_path in self._pending:
+                return
+            self._pending.add(binary_path)
+
+        self._executor.submit(self._probe, path, binary_key)
+
+    def probeFinished(self, binary_path, program_version):
+        for callback, args in self._callbacks.pop(binary_path, []):
+            callback(program_version, *args)
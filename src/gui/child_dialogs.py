@@ -124,10 +124,24 @@ class OpenSessionDialog(ChildDialog):
         
         self.ui.currentNsmFolder.setText(CommandLineArgs.session_root)
 
-        self._signaler.add_sessions_to_list.connect(self.addSessions)
+        #root of listed sessions, known with the first page
+        self.sessions_root = ''
+
+        #{session_name: (item, record)}, to update sizes sent later
+        self.session_items = {}
+
+        #session is prefetched only once selection stays on it,
+        #not for each session browsed with keyboard
+        self.prefetch_timer = QTimer()
+        self.prefetch_timer.setInterval(300)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.timeout.connect(self.prefetchSession)
+
+        self._signaler.sessions_page_received.connect(self.addSessionsPage)
+        self._signaler.session_size_received.connect(self.updateSessionSize)
         self._signaler.root_changed.connect(self.rootChanged)
 
-        self.toDaemon('/ray/server/list_sessions', 0)
+        self.requestSessionsPage('')
 
         if self.daemon_launched_before:
             self.ui.toolButtonFolder.setVisible(False)
@@ -154,16 +168,73 @@ class OpenSessionDialog(ChildDialog):
     def rootChanged(self, session_root):
         self.ui.currentNsmFolder.setText(session_root)
         self.ui.sessionList.clear()
-        self.toDaemon('/ray/server/list_sessions', 0)
+        self.session_items.clear()
+        self.f_last_session_item = None
+        self.sessions_root = session_root
+        self.requestSessionsPage('')
+
+    def requestSessionsPage(self, cursor):
+        #sessions are listed by pages, so a big root loads progressively
+        self.toDaemon('/ray/server/list_sessions_page', 50, 'name', cursor)
+
+    def addSessionsPage(self, session_root, next_cursor, records):
+        if self.sessions_root and session_root != self.sessions_root:
+            #page of a previous root
+            return
+
+        self.sessions_root = session_root
+
+        self.addSessions(records)
+
+        if next_cursor:
+            self.requestSessionsPage(next_cursor)
+
+    def updateSessionSize(self, session_root, session_name, size):
+        if (session_root != self.sessions_root
+                or not session_name in self.session_items):
+            return
+
+        item, record = self.session_items[session_name]
+        record[3] = size
+        item.setToolTip(self.sessionToolTip(*record[1:]))
+
+    def sessionToolTip(self, mtime, client_count, size, locked):
+        tooltip = _translate('open_session', "Modified: %s") \
+                    % time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime))
+        tooltip += "\n"
+        tooltip += _translate('open_session', "Clients: %i") % client_count
+
+        #size is -1 while daemon computes it
+        if size >= 1024 * 1024:
+            tooltip += "\n"
+            tooltip += _translate('open_session', "Size: %.1f GB") \
+                        % (size / (1024 * 1024))
+        elif size >= 0:
+            tooltip += "\n"
+            tooltip += _translate('open_session', "Size: %.1f MB") \
+                        % (size / 1024)
+
+        if locked:
+            tooltip += "\n"
+            tooltip += _translate('open_session',
+                                  "Locked, session is already open")
+
+        return tooltip
+
+    def addSessions(self, records):
+        for record in records:
+            session_name, mtime, client_count, size, locked = record
+            item = QListWidgetItem(session_name)
+            item.setToolTip(
+                self.sessionToolTip(mtime, client_count, size, locked))
+            self.session_items[session_name] = (item, list(record))
 
-    def addSessions(self, session_names):
-        for session_name in session_names:
             if session_name == RS.settings.value('last_session', type=str):
-                self.f_last_session_item = QListWidgetItem(session_name)
+                self.f_last_session_item = item
                 self.ui.sessionList.addItem(self.f_last_session_item)
                 self.ui.sessionList.setCurrentItem(self.f_last_session_item)
             else:
-                self.ui.sessionList.addItem(session_name)
+                self.ui.sessionList.addItem(item)
 
             self.ui.sessionList.sortItems()
 
@@ -228,6 +299,18 @@ class OpenSessionDialog(ChildDialog):
         self.has_selection = bool(item)
         self.preventOk()
 
+        if item:
+            self.prefetch_timer.start()
+        else:
+            self.prefetch_timer.stop()
+
+    def prefetchSession(self):
+        item = self.ui.sessionList.currentItem()
+
+        if item:
+            # daemon starts to read session files in case it is opened
+            self.toDaemon('/ray/server/prefetch_session', item.text())
+
     def preventOk(self):
         self.ui.buttonBox.button(QDialogButtonBox.Ok).setEnabled(
             bool(self.server_will_accept and self.has_selection))
@@ -518,6 +601,13 @@ class ClientPropertiesDialog(ChildDialog):
         self.ui.toolButtonIcon.setIcon(
             ray.getAppIcon(self.client.icon_name, self))
 
+        self.ui.lineEditCpuAffinity.setText(self.client.cpu_affinity)
+        self.ui.spinBoxNice.setValue(self.client.nice)
+        self.ui.comboBoxIoClass.setCurrentIndex(self.client.io_class)
+        self.ui.lineEditCgroupSlice.setText(self.client.cgroup_slice)
+        self.ui.spinBoxCpuQuota.setValue(self.client.cpu_quota)
+        self.ui.spinBoxMemoryMax.setValue(self.client.memory_max)
+
     def changeIconwithText(self, text):
         self.ui.toolButtonIcon.setIcon(ray.getAppIcon(text, self))
 
@@ -535,6 +625,14 @@ class ClientPropertiesDialog(ChildDialog):
         self.client.icon_name = self.ui.lineEditIcon.text()
         self.client.check_last_save = self.ui.checkBoxSaveStop.isChecked()
         self.client.sendPropertiesToDaemon()
+
+        self.client.cpu_affinity = self.ui.lineEditCpuAffinity.text()
+        self.client.nice = self.ui.spinBoxNice.value()
+        self.client.io_class = self.ui.comboBoxIoClass.currentIndex()
+        self.client.cgroup_slice = self.ui.lineEditCgroupSlice.text()
+        self.client.cpu_quota = self.ui.spinBoxCpuQuota.value()
+        self.client.memory_max = self.ui.spinBoxMemoryMax.value()
+        self.client.sendSchedulingToDaemon()
         # better for user to wait a little before close the window
         QTimer.singleShot(150, self.accept)
 
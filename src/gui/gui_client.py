@@ -21,6 +21,14 @@ class Client(object):
         self.capabilities    = client_data.capabilities
         self.check_last_save = client_data.check_last_save
 
+        # scheduling applied by daemon at client launch
+        self.cpu_affinity = ''
+        self.nice         = 0
+        self.io_class     = ray.IoClass.NONE
+        self.cgroup_slice = ''
+        self.cpu_quota    = 0
+        self.memory_max   = 0
+
         self.status = ray.ClientStatus.STOPPED
         self.previous_status = ray.ClientStatus.STOPPED
         self.hasGui = False
@@ -61,6 +69,9 @@ class Client(object):
     def setProgress(self, progress):
         self.widget.setProgress(progress)
 
+    def setStats(self, stats):
+        self.widget.setStats(*stats)
+
     def switch(self, new_client_id):
         self.client_id = new_client_id
         self.widget.updateClientData()
@@ -114,6 +125,27 @@ class Client(object):
                         self.capabilities,
                         int(self.check_last_save))
 
+    def setScheduling(self, scheduling):
+        (self.cpu_affinity, self.nice, self.io_class,
+         self.cgroup_slice, self.cpu_quota, self.memory_max) = scheduling
+
+    def sendSchedulingToDaemon(self):
+        server = GUIServerThread.instance()
+        if not server:
+            sys.stderr.write(
+                'Server not found. Client %s can not send its scheduling\n'
+                    % self.client_id)
+            return
+
+        server.toDaemon('/ray/client/set_scheduling',
+                        self.client_id,
+                        self.cpu_affinity,
+                        self.nice,
+                        self.io_class,
+                        self.cgroup_slice,
+                        self.cpu_quota,
+                        self.memory_max)
+
     def showPropertiesDialog(self):
         self.properties_dialog.updateContents()
         self.properties_dialog.show()
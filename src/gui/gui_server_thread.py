@@ -54,6 +54,41 @@ class GUIServerThread(ServerThread):
 
         self._signaler.add_sessions_to_list.emit(args)
 
+    @make_method('/reply_sessions_page', None)
+    def replySessionsPage(self, path, args):
+        self.debugg(path, args)
+
+        if len(args) < 2 or (len(args) - 2) % 5:
+            return
+
+        session_root, next_cursor = args[:2]
+        if not ray.areTheyAllString((session_root, next_cursor)):
+            return
+
+        records = []
+
+        #each record is name, mtime, client count, size in kB, locked
+        for i in range(2, len(args), 5):
+            record = args[i:i+5]
+            if type(record[0]) != str:
+                return
+
+            for arg in record[1:]:
+                if type(arg) != int:
+                    return
+
+            records.append(record)
+
+        self._signaler.sessions_page_received.emit(session_root,
+                                                   next_cursor, records)
+
+    @make_method('/reply_session_size', 'ssi')
+    def replySessionSize(self, path, args):
+        self.debugg(path, args)
+
+        #size in kB of a listed session, computed after its page was sent
+        self._signaler.session_size_received.emit(*args)
+
     @make_method('/reply_path', None)
     def replyPath(self, path, args):
         self.debugg(path, args)
@@ -187,6 +222,22 @@ class GUIServerThread(ServerThread):
 
         self._signaler.client_progress.emit(client_id, progress)
 
+    @make_method('/ray/client/stats', 'sfiii')
+    def guiClientStats(self, path, args):
+        self.debugg(path, args)
+
+        client_id, *stats = args
+
+        self._signaler.client_stats.emit(client_id, stats)
+
+    @make_method('/ray/client/scheduling', 'ssiisii')
+    def guiClientScheduling(self, path, args):
+        self.debugg(path, args)
+
+        client_id, *scheduling = args
+
+        self._signaler.client_scheduling.emit(client_id, scheduling)
+
     @make_method('/ray/client/dirty', 'si')
     def guiClientDirty(self, path, args):
         self.debugg(path, args)
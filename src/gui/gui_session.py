@@ -139,6 +139,16 @@ class Session(object):
         if client:
             client.setDirtyState(bool_dirty)
 
+    def setClientStats(self, client_id, stats):
+        client = self.getClient(client_id)
+        if client:
+            client.setStats(stats)
+
+    def setClientScheduling(self, client_id, scheduling):
+        client = self.getClient(client_id)
+        if client:
+            client.setScheduling(scheduling)
+
     def switchClient(self, old_client_id, new_client_id):
         client = self.getClient(old_client_id)
         if client:
@@ -21,12 +21,16 @@ class Signaler(QObject):
     client_status_changed = pyqtSignal(str, int)
     client_switched = pyqtSignal(str, str)
     client_progress = pyqtSignal(str, float)
+    client_stats = pyqtSignal(str, list)
+    client_scheduling = pyqtSignal(str, list)
     client_dirty_sig = pyqtSignal(str, bool)
     client_has_gui = pyqtSignal(str)
     client_gui_visible_sig = pyqtSignal(str, int)
     client_still_running = pyqtSignal(str)
     client_updated = pyqtSignal(object)
     add_sessions_to_list = pyqtSignal(list)
+    sessions_page_received = pyqtSignal(str, str, list)
+    session_size_received = pyqtSignal(str, str, int)
     new_executable = pyqtSignal(list)
     session_template_found = pyqtSignal(list)
     user_client_template_found = pyqtSignal(list)
@@ -251,6 +251,7 @@ class ClientSlot(QFrame):
             self.ui.killButton.setVisible(False)
 
             self.ui.saveButton.setIcon(self.saveIcon)
+            self.ui.lineEditClientStatus.setToolTip('')
 
         elif status == ray.ClientStatus.PRECOPY:
             self.ui.startButton.setEnabled(False)
@@ -313,6 +314,13 @@ class ClientSlot(QFrame):
     def setProgress(self, progress):
         self.ui.lineEditClientStatus.setProgress(progress)
 
+    def setStats(self, cpu, rss, read_rate, write_rate):
+        self.ui.lineEditClientStatus.setToolTip(
+            _translate('client_slot',
+                       "CPU: %.1f %%\nMemory: %.1f MB\nDisk: %i kB/s read, "
+                       "%i kB/s written")
+                % (cpu, rss / 1024, read_rate, write_rate))
+
     def contextMenuEvent(self, event):
         act_selected = self.menu.exec(self.mapToGlobal(event.pos()))
         event.accept()
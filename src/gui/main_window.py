@@ -97,6 +97,9 @@ class MainWindow(QMainWindow):
             self.bookmarkSessionFolderToggled)
         self.ui.actionDesktopsMemory.toggled.connect(
             self.desktopsMemoryToggled)
+        self.ui.actionCloneCopy.toggled.connect(self.cloneCopyToggled)
+        self.ui.actionVerifyCopy.toggled.connect(self.verifyCopyToggled)
+        self.ui.actionAutoSnapshot.toggled.connect(self.autoSnapshotToggled)
         self.ui.actionAboutRaySession.triggered.connect(self.aboutRaySession)
         self.ui.actionAboutQt.triggered.connect(QApplication.aboutQt)
 
@@ -114,6 +117,9 @@ class MainWindow(QMainWindow):
         self.controlMenu.addAction(self.ui.actionSaveAllFromSavedClient)
         self.controlMenu.addAction(self.ui.actionBookmarkSessionFolder)
         self.controlMenu.addAction(self.ui.actionDesktopsMemory)
+        self.controlMenu.addAction(self.ui.actionCloneCopy)
+        self.controlMenu.addAction(self.ui.actionVerifyCopy)
+        self.controlMenu.addAction(self.ui.actionAutoSnapshot)
 
         self.controlToolButton = self.ui.toolBar.widgetForAction(
             self.ui.actionControlMenu)
@@ -139,6 +145,8 @@ class MainWindow(QMainWindow):
         sg.client_dirty_sig.connect(self.serverSetsClientDirtyState)
         sg.client_switched.connect(self.serverSwitchesClient)
         sg.client_progress.connect(self.serverClientProgress)
+        sg.client_stats.connect(self.serverClientStats)
+        sg.client_scheduling.connect(self.serverClientScheduling)
         sg.client_still_running.connect(self.serverStillRunningClient)
         sg.client_updated.connect(self.serverUpdatesClientProperties)
         sg.new_message_sig.connect(self.serverPrintsMessage)
@@ -240,6 +248,12 @@ class MainWindow(QMainWindow):
             bool(options & ray.Option.BOOKMARK_SESSION))
         self.ui.actionDesktopsMemory.setChecked(
             bool(options & ray.Option.DESKTOPS_MEMORY))
+        self.ui.actionCloneCopy.setChecked(
+            bool(options & ray.Option.CLONE_COPY))
+        self.ui.actionVerifyCopy.setChecked(
+            bool(options & ray.Option.VERIFY_COPY))
+        self.ui.actionAutoSnapshot.setChecked(
+            bool(options & ray.Option.AUTO_SNAPSHOT))
 
         has_wmctrl = bool(options & ray.Option.HAS_WMCTRL)
         self.ui.actionDesktopsMemory.setEnabled(has_wmctrl)
@@ -278,6 +292,15 @@ class MainWindow(QMainWindow):
     def desktopsMemoryToggled(self, state):
         self.toDaemon('/ray/option/desktops_memory', int(state))
 
+    def cloneCopyToggled(self, state):
+        self.toDaemon('/ray/option/clone_copy', int(state))
+
+    def verifyCopyToggled(self, state):
+        self.toDaemon('/ray/option/verify_copy', int(state))
+
+    def autoSnapshotToggled(self, state):
+        self.toDaemon('/ray/option/auto_snapshot', int(state))
+
     def flashOpen(self):
         for client in self._session.client_list:
             if client.status == ray.ClientStatus.OPEN:
@@ -498,7 +521,7 @@ class MainWindow(QMainWindow):
         if not dialog.result():
             return
 
-        self.toDaemon('/ray/server/abort_copy')
+        self.toDaemon('/ray/client/abort_copy', client_id)
 
     def renameSession(self, new_session_name):
         self.toDaemon('/ray/session/rename', new_session_name)
@@ -592,6 +615,12 @@ class MainWindow(QMainWindow):
     def serverSetsClientDirtyState(self, client_id, bool_dirty):
         self._session.setClientDirtyState(client_id, bool_dirty)
 
+    def serverClientStats(self, client_id, stats):
+        self._session.setClientStats(client_id, stats)
+
+    def serverClientScheduling(self, client_id, scheduling):
+        self._session.setClientScheduling(client_id, scheduling)
+
     def serverStillRunningClient(self, client_id):
         self._session.clientIsStillRunning(client_id)
 
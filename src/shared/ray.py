@@ -4,9 +4,12 @@ import argparse
 import liblo
 import os
 import shlex
+import shutil
 import socket
+import stat
 import subprocess
 import sys
+import time
 from liblo import Server, Address
 from PyQt5.QtCore import QLocale, QTranslator, QT_VERSION_STR, QFile
 from PyQt5.QtGui import QIcon, QPalette
@@ -34,6 +37,14 @@ class PrefixMode:
     SESSION_NAME = 2
 
 
+class IoClass:
+    #same values as ionice classes
+    NONE        = 0
+    REALTIME    = 1
+    BEST_EFFORT = 2
+    IDLE        = 3
+
+
 class ClientStatus:
     STOPPED =  0
     LAUNCH  =  1
@@ -76,6 +87,9 @@ class Option:
     BOOKMARK_SESSION = 0x004
     HAS_WMCTRL       = 0x008
     DESKTOPS_MEMORY  = 0x010
+    CLONE_COPY       = 0x020
+    VERIFY_COPY      = 0x040
+    AUTO_SNAPSHOT    = 0x080
 
 
 class Err:
@@ -94,6 +108,8 @@ class Err:
     OPERATION_PENDING = -12
     COPY_RUNNING = -13
     NET_ROOT_RUNNING = -14
+    COPY_CORRUPTED = -15
+    SNAPSHOT_FAILED = -16
 
 
 class Command:
@@ -164,24 +180,121 @@ def getListInSettings(settings, path):
     return settings_list
 
 
-def isPidChildOf(child_pid, parent_pid):
-    if child_pid < parent_pid:
-        return False
+class ProcessTree:
+    # parents of all processes, read from /proc/*/stat in one pass.
+    # The map is kept for TTL seconds, so a batch of ancestry or
+    # descendants queries reads /proc only once, and no ps is forked.
+    TTL = 0.5
+
+    # pid: (ppid, cpu_ticks)
+    _processes = {}
+    _children = None
+    _read_time = 0.0
 
-    ppid = child_pid
-    this_pid = os.getpid()
+    @classmethod
+    def refresh(cls):
+        processes = {}
 
-    while ppid != parent_pid and ppid > 1 and ppid != this_pid:
         try:
-            ppid = int(subprocess.check_output(
-                ['ps', '-o', 'ppid=', '-p', str(ppid)]))
-        except BaseException:
-            return False
+            proc_entries = os.listdir('/proc')
+        except OSError:
+            proc_entries = []
 
-    if ppid == parent_pid:
-        return True
+        for entry in proc_entries:
+            if not entry.isdigit():
+                continue
 
-    return False
+            try:
+                with open('/proc/%s/stat' % entry, 'r') as file:
+                    contents = file.read()
+            except OSError:
+                # process finished meanwhile
+                continue
+
+            # process name may contain spaces and parenthesis
+            elements = contents[contents.rfind(')') + 2:].split()
+            if len(elements) < 13:
+                continue
+
+            try:
+                processes[int(entry)] = (
+                    int(elements[1]), int(elements[11]) + int(elements[12]))
+            except ValueError:
+                continue
+
+        cls._processes = processes
+        cls._children = None
+        cls._read_time = time.monotonic()
+
+    @classmethod
+    def _update(cls, max_age, pid=0):
+        # a pid unknown in map may be younger than the map
+        if (time.monotonic() - cls._read_time > max_age
+                or (pid and pid not in cls._processes)):
+            cls.refresh()
+
+    @classmethod
+    def parentOf(cls, pid, max_age=TTL):
+        cls._update(max_age, pid)
+        return cls._processes.get(pid, (0, 0))[0]
+
+    @classmethod
+    def cpuTicks(cls, pid, max_age=TTL):
+        cls._update(max_age, pid)
+        return cls._processes.get(pid, (0, 0))[1]
+
+    @classmethod
+    def findAncestor(cls, pid, ancestor_pids, max_age=TTL):
+        # returns the first pid of ancestor_pids found going up
+        # from pid (pid itself included), or 0.
+        cls._update(max_age, pid)
+
+        # parents map could be inconsistent, hops are limited
+        for i in range(len(cls._processes) + 1):
+            if pid in ancestor_pids:
+                return pid
+
+            if pid <= 1:
+                break
+
+            pid = cls._processes.get(pid, (0, 0))[0]
+
+        return 0
+
+    @classmethod
+    def isDescendantOf(cls, pid, ancestor_pid, max_age=TTL):
+        return bool(pid != ancestor_pid
+                    and cls.findAncestor(pid, (ancestor_pid,), max_age))
+
+    @classmethod
+    def descendants(cls, pid, max_age=TTL):
+        # returns pid and pids of all its descendants
+        cls._update(max_age)
+
+        if cls._children is None:
+            children = {}
+            for child_pid, (ppid, ticks) in cls._processes.items():
+                if ppid not in children:
+                    children[ppid] = []
+                children[ppid].append(child_pid)
+            cls._children = children
+
+        tree = []
+        to_visit = [pid]
+
+        while to_visit:
+            current = to_visit.pop()
+            tree.append(current)
+            to_visit += cls._children.get(current, [])
+
+        return tree
+
+
+def isPidChildOf(child_pid, parent_pid):
+    if child_pid < parent_pid:
+        return False
+
+    return bool(ProcessTree.findAncestor(child_pid, (parent_pid,)))
 
 
 def isOscPortFree(port):
@@ -397,6 +510,70 @@ def areTheyAllString(args):
     return True
 
 
+def writeFileAtomically(file_path, contents, backup=False):
+    # write contents to a temp file, fsync it and rename it to file_path,
+    # so file_path is never truncated or half written.
+    # With backup, previous file_path is kept as file_path.bak
+    tmp_path = "%s.tmp" % file_path
+    fd = -1
+
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+        # keep permissions of the replaced file
+        try:
+            os.fchmod(fd, stat.S_IMODE(os.stat(file_path).st_mode))
+        except FileNotFoundError:
+            pass
+
+        data = contents.encode()
+        while data:
+            data = data[os.write(fd, data):]
+        os.fsync(fd)
+        os.close(fd)
+        fd = -1
+
+        if backup and os.path.isfile(file_path):
+            bak_path = "%s.bak" % file_path
+            try:
+                if os.path.exists(tmp_path + '.bak'):
+                    os.remove(tmp_path + '.bak')
+                os.link(file_path, tmp_path + '.bak')
+                os.replace(tmp_path + '.bak', bak_path)
+            except OSError:
+                # no hard links on this filesystem
+                shutil.copy2(file_path, bak_path)
+
+        os.replace(tmp_path, file_path)
+
+        # make the rename itself durable
+        dir_fd = os.open(os.path.dirname(os.path.abspath(file_path)),
+                         os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except BaseException as e:
+        # temp file is removed whatever happened,
+        # only write errors are reported by returning False.
+        if fd >= 0:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        if os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+        if isinstance(e, (OSError, ValueError)):
+            return False
+        raise
+
+    return True
+
+
 def getAppIcon(icon_name, widget):
     dark = bool(
         widget.palette().brush(